@@ -0,0 +1,65 @@
+"""
+Micro-benchmark of agent buffer construction time versus agent count.
+Compares the vectorized build_agents with the old per pixel list building.
+run with: python -m benchmarks.agent_build
+"""
+import time
+
+import numpy as np
+
+from wallpaper_shaders.agents import build_agents, AGENT_DTYPE, AGENT_SINGLE_COLOR_DTYPE
+
+COLOR_TRESHOLD = (10, 10, 10, 255)
+MASK_SIZE = (3840, 2160)
+DENSITIES = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5)
+# the per pixel version is too slow to run on the denser masks
+LEGACY_MAX_AGENTS = 200_000
+
+
+def synthetic_mask(size, density, random_generator):
+    """Returns a RGBA mask with roughly density * width * height pixels above the treshold."""
+    mask = np.zeros((size[1], size[0], 4), dtype=np.uint8)
+    mask[..., 3] = 255
+    hit = random_generator.random((size[1], size[0])) < density
+    mask[hit, :3] = random_generator.integers(11, 256, (int(hit.sum()), 3), dtype=np.uint8)
+    return mask
+
+
+def build_agents_legacy(mask, color_treshold):
+    """Per pixel agent building as it was done in ComputeRender.__init__"""
+    agents = []
+    for cords in np.transpose(np.where(np.any(mask > color_treshold, axis=-1))):
+        y = mask.shape[0] - cords[0]
+        agents.extend((cords[1], y, 0.0, 0.0, 0.0, 0.0, cords[1], y))
+        agents.extend(mask[cords[0]][cords[1]] / 255)
+    return np.array(agents, dtype="f4")
+
+
+def timed(function, *args, repeat=3):
+    """Returns the best time of repeat calls and the result of the last one."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    random_generator = np.random.default_rng(0)
+    print(f"{'agents':>10} {'multicolor ms':>14} {'single ms':>10} {'legacy ms':>10} {'speedup':>8}")
+    for density in DENSITIES:
+        mask = synthetic_mask(MASK_SIZE, density, random_generator)
+        vectorized, agents = timed(build_agents, mask, COLOR_TRESHOLD, AGENT_DTYPE)
+        single, _ = timed(build_agents, mask, COLOR_TRESHOLD, AGENT_SINGLE_COLOR_DTYPE)
+        if len(agents) <= LEGACY_MAX_AGENTS:
+            legacy, legacy_agents = timed(build_agents_legacy, mask, COLOR_TRESHOLD, repeat=1)
+            assert np.array_equal(legacy_agents, agents.view("f4")), "layouts differ"
+            legacy_column = f"{legacy * 1000:10.1f} {legacy / vectorized:7.0f}x"
+        else:
+            legacy_column = f"{'-':>10} {'-':>8}"
+        print(f"{len(agents):>10} {vectorized * 1000:14.2f} {single * 1000:10.2f} {legacy_column}")
+
+
+if __name__ == "__main__":
+    main()
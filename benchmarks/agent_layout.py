@@ -0,0 +1,41 @@
+"""
+Frame time of the particle pass with every agent layout.
+Renders each script offscreen with the float, packed and packed_half layouts
+and prints the particle stage and whole frame times.
+run with: python -m benchmarks.agent_layout --size 1920 1080 --backend egl
+"""
+import argparse
+
+from wallpaper_shaders.agents import AGENT_LAYOUTS, AGENT_SINGLE_COLOR_LAYOUTS
+from wallpaper_shaders.benchmark import SCRIPTS, create_headless_render, run_benchmark, set_agent_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare agent layouts.")
+    parser.add_argument("--size", type=int, nargs=2, default=(1920, 1080))
+    parser.add_argument("--agents", type=int, default=None, help="resample the mask agents to this count")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--backend", default=None, help="moderngl context backend, e.g. egl")
+    values = parser.parse_args()
+
+    print(f"{'script':>30} {'layout':>12} {'bytes':>6} {'particles cpu/gpu ms':>21} {'frame ms':>9}")
+    for script in SCRIPTS:
+        layouts = AGENT_LAYOUTS if script == "pixel_particles" else AGENT_SINGLE_COLOR_LAYOUTS
+        for layout, dtype in layouts.items():
+            # settled agents are still simulated, so every frame does the same work
+            render = create_headless_render(script, tuple(values.size),
+                                            {"agent_layout": layout, "idle_after": 0}, values.backend)
+            if values.agents is not None:
+                set_agent_count(render, values.agents)
+            render.profiler.enabled = True
+            render.profiler.log_interval = 0
+            result = run_benchmark(render, values.frames)
+            render.close()
+            render.wnd.destroy()
+            cpu, gpu = render.profiler.averages()["particles"]
+            print(f"{script:>30} {layout:>12} {dtype.itemsize:>6} {cpu:10.3f}/{gpu or 0:10.3f} "
+                  f"{result['frame_time_ms']['mean']:9.3f}")
+
+
+if __name__ == "__main__":
+    main()
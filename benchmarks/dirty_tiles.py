@@ -0,0 +1,59 @@
+"""
+Diffuse time with and without dirty tiles.
+Renders each script offscreen with dirty tiles off and on, with and without the active
+list, and prints the diffuse stage and whole frame times and the fraction of the tiles
+diffused. The cursor moves during the first frames and rests after them, so the scene
+settles and more and more tiles are skipped.
+run with: python -m benchmarks.dirty_tiles --size 1920 1080 --backend egl
+"""
+import argparse
+import time
+
+from wallpaper_shaders.benchmark import (FRAME_TIME, SCRIPTS, create_headless_render, frame_statistics,
+                                         synthetic_mouse_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the diffuse pass with and without dirty tiles.")
+    parser.add_argument("--size", type=int, nargs=2, default=(1920, 1080))
+    parser.add_argument("--frames", type=int, default=1200)
+    parser.add_argument("--move-frames", type=int, default=60, help="frames the cursor moves at the start")
+    parser.add_argument("--backend", default=None, help="moderngl context backend, e.g. egl")
+    values = parser.parse_args()
+
+    print(f"{'script':>30} {'active':>6} {'dirty':>5} {'diffuse cpu/gpu ms':>21} {'tiles':>6} {'frame ms':>9}")
+    for script in SCRIPTS:
+        for active_list in (False, True):
+            for dirty_tiles in (False, True):
+                # settled agents keep being simulated unless idle stops the simulation
+                render = create_headless_render(
+                    script, tuple(values.size),
+                    {"dirty_tiles": dirty_tiles, "active_list": active_list, "idle_after": 0},
+                    values.backend
+                )
+                render.profiler.enabled = True
+                render.profiler.log_interval = 0
+                path = synthetic_mouse_path(render.window_size, values.move_frames)
+                frame_times = []
+                for frame in range(values.frames):
+                    if frame < len(path):
+                        render.mouse_position_event(*path[frame])
+                    elif frame == len(path):
+                        render.mouse_position_event(*path[-1][:2], 0, 0)
+                    start = time.perf_counter()
+                    render.render(frame * FRAME_TIME, FRAME_TIME)
+                    render.ctx.finish()
+                    frame_times.append(time.perf_counter() - start)
+                result = frame_statistics(render, frame_times)
+                render.close()
+                render.wnd.destroy()
+                diffuse_cpu, diffuse_gpu = render.profiler.averages()["diffuse"]
+                fraction = result.get("diffuse_tile_fraction")
+                print(f"{script:>30} {active_list!s:>6} {dirty_tiles!s:>5} "
+                      f"{diffuse_cpu:10.3f}/{diffuse_gpu or 0:10.3f} "
+                      f"{'' if fraction is None else f'{fraction:.3f}':>6} "
+                      f"{result['frame_time_ms']['mean']:9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Checks that the agents of the default mask settle after the cursor moved.
+Renders each script offscreen with and without the active list, swipes the cursor
+over the window and rests it, and prints after how many frames the render went idle.
+Exits with 1 if any of them still has moving agents after --frames.
+run with: python -m benchmarks.settle --size 1920 1080 --backend egl
+"""
+import argparse
+import sys
+
+from wallpaper_shaders.benchmark import FRAME_TIME, SCRIPTS, create_headless_render, synthetic_mouse_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that every agent settles and the render goes idle.")
+    parser.add_argument("--size", type=int, nargs=2, default=(1920, 1080))
+    parser.add_argument("--frames", type=int, default=3000, help="frames after which the render has to be idle")
+    parser.add_argument("--move-frames", type=int, default=60, help="frames the cursor moves at the start")
+    parser.add_argument("--backend", default=None, help="moderngl context backend, e.g. egl")
+    values = parser.parse_args()
+
+    failed = False
+    print(f"{'script':>30} {'active':>6} {'idle at':>8} {'moving':>7}")
+    for script in SCRIPTS:
+        for active_list in (False, True):
+            # idle_after of 0 in the config would never go idle
+            render = create_headless_render(script, tuple(values.size),
+                                            {"active_list": active_list, "idle_after": 60}, values.backend)
+            path = synthetic_mouse_path(render.window_size, values.move_frames)
+            idle_frame = None
+            for frame in range(values.frames):
+                if frame < len(path):
+                    render.mouse_position_event(*path[frame])
+                elif frame == len(path):
+                    render.mouse_position_event(*path[-1][:2], 0, 0)
+                render.render(frame * FRAME_TIME, FRAME_TIME)
+                if frame >= len(path) and render.settle.idle:
+                    idle_frame = frame
+                    break
+            moving = render.settle.moving_agents
+            render.close()
+            render.wnd.destroy()
+            failed = failed or idle_frame is None
+            print(f"{script:>30} {active_list!s:>6} {'never' if idle_frame is None else idle_frame:>8} {moving!s:>7}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
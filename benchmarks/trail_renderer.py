@@ -0,0 +1,53 @@
+"""
+Frame time of drawing the trails with the scatter and points trail renderers.
+Renders each script offscreen with both renderers at every agent count and prints
+the particle and point stage and whole frame times. Counts above the agents of the
+mask repeat them, so denser counts pile more agents onto the same pixels.
+run with: python -m benchmarks.trail_renderer --size 1920 1080 --agents 100000 1000000 --backend egl
+"""
+import argparse
+
+from wallpaper_shaders.benchmark import SCRIPTS, create_headless_render, run_benchmark, set_agent_count
+from wallpaper_shaders.points import TRAIL_RENDERERS
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare trail renderers.")
+    parser.add_argument("--size", type=int, nargs=2, default=(1920, 1080))
+    parser.add_argument("--agents", type=int, nargs="+", default=[None],
+                        help="resample the mask agents to these counts")
+    parser.add_argument("--splat-radius", type=int, default=0)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--backend", default=None, help="moderngl context backend, e.g. egl")
+    values = parser.parse_args()
+
+    print(f"{'script':>30} {'renderer':>9} {'agents':>9} {'particles cpu/gpu ms':>21} "
+          f"{'points cpu/gpu ms':>21} {'frame ms':>9}")
+    for script in SCRIPTS:
+        for count in values.agents:
+            for renderer in TRAIL_RENDERERS:
+                # settled agents are still simulated, so every frame does the same work
+                render = create_headless_render(
+                    script, tuple(values.size),
+                    {"trail_renderer": renderer, "splat_radius": values.splat_radius, "idle_after": 0},
+                    values.backend
+                )
+                if count is not None:
+                    set_agent_count(render, count)
+                render.profiler.enabled = True
+                render.profiler.log_interval = 0
+                result = run_benchmark(render, values.frames)
+                agents = render.count
+                render.close()
+                render.wnd.destroy()
+                averages = render.profiler.averages()
+                particles_cpu, particles_gpu = averages["particles"]
+                points_cpu, points_gpu = averages.get("points", (0.0, 0.0))
+                print(f"{script:>30} {renderer:>9} {agents:>9} "
+                      f"{particles_cpu:10.3f}/{particles_gpu or 0:10.3f} "
+                      f"{points_cpu:10.3f}/{points_gpu or 0:10.3f} "
+                      f"{result['frame_time_ms']['mean']:9.3f}")
+
+
+if __name__ == "__main__":
+    main()
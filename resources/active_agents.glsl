@@ -0,0 +1,69 @@
+#version 430 core
+
+#define ARGS_PASS 0 // 1 builds the indirect dispatch of the particle kernel instead of activating bins
+#define PARTICLE_GROUP_SIZE 16 // local_size_x of the particle kernel
+
+layout (local_size_x = 64, local_size_y = 1) in;
+
+layout (std430, binding = 5) buffer ActiveIn
+{
+    uint count_in;
+    uint agents_in[];
+} active_in;
+
+layout (std430, binding = 6) buffer ActiveOut
+{
+    uint count_out;
+    uint agents_out[];
+} active_out;
+
+// 0 resting, 1 in the active list, 2 added to the active list this frame
+layout (std430, binding = 7) buffer ActiveFlags
+{
+    uint state[];
+} flags;
+
+// agent indices sorted by the bin of their original position
+layout (std430, binding = 8) readonly buffer BinAgents
+{
+    uint agents[];
+} bin_agents;
+
+// agents of bin b are bin_agents.agents[offsets[b]..offsets[b+1]]
+layout (std430, binding = 9) readonly buffer BinOffsets
+{
+    uint offsets[];
+} bin_offsets;
+
+// bins close enough to the mouse to be pushed, one work group each
+layout (std430, binding = 10) readonly buffer HitBins
+{
+    uint bins[];
+} hit_bins;
+
+layout (std430, binding = 11) writeonly buffer DispatchArgs
+{
+    uint num_groups[3];
+} args;
+
+void main()
+{
+#if ARGS_PASS
+    if (gl_LocalInvocationIndex == 0){
+        args.num_groups[0] = (active_in.count_in + PARTICLE_GROUP_SIZE - 1) / PARTICLE_GROUP_SIZE;
+        args.num_groups[1] = 1;
+        args.num_groups[2] = 1;
+        active_out.count_out = 0;
+    }
+#else
+    uint bin = hit_bins.bins[gl_WorkGroupID.x];
+    uint end = bin_offsets.offsets[bin+1];
+    for (uint j = bin_offsets.offsets[bin]+gl_LocalInvocationID.x; j < end; j += gl_WorkGroupSize.x){
+        uint i = bin_agents.agents[j];
+        // agents already in the list keep their place
+        if (atomicCompSwap(flags.state[i], 0u, 2u) == 0u){
+            active_in.agents_in[atomicAdd(active_in.count_in, 1u)] = i;
+        }
+    }
+#endif
+}
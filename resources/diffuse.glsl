@@ -3,41 +3,151 @@
 #define DECAY vec4(0.01,0.01,0.01,0.0)
 #define DIFFUSE vec4(0.9,0.9,0.9,1.0)
 
-layout (local_size_x = 32, local_size_y = 32) in;
+#define LOCAL_SIZE_X 32
+#define LOCAL_SIZE_Y 32
+#define TILED 0 // 1 loads the tile and its 1 pixel border into shared memory once per work group
+#define SEPARABLE_PASS 0 // 1 horizontal sum into img_rows, 2 vertical sum of img_rows, 0 both at once
+#define DIRTY_TILES 0 // 1 diffuses only the tiles listed by dirty_tiles.glsl and marks the tiles it changed
+#define TILE_SIZE 32 // pixels of a dirty tile side, a multiple of the local sizes
+
+layout (local_size_x = LOCAL_SIZE_X, local_size_y = LOCAL_SIZE_Y) in;
 
 layout (binding = 0, rgba8) readonly uniform image2D img_input;
+#if SEPARABLE_PASS == 1
+layout (binding = 2, rgba16f) writeonly uniform image2D img_rows;
+#else
 layout (binding = 1, rgba8) writeonly uniform image2D img_output;
+#endif
+#if SEPARABLE_PASS == 2
+layout (binding = 2, rgba16f) readonly uniform image2D img_rows;
+#endif
+
+#if DIRTY_TILES
+// work groups of one dirty tile
+#define GROUPS_X (TILE_SIZE/LOCAL_SIZE_X)
+#define GROUPS_Y (TILE_SIZE/LOCAL_SIZE_Y)
+
+// tiles changed this step, cleared by the host before the step
+layout (std430, binding = 18) buffer TileMarks
+{
+    uint marks[];
+} tile_marks;
+
+// tiles to diffuse this step, x in the low 16 bits and y in the high, filled by dirty_tiles.glsl
+layout (std430, binding = 20) readonly buffer DirtyList
+{
+    uint count;
+    uint tiles[];
+} dirty_list;
+
+// the work group of a full dispatch this group stands in for
+uvec2 group_id(){
+    uint tile = dirty_list.tiles[gl_WorkGroupID.x/(GROUPS_X*GROUPS_Y)];
+    uint group = gl_WorkGroupID.x%(GROUPS_X*GROUPS_Y);
+    return uvec2(tile & 0xFFFFu, tile >> 16)*uvec2(GROUPS_X, GROUPS_Y) + uvec2(group%GROUPS_X, group/GROUPS_X);
+}
+
+void mark_tile(ivec2 pixel){
+    uint index = (pixel.y/TILE_SIZE)*((imageSize(img_input).x+TILE_SIZE-1)/TILE_SIZE) + pixel.x/TILE_SIZE;
+    // most pixels of a changed tile change, loading is cheaper than storing from all of them
+    if (tile_marks.marks[index] == 0u){
+        tile_marks.marks[index] = 1u;
+    }
+}
+#else
+uvec2 group_id(){
+    return gl_WorkGroupID.xy;
+}
+#endif
+
+// pixel of this invocation, set first thing in main
+ivec2 pos;
+
+#if TILED
+#define TILE_X (LOCAL_SIZE_X+2)
+#define TILE_Y (LOCAL_SIZE_Y+2)
+shared vec4 tile[TILE_Y][TILE_X];
+
+// pixel at offset from the pixel of this invocation
+vec4 load(ivec2 offset){
+    ivec2 local = ivec2(gl_LocalInvocationID.xy)+1+offset;
+    return tile[local.y][local.x];
+}
+#else
+vec4 load(ivec2 offset){
+    return imageLoad(img_input, pos+offset);
+}
+#endif
+
+#if SEPARABLE_PASS == 1
+vec4 row_blur(ivec2 pixel){
+    return (imageLoad(img_input, pixel+ivec2(-1, 0)) + imageLoad(img_input, pixel) + imageLoad(img_input, pixel+ivec2(1, 0)))/3.0;
+}
+#endif
 
 void main(void)
 {
     ivec2 IMAGE_SIZE = imageSize(img_input);
 
     //vec4 texel;
-    ivec2 pos = ivec2(gl_GlobalInvocationID.xy);
+    uvec2 group = group_id();
+    pos = ivec2(group*gl_WorkGroupSize.xy + gl_LocalInvocationID.xy);
 
-    if (pos.x > IMAGE_SIZE.x || pos.x < 0 || pos.y > IMAGE_SIZE.y || pos.y < 0){
+#if TILED
+    // every invocation loads a few pixels, outside of the image reads as 0 like imageLoad
+    ivec2 tile_origin = ivec2(group*gl_WorkGroupSize.xy)-1;
+    for (uint i = gl_LocalInvocationIndex; i < TILE_X*TILE_Y; i += LOCAL_SIZE_X*LOCAL_SIZE_Y){
+        ivec2 local = ivec2(i % TILE_X, i / TILE_X);
+        tile[local.y][local.x] = imageLoad(img_input, tile_origin+local);
+    }
+    barrier();
+#endif
+
+    // the last work groups overlap the edge of the image
+    if (pos.x >= IMAGE_SIZE.x || pos.y >= IMAGE_SIZE.y){
         return;
     }
 
-    vec4 og_color = imageLoad(img_input,pos);
+#if SEPARABLE_PASS == 1
+    imageStore(img_rows, pos, row_blur(pos));
+#if DIRTY_TILES
+    // the vertical pass of the tile also reads the rows next to it
+    if (pos.y%TILE_SIZE == 0){
+        imageStore(img_rows, pos+ivec2(0, -1), row_blur(pos+ivec2(0, -1)));
+    }
+    if (pos.y%TILE_SIZE == TILE_SIZE-1){
+        imageStore(img_rows, pos+ivec2(0, 1), row_blur(pos+ivec2(0, 1)));
+    }
+#endif
+#else
+    vec4 og_color = load(ivec2(0, 0));
 
-    vec4 color_sum = imageLoad(img_input,pos);
-    color_sum +=  imageLoad(img_input,pos+ivec2(-1,-1));
-    color_sum +=  imageLoad(img_input,pos+ivec2(-1, 0));
-    color_sum +=  imageLoad(img_input,pos+ivec2(-1, 1));
-    color_sum +=  imageLoad(img_input,pos+ivec2( 0,-1));
-    color_sum +=  imageLoad(img_input,pos+ivec2( 0, 1));
-    color_sum +=  imageLoad(img_input,pos+ivec2( 1,-1));
-    color_sum +=  imageLoad(img_input,pos+ivec2( 1, 0));
-    color_sum +=  imageLoad(img_input,pos+ivec2( 1, 1));
+#if SEPARABLE_PASS == 2
+    vec4 blured_color = (imageLoad(img_rows, pos+ivec2(0,-1)) + imageLoad(img_rows, pos) + imageLoad(img_rows, pos+ivec2(0, 1)))/3.0;
+#else
+    vec4 color_sum = load(ivec2( 0, 0));
+    color_sum +=  load(ivec2(-1,-1));
+    color_sum +=  load(ivec2(-1, 0));
+    color_sum +=  load(ivec2(-1, 1));
+    color_sum +=  load(ivec2( 0,-1));
+    color_sum +=  load(ivec2( 0, 1));
+    color_sum +=  load(ivec2( 1,-1));
+    color_sum +=  load(ivec2( 1, 0));
+    color_sum +=  load(ivec2( 1, 1));
 
     vec4 blured_color = (color_sum/9.0);
+#endif
     vec4 color;
     color = mix(og_color, blured_color, DIFFUSE);
 
 
-    imageStore(img_output, pos, vec4(clamp(color-DECAY,0.0,1.0)));
-    //imageStore(img_output, pos, og_color);
-    //barrier();
-    //memoryBarrierShared();
-}
\ No newline at end of file
+    color = clamp(color-DECAY,0.0,1.0);
+    imageStore(img_output, pos, color);
+#if DIRTY_TILES
+    // compared as stored, a tile that stopped changing is left alone from the next steps on
+    if (packUnorm4x8(color) != packUnorm4x8(og_color)){
+        mark_tile(pos);
+    }
+#endif
+#endif
+}
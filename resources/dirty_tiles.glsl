@@ -0,0 +1,71 @@
+#version 430 core
+
+#define ARGS_PASS 0 // 1 builds the indirect dispatch of the diffuse pass instead of listing tiles
+#define GROUPS_PER_TILE 1 // work groups of the diffuse pass covering one tile
+
+// The diffuse pass and everything drawing into the trails mark the tiles they change.
+// A tile is diffused while a mark is next to it, in the step after the mark and the one
+// after that, so both textures of the ping-pong hold the same settled tile before it is
+// left alone, and a settled tile is diffused again as soon as a change reaches its border.
+
+layout (local_size_x = 8, local_size_y = 8) in;
+
+// marks of the last step
+layout (std430, binding = 18) readonly buffer MarksLast
+{
+    uint marks[];
+} marks_last;
+
+// marks of the step before, cleared by the host after this pass for this step's marks
+layout (std430, binding = 19) readonly buffer MarksBefore
+{
+    uint marks[];
+} marks_before;
+
+// x in the low 16 bits and y in the high, count cleared by the host before this pass
+layout (std430, binding = 20) buffer DirtyList
+{
+    uint count;
+    uint tiles[];
+} dirty_list;
+
+layout (std430, binding = 21) writeonly buffer DispatchArgs
+{
+    uint num_groups[3];
+} args;
+
+// tiles of the image in x and y
+uniform ivec2 tiles;
+
+bool marked(ivec2 tile){
+    if (any(lessThan(tile, ivec2(0))) || any(greaterThanEqual(tile, tiles))){
+        return false;
+    }
+    uint index = tile.y*tiles.x + tile.x;
+    return (marks_last.marks[index] | marks_before.marks[index]) != 0u;
+}
+
+void main()
+{
+#if ARGS_PASS
+    if (gl_LocalInvocationIndex == 0){
+        args.num_groups[0] = dirty_list.count * GROUPS_PER_TILE;
+        args.num_groups[1] = 1;
+        args.num_groups[2] = 1;
+    }
+#else
+    ivec2 tile = ivec2(gl_GlobalInvocationID.xy);
+    if (tile.x >= tiles.x || tile.y >= tiles.y){
+        return;
+    }
+    // diffusing a tile reads one pixel of its neighbours
+    for (int y = -1; y <= 1; y++){
+        for (int x = -1; x <= 1; x++){
+            if (marked(tile+ivec2(x, y))){
+                dirty_list.tiles[atomicAdd(dirty_list.count, 1u)] = uint(tile.x) | (uint(tile.y) << 16);
+                return;
+            }
+        }
+    }
+#endif
+}
@@ -6,6 +6,16 @@
 #define PUSH 1.0 // push away from the mouse
 #define CLOSE_TRESHOLD 1.0 // How close point need to be to think they are in a right spot
 #define DRAG 0.99
+#define SETTLE_SPEED 4.0 // agents slower than this stop when they pass their original position, 0.0 never stops them
+#define SETTLE_RADIUS 8.0 // agents closer than this to their original position are slowed by SETTLE_DRAG
+#define SETTLE_DRAG 0.9 // drag on top of DRAG close to the original position
+#define ACTIVE_LIST 0 // 1 simulates only the agents in the active list, see active_agents.glsl
+#define PACKED 0 // 1 uses the packed Agent struct, the layouts are in agents.py
+#define HALF_VELOCITY 0 // 1 stores the velocity of the packed struct as half floats
+#define SCATTER_TRAILS 1 // 0 leaves drawing the agents into the trails to trail_points.glsl
+#define MASK_TARGETS 0 // 1 reads original positions and colors from the targets of an animated mask
+#define DIRTY_TILES 0 // 1 marks the tiles drawn into for the diffuse pass, see dirty_tiles.glsl
+#define TILE_SIZE 32 // pixels of a dirty tile side
 
 layout (local_size_x = 16, local_size_y = 1) in;
 
@@ -13,7 +23,22 @@ layout (binding = 1, rgba8) readonly uniform image2D img_input;//needs to be the
 layout (binding = 0, rgba8) writeonly uniform image2D img_output;
 
 uniform float agents_count;
+// agents draw squares of 2*splat_radius+1 pixels, covers the gaps between subsampled agents
+uniform int splat_radius;
 
+#if PACKED
+// only 4 byte members so the struct is not aligned to 8 bytes
+struct Agent
+{
+    float position[2];
+#if HALF_VELOCITY
+    uint velocity;
+#else
+    float velocity[2];
+#endif
+    uint original_postion; // x in the low 16 bits, y in the high
+};
+#else
 struct Agent
 {
     vec2 position;
@@ -22,12 +47,159 @@ struct Agent
     vec2 velocity;
     vec2 original_postion;
 };
+#endif
 
 layout (std430, binding = 2) buffer AgentsBlock
 {
     Agent agents[];
 } input_data;
 
+#if PACKED
+vec2 agent_position(uint i){
+    return vec2(input_data.agents[i].position[0], input_data.agents[i].position[1]);
+}
+
+vec2 agent_velocity(uint i){
+#if HALF_VELOCITY
+    return unpackHalf2x16(input_data.agents[i].velocity);
+#else
+    return vec2(input_data.agents[i].velocity[0], input_data.agents[i].velocity[1]);
+#endif
+}
+
+#if !MASK_TARGETS
+vec2 agent_original_postion(uint i){
+    uint bits = input_data.agents[i].original_postion;
+    return vec2(bits & 0xFFFFu, bits >> 16);
+}
+#endif
+
+
+void store_agent(uint i, vec2 position, vec2 velocity){
+    input_data.agents[i].position[0] = position.x;
+    input_data.agents[i].position[1] = position.y;
+#if HALF_VELOCITY
+    input_data.agents[i].velocity = packHalf2x16(velocity);
+#else
+    input_data.agents[i].velocity[0] = velocity.x;
+    input_data.agents[i].velocity[1] = velocity.y;
+#endif
+}
+#else
+vec2 agent_position(uint i){
+    return input_data.agents[i].position;
+}
+
+vec2 agent_velocity(uint i){
+    return input_data.agents[i].velocity;
+}
+
+#if !MASK_TARGETS
+vec2 agent_original_postion(uint i){
+    return input_data.agents[i].original_postion;
+}
+#endif
+
+
+void store_agent(uint i, vec2 position, vec2 velocity){
+    input_data.agents[i].position = position;
+    input_data.agents[i].velocity = velocity;
+}
+#endif
+
+#if MASK_TARGETS
+// where the agents flow to, the frame of an animated mask shown now, see animation.py
+struct Target
+{
+    vec2 position;
+    uint color; // rgba8
+    uint padding;
+};
+
+layout (std430, binding = 17) readonly buffer TargetsBlock
+{
+    Target targets[];
+} mask_targets;
+
+vec2 agent_original_postion(uint i){
+    return mask_targets.targets[i].position;
+}
+#endif
+
+// agents not resting on their original position, cleared by the host every frame
+layout (std430, binding = 4) buffer StatsBlock
+{
+    uint moving_agents;
+} stats;
+
+#if ACTIVE_LIST
+// agents simulated this frame, filled by active_agents.glsl
+layout (std430, binding = 5) buffer ActiveIn
+{
+    uint count_in;
+    uint agents_in[];
+} active_in;
+
+// agents still moving after this frame, simulated again next frame
+layout (std430, binding = 6) buffer ActiveOut
+{
+    uint count_out;
+    uint agents_out[];
+} active_out;
+
+// 0 resting, 1 in the active list, 2 added to the active list this frame
+layout (std430, binding = 7) buffer ActiveFlags
+{
+    uint state[];
+} flags;
+
+// pixels of the resting agents, drawn over the trails by view.glsl
+layout (binding = 5, rgba8) writeonly uniform image2D rest_image;
+#endif
+
+#if DIRTY_TILES
+// tiles changed this step, see dirty_tiles.glsl
+layout (std430, binding = 18) buffer TileMarks
+{
+    uint marks[];
+} tile_marks;
+
+// marks the tiles of the pixels from low to high
+void mark_tiles(ivec2 low, ivec2 high){
+    ivec2 size = imageSize(img_output);
+    ivec2 first = clamp(low, ivec2(0), size-1)/TILE_SIZE;
+    ivec2 last = clamp(high, ivec2(0), size-1)/TILE_SIZE;
+    int tiles_x = (size.x+TILE_SIZE-1)/TILE_SIZE;
+    for (int y = first.y; y <= last.y; y++){
+        for (int x = first.x; x <= last.x; x++){
+            tile_marks.marks[y*tiles_x + x] = 1u;
+        }
+    }
+}
+#endif
+
+// stores outside of the image are ignored
+void splat_output(ivec2 pixel, vec4 color){
+    for (int y = -splat_radius; y <= splat_radius; y++){
+        for (int x = -splat_radius; x <= splat_radius; x++){
+            imageStore(img_output, pixel+ivec2(x, y), color);
+        }
+    }
+#if DIRTY_TILES
+    mark_tiles(pixel-splat_radius, pixel+splat_radius);
+#endif
+}
+
+#if ACTIVE_LIST
+void splat_rest(ivec2 pixel, vec4 color){
+    for (int y = -splat_radius; y <= splat_radius; y++){
+        for (int x = -splat_radius; x <= splat_radius; x++){
+            imageStore(rest_image, pixel+ivec2(x, y), color);
+        }
+    }
+}
+#endif
+
 layout (binding = 3, rgba8) readonly uniform image2D mask;
 
 uniform vec2 mouse;
@@ -60,14 +232,28 @@ void main()
 
     //Do not execute if there are no more agents
     //Easy workaround around having to be precise with job count
+#if ACTIVE_LIST
+    if (gl_GlobalInvocationID.x >= active_in.count_in){
+        return;
+    }
+    uint i = active_in.agents_in[gl_GlobalInvocationID.x];
+#else
     uint i = gl_GlobalInvocationID.x;
-    if (i > agents_count){
+    if (i >= agents_count){
         return;
     }
+#endif
+
+    vec2 pos = agent_position(i);
+    float angle;
+    vec2 velocity = agent_velocity(i);
+    vec2 original_postion = agent_original_postion(i);
 
-    vec2 pos = input_data.agents[i].position;
-    float angle = input_data.agents[i].angle;
-    vec2 velocity = input_data.agents[i].velocity;
+#if ACTIVE_LIST
+    if (flags.state[i] == 2u){
+        splat_rest(ivec2(original_postion), vec4(0.0));
+    }
+#endif
 
     angle = angle_to_point(mouse, pos);
     float distance_mouse = distance_line(mouse, mouse-delta_mouse, pos);
@@ -76,17 +262,39 @@ void main()
     velocity += force*PUSH;//vec2(cos(-angle), sin(-angle))*force;
     //}
     //pull
-    float distance_original = distance(input_data.agents[i].original_postion, pos);
+    float distance_original = distance(original_postion, pos);
     if (distance_original > CLOSE_TRESHOLD){
-        angle = angle_to_point(input_data.agents[i].original_postion, pos);
+        angle = angle_to_point(original_postion, pos);
         velocity += vec2(cos(angle), sin(angle))*PULL;
     }
     
 
     velocity *= DRAG;
 
+    //with DRAG alone some agents keep swinging through or orbiting their original position forever,
+    //close to it they are slowed more and slow ones lose the sideways velocity, so they pass through it and stop
+    if (distance_original > CLOSE_TRESHOLD && distance_original < SETTLE_RADIUS){
+        velocity *= SETTLE_DRAG;
+        if (length(velocity) < SETTLE_SPEED){
+            vec2 direction = (original_postion-pos)/distance_original;
+            velocity = direction*dot(velocity, direction);
+        }
+    }
+
     vec2 newpos = pos+velocity;
 
+    //stop on the original position if this step passes close enough to it
+    vec2 step_delta = newpos-pos;
+    float along = clamp(dot(original_postion-pos, step_delta)/max(dot(step_delta, step_delta), 0.000001), 0.0, 1.0);
+    if (distance_original > 0.0 && length(velocity) < SETTLE_SPEED && distance(pos+step_delta*along, original_postion) <= CLOSE_TRESHOLD){
+        newpos = original_postion;
+        velocity = vec2(0.0);
+    }
+    bool moving = newpos != original_postion || velocity != vec2(0.0);
+    if (moving){
+        atomicAdd(stats.moving_agents, 1u);
+    }
+
     if (newpos.x>IMAGE_SIZE.x || newpos.x<0 || newpos.y>IMAGE_SIZE.y || newpos.y<0){
         newpos.x = min(IMAGE_SIZE.x-0.001,max(newpos.x-0.001, 0.0));
         newpos.y = min(IMAGE_SIZE.y-0.001,max(newpos.y-0.001, 0.0));
@@ -94,10 +302,28 @@ void main()
     else
     {
         vec4 prev_val = imageLoad(img_input, ivec2(newpos));
-        imageStore(img_output, ivec2(newpos), prev_val+vec4(0.01*distance_original/10, 0.0175, 0.205, 1.0)*2.75);
+        vec4 new_color = prev_val+vec4(0.01*distance_original/10, 0.0175, 0.205, 1.0)*2.75;
+#if SCATTER_TRAILS
+        splat_output(ivec2(newpos), new_color);
+#endif
+#if ACTIVE_LIST
+        if (!moving){
+            splat_rest(ivec2(newpos), new_color);
+        }
+#endif
         //imageStore(img_output, ivec2(newpos), vec4(0.8549, 0.398, 0.6745, 1.0)*0.5);
     }
-    input_data.agents[i].position = newpos;
-    input_data.agents[i].velocity = velocity;
+    store_agent(i, newpos, velocity);
+
+#if ACTIVE_LIST
+    if (moving){
+        flags.state[i] = 1u;
+        active_out.agents_out[atomicAdd(active_out.count_out, 1u)] = i;
+    }
+    else
+    {
+        flags.state[i] = 0u;
+    }
+#endif
 
 }
\ No newline at end of file
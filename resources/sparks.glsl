@@ -0,0 +1,179 @@
+#version 430 core
+
+#define EMIT_PASS 0 // 1 spawns sparks along the mouse line
+#define ARGS_PASS 0 // 1 builds the indirect dispatch of the update pass
+#define LIFETIME 90 // simulation steps a spark lives
+#define DRAG 0.95
+#define SPARK_COLOR vec4(1.0, 0.6, 0.2, 1.0)
+#define GROUP_SIZE 64 // local_size_x, the args pass divides by it
+#define DIRTY_TILES 0 // 1 marks the tiles drawn into for the diffuse pass, see dirty_tiles.glsl
+#define TILE_SIZE 32 // pixels of a dirty tile side
+
+// Sparks are short lived particles spawned by the cursor, independent of the mask agents.
+// They live in a fixed pool, the free list holds the unused slots and the live lists the
+// used ones. Dead sparks go back to the free list, so the pool is never reallocated and
+// the host never reads a count back.
+
+layout (local_size_x = GROUP_SIZE, local_size_y = 1) in;
+
+struct Spark
+{
+    vec2 position;
+    vec2 velocity;
+    vec4 color;
+    uint age;
+    uint padding[3];
+};
+
+layout (std430, binding = 12) buffer SparkPool
+{
+    Spark sparks[];
+} pool;
+
+// count can drop below 0 while the emit pass takes slots, it is restored by the losers
+layout (std430, binding = 13) buffer FreeList
+{
+    int count;
+    uint slots[];
+} free_list;
+
+// sparks updated this step, emitted sparks are added to it
+layout (std430, binding = 14) buffer LiveIn
+{
+    uint count_in;
+    uint sparks_in[];
+} live_in;
+
+// sparks still alive after this step
+layout (std430, binding = 15) buffer LiveOut
+{
+    uint count_out;
+    uint sparks_out[];
+} live_out;
+
+layout (std430, binding = 16) writeonly buffer DispatchArgs
+{
+    uint num_groups[3];
+} args;
+
+// agents not resting on their original position, live sparks keep the scene awake too
+layout (std430, binding = 4) buffer StatsBlock
+{
+    uint moving_agents;
+} stats;
+
+layout (binding = 0, rgba8) uniform image2D img_output;
+
+#if DIRTY_TILES
+// tiles changed this step, see dirty_tiles.glsl
+layout (std430, binding = 18) buffer TileMarks
+{
+    uint marks[];
+} tile_marks;
+
+// marks the tiles of the pixels from low to high
+void mark_tiles(ivec2 low, ivec2 high){
+    ivec2 size = imageSize(img_output);
+    ivec2 first = clamp(low, ivec2(0), size-1)/TILE_SIZE;
+    ivec2 last = clamp(high, ivec2(0), size-1)/TILE_SIZE;
+    int tiles_x = (size.x+TILE_SIZE-1)/TILE_SIZE;
+    for (int y = first.y; y <= last.y; y++){
+        for (int x = first.x; x <= last.x; x++){
+            tile_marks.marks[y*tiles_x + x] = 1u;
+        }
+    }
+}
+#endif
+
+uniform vec2 mouse;
+uniform vec2 delta_mouse;
+// sparks the emit pass spawns, at most one per invocation
+uniform int emit_count;
+// differs every step so the sparks of each step scatter differently
+uniform uint seed;
+uniform int splat_radius;
+
+// https://www.pcg-random.org/
+uint pcg_hash(uint x){
+    uint state = x * 747796405u + 2891336453u;
+    uint word = ((state >> ((state >> 28u) + 4u)) ^ state) * 277803737u;
+    return (word >> 22u) ^ word;
+}
+
+float random(inout uint state){
+    state = pcg_hash(state);
+    return float(state) / 4294967295.0;
+}
+
+void main()
+{
+#if EMIT_PASS
+    int j = int(gl_GlobalInvocationID.x);
+    if (j >= emit_count){
+        return;
+    }
+    int slot = atomicAdd(free_list.count, -1) - 1;
+    if (slot < 0){
+        // pool exhausted
+        atomicAdd(free_list.count, 1);
+        return;
+    }
+    uint i = free_list.slots[slot];
+
+    uint state = seed ^ pcg_hash(uint(j));
+    // along the line the mouse moved this frame, thrown forward with some spread
+    vec2 origin = mouse - delta_mouse*random(state);
+    float angle = atan(delta_mouse.y, delta_mouse.x) + (random(state)-0.5)*1.5;
+    float speed = length(delta_mouse)*(0.05 + 0.15*random(state));
+    pool.sparks[i].position = origin;
+    pool.sparks[i].velocity = vec2(cos(angle), sin(angle))*speed;
+    pool.sparks[i].color = SPARK_COLOR*(0.6 + 0.4*random(state));
+    // staggered so the sparks of one frame do not all die together
+    pool.sparks[i].age = uint(random(state)*LIFETIME*0.5);
+    live_in.sparks_in[atomicAdd(live_in.count_in, 1u)] = i;
+#elif ARGS_PASS
+    if (gl_LocalInvocationIndex == 0){
+        args.num_groups[0] = (live_in.count_in + GROUP_SIZE - 1) / GROUP_SIZE;
+        args.num_groups[1] = 1;
+        args.num_groups[2] = 1;
+        live_out.count_out = 0;
+    }
+#else
+    if (gl_GlobalInvocationID.x >= live_in.count_in){
+        return;
+    }
+    uint i = live_in.sparks_in[gl_GlobalInvocationID.x];
+    Spark spark = pool.sparks[i];
+    vec2 size = vec2(imageSize(img_output));
+    spark.age += 1u;
+    if (spark.age >= LIFETIME){
+        // retired, the slot can be emitted again next step
+        free_list.slots[atomicAdd(free_list.count, 1)] = i;
+        return;
+    }
+
+    spark.velocity *= DRAG;
+    spark.position += spark.velocity;
+    if (spark.position.x < 0.0 || spark.position.x >= size.x || spark.position.y < 0.0 || spark.position.y >= size.y){
+        spark.position = clamp(spark.position, vec2(0.0), size-0.001);
+        spark.velocity = vec2(0.0);
+    }
+    pool.sparks[i].position = spark.position;
+    pool.sparks[i].velocity = spark.velocity;
+    pool.sparks[i].age = spark.age;
+    live_out.sparks_out[atomicAdd(live_out.count_out, 1u)] = i;
+    atomicAdd(stats.moving_agents, 1u);
+
+    vec4 color = spark.color*(1.0 - float(spark.age)/LIFETIME);
+    ivec2 pixel = ivec2(spark.position);
+    for (int y = -splat_radius; y <= splat_radius; y++){
+        for (int x = -splat_radius; x <= splat_radius; x++){
+            // never darker than the trail below, stores outside of the image are ignored
+            imageStore(img_output, pixel+ivec2(x, y), max(imageLoad(img_output, pixel+ivec2(x, y)), color));
+        }
+    }
+#if DIRTY_TILES
+    mark_tiles(pixel-splat_radius, pixel+splat_radius);
+#endif
+#endif
+}
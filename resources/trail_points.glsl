@@ -0,0 +1,202 @@
+#version 430
+
+#define SINGLE_COLOR 0 // 1 for the agents of pixel_particles_single_color.glsl
+#define PACKED 0 // 1 uses the packed Agent struct, the layouts are in agents.py
+#define HALF_VELOCITY 0 // 1 stores the velocity of the packed struct as half floats
+#define ACTIVE_LIST 0 // 1 skips the resting agents, view.glsl draws them from the rest texture
+#define MASK_TARGETS 0 // 1 reads original positions and colors from the targets of an animated mask
+#define DIRTY_TILES 0 // 1 marks the tiles drawn into for the diffuse pass, see dirty_tiles.glsl
+#define TILE_SIZE 32 // pixels of a dirty tile side
+
+// Draws every agent as a point into the trail texture, instead of the imageStore scatter
+// of the particle kernels. Instance i is agent i, read straight from the agent buffer
+// the particle kernel just updated. Blending is additive, so agents landing on the same
+// pixel all add to it.
+
+#if defined VERTEX_SHADER
+
+#if PACKED
+struct Agent
+{
+    float position[2];
+#if HALF_VELOCITY
+    uint velocity;
+#else
+    float velocity[2];
+#endif
+    uint original_postion;
+#if !SINGLE_COLOR
+    uint color;
+#endif
+};
+#else
+struct Agent
+{
+    vec2 position;
+#if SINGLE_COLOR
+    float angle;
+    float padding;
+#else
+    vec2 padding;
+#endif
+    vec2 velocity;
+    vec2 original_postion;
+#if !SINGLE_COLOR
+    vec4 color;
+#endif
+};
+#endif
+
+layout (std430, binding = 2) readonly buffer AgentsBlock
+{
+    Agent agents[];
+} input_data;
+
+#if ACTIVE_LIST
+// 0 resting, see pixel_particles.glsl
+layout (std430, binding = 7) readonly buffer ActiveFlags
+{
+    uint state[];
+} flags;
+#endif
+
+uniform vec2 u_resolution;
+uniform int splat_radius;
+
+#if DIRTY_TILES
+// tiles changed this step, see dirty_tiles.glsl
+layout (std430, binding = 18) buffer TileMarks
+{
+    uint marks[];
+} tile_marks;
+
+// marks the tiles of the pixels from low to high
+void mark_tiles(ivec2 low, ivec2 high){
+    ivec2 size = ivec2(u_resolution);
+    ivec2 first = clamp(low, ivec2(0), size-1)/TILE_SIZE;
+    ivec2 last = clamp(high, ivec2(0), size-1)/TILE_SIZE;
+    int tiles_x = (size.x+TILE_SIZE-1)/TILE_SIZE;
+    for (int y = first.y; y <= last.y; y++){
+        for (int x = first.x; x <= last.x; x++){
+            tile_marks.marks[y*tiles_x + x] = 1u;
+        }
+    }
+}
+#endif
+
+out vec4 color;
+
+#if PACKED
+vec2 agent_position(uint i){
+    return vec2(input_data.agents[i].position[0], input_data.agents[i].position[1]);
+}
+
+vec2 agent_velocity(uint i){
+#if HALF_VELOCITY
+    return unpackHalf2x16(input_data.agents[i].velocity);
+#else
+    return vec2(input_data.agents[i].velocity[0], input_data.agents[i].velocity[1]);
+#endif
+}
+
+#if !MASK_TARGETS
+vec2 agent_original_postion(uint i){
+    uint bits = input_data.agents[i].original_postion;
+    return vec2(bits & 0xFFFFu, bits >> 16);
+}
+#endif
+
+#if !SINGLE_COLOR && !MASK_TARGETS
+vec4 agent_color(uint i){
+    return unpackUnorm4x8(input_data.agents[i].color);
+}
+#endif
+#else
+vec2 agent_position(uint i){
+    return input_data.agents[i].position;
+}
+
+vec2 agent_velocity(uint i){
+    return input_data.agents[i].velocity;
+}
+
+#if !MASK_TARGETS
+vec2 agent_original_postion(uint i){
+    return input_data.agents[i].original_postion;
+}
+#endif
+
+#if !SINGLE_COLOR && !MASK_TARGETS
+vec4 agent_color(uint i){
+    return input_data.agents[i].color;
+}
+#endif
+#endif
+
+#if MASK_TARGETS
+// where the agents flow to, the frame of an animated mask shown now, see animation.py
+struct Target
+{
+    vec2 position;
+    uint color; // rgba8
+    uint padding;
+};
+
+layout (std430, binding = 17) readonly buffer TargetsBlock
+{
+    Target targets[];
+} mask_targets;
+
+vec2 agent_original_postion(uint i){
+    return mask_targets.targets[i].position;
+}
+
+#if !SINGLE_COLOR
+vec4 agent_color(uint i){
+    return unpackUnorm4x8(mask_targets.targets[i].color);
+}
+#endif
+#endif
+
+void main() {
+    uint i = gl_InstanceID;
+    vec2 pos = agent_position(i);
+    // the kernel uses the distance before the step, the one after is close enough for the color
+    float distance_original = distance(agent_original_postion(i), pos);
+
+#if SINGLE_COLOR
+    color = vec4(0.01*distance_original/10, 0.0175, 0.205, 1.0)*2.75;
+#else
+    vec2 velocity = agent_velocity(i);
+    float cut_color = max((distance_original/u_resolution.x)*0.05 + (abs(velocity.x)+abs(velocity.y))*0.2, 1.0);
+    color = agent_color(i);
+    color.r *= cut_color;
+    color.g *= max(cut_color*0.5, 1.0);
+    color = clamp(color, 0.0, 1.0);
+#endif
+
+    // center of the pixel the kernel would store to
+    gl_Position = vec4((floor(pos)+0.5)/u_resolution*2.0-1.0, 0.0, 1.0);
+    gl_PointSize = float(2*splat_radius+1);
+#if ACTIVE_LIST
+    if (flags.state[i] == 0u){
+        // outside of the clip volume
+        gl_Position = vec4(2.0, 2.0, 2.0, 1.0);
+        return;
+    }
+#endif
+#if DIRTY_TILES
+    mark_tiles(ivec2(pos)-splat_radius, ivec2(pos)+splat_radius);
+#endif
+}
+
+#elif defined FRAGMENT_SHADER
+
+in vec4 color;
+out vec4 fragColor;
+
+void main() {
+    fragColor = color;
+}
+
+#endif
@@ -1,5 +1,7 @@
 #version 430
 
+#define REST_OVERLAY 0 // 1 draws the resting agents of the active list over the trails
+
 #if defined VERTEX_SHADER
 
 in vec3 in_position;
@@ -15,10 +17,16 @@ void main() {
 #elif defined FRAGMENT_SHADER
 
 uniform sampler2D texture0;
+#if REST_OVERLAY
+uniform sampler2D rest_texture;
+#endif
 out vec4 fragColor;
 in vec2 uv;
 void main() {
     fragColor = texture(texture0, uv);
+#if REST_OVERLAY
+    fragColor = max(fragColor, texture(rest_texture, uv));
+#endif
 }
 
 
@@ -7,16 +7,25 @@ import pathlib
 import logging
 import importlib
 import json
+import sys
+
+# first, so the startup clock includes the other imports
+from wallpaper_shaders.startup import STARTUP
+
 from pydantic import BaseSettings, ValidationError
 
 class Config(BaseSettings):
     script_name: str
 
 #needs to be also changed in common.py
-CONFIG_DIRECTORY = pathlib.PurePath(__file__, "../config/")
+CONFIG_DIRECTORY = pathlib.PurePath(__file__).parent.joinpath("config")
 SCRIPT_DIRECTORY = pathlib.PurePath("wallpaper_shaders")
 
 def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    # also parsed by the window, this only starts the report before the script is imported
+    STARTUP.enabled = "--profile-startup" in sys.argv
+    STARTUP.end("imports")
     try:
         with open(CONFIG_DIRECTORY.joinpath("config.json")) as file:
             config_json = json.load(file)
@@ -24,7 +33,8 @@ def main():
     except (ValidationError, json.JSONDecodeError) as error:
         logging.error("config.json is invalid", exc_info=error)
         raise
-    script = importlib.import_module("." + config.script_name, str(SCRIPT_DIRECTORY))
+    with STARTUP.phase("script imports"):
+        script = importlib.import_module("." + config.script_name, str(SCRIPT_DIRECTORY))
     script.main()
 
 
@@ -0,0 +1,124 @@
+"""
+Active agent list for the particle kernels.
+Resting agents are skipped, only agents pushed by the mouse and agents still
+moving are simulated. Agents are binned by their original position, every frame
+the bins close to the mouse line are activated on the GPU and the particle kernel
+is dispatched indirectly over the active list. Resting agents are drawn from a
+rest texture the kernel keeps up to date.
+"""
+from typing import Tuple
+
+import moderngl
+import numpy as np
+
+from wallpaper_shaders.agents import SINGLE_COLOR_TRAIL, to_unorm8
+
+
+class ActiveAgents:
+    """
+    Buffers and passes of the active list, bound to the bindings used by
+    active_agents.glsl and the ACTIVE_LIST branch of the particle kernels.
+    Mouse pushes weaker than config.active_min_force do not activate agents.
+    """
+
+    def __init__(self, ctx: moderngl.Context, agents: np.ndarray, size: Tuple[int, int], config,
+                 activate_shader: moderngl.ComputeShader, args_shader: moderngl.ComputeShader,
+                 splat_radius: int = 0):
+        self.ctx = ctx
+        self.size = size
+        self.bin_size = config.active_bin_size
+        self.push = config.push
+        self.min_force = config.active_min_force
+        self.activate_shader = activate_shader
+        self.args_shader = args_shader
+
+        original = agents["original_postion"]
+        bins_x = -(-size[0] // self.bin_size)
+        bins_y = -(-size[1] // self.bin_size) + 1  # original y goes up to the height
+        cells = np.clip(original // self.bin_size, 0, (bins_x - 1, bins_y - 1)).astype(np.int64)
+        agent_bins = cells[:, 1] * bins_x + cells[:, 0]
+        order = np.argsort(agent_bins, kind="stable").astype(np.uint32)
+        offsets = np.zeros(bins_x * bins_y + 1, dtype=np.uint32)
+        np.cumsum(np.bincount(agent_bins, minlength=bins_x * bins_y), out=offsets[1:])
+
+        # only bins with agents are ever activated
+        self.bins = np.flatnonzero(np.diff(offsets)).astype(np.uint32)
+        self.centers = (np.stack((self.bins % bins_x, self.bins // bins_x), axis=1) + 0.5) * self.bin_size
+        self.half_diagonal = self.bin_size * np.sqrt(0.5)
+
+        self.bin_agents = ctx.buffer(order)
+        self.bin_offsets = ctx.buffer(offsets)
+        self.hit_bins = ctx.buffer(reserve=max(len(self.bins), 1) * 4)
+        self.flags = ctx.buffer(reserve=max(len(agents), 1) * 4)
+        # count followed by agent indices, swapped every frame
+        self.lists = [ctx.buffer(reserve=(len(agents) + 1) * 4) for _ in range(2)]
+        self.args = ctx.buffer(reserve=3 * 4)
+        for buffer in self.lists:
+            buffer.clear()
+
+        # agents away from their original position, e.g. resumed from a snapshot, start in the list
+        moving = (np.any(agents["position"] != original, axis=1)
+                  | np.any(agents["velocity"] != 0, axis=1))
+        moving_agents = np.flatnonzero(moving).astype(np.uint32)
+        self.flags.write(moving.astype(np.uint32))
+        self.lists[0].write(np.concatenate(([len(moving_agents)], moving_agents)).astype(np.uint32))
+
+        # the other agents rest, drawn at their original position
+        if "color" in agents.dtype.names and agents.dtype["color"].base == np.uint8:
+            colors = agents["color"]
+        elif "color" in agents.dtype.names:
+            colors = to_unorm8(agents["color"])
+        else:
+            colors = np.broadcast_to(to_unorm8(SINGLE_COLOR_TRAIL), (len(agents), 4))
+        rest = np.zeros((size[1], size[0], 4), dtype=np.uint8)
+        pixels = original.astype(np.int64)
+        # the same squares the kernels splat
+        for offset_y in range(-splat_radius, splat_radius + 1):
+            for offset_x in range(-splat_radius, splat_radius + 1):
+                x, y = pixels[:, 0] + offset_x, pixels[:, 1] + offset_y
+                inside = (x >= 0) & (x < size[0]) & (y >= 0) & (y < size[1]) & ~moving
+                rest[y[inside], x[inside]] = colors[inside]
+        self.rest_texture = ctx.texture(size, 4, rest)
+        self.rest_texture.filter = moderngl.NEAREST, moderngl.NEAREST
+
+    def hit(self, mouse: np.ndarray, delta_mouse: np.ndarray) -> np.ndarray:
+        """Returns bins that may hold agents pushed harder than min_force, same distance as the kernels."""
+        length = np.hypot(delta_mouse[0], delta_mouse[1])
+        if length == 0:
+            return self.bins[:0]
+        radius = length * self.push / self.min_force
+        distance = np.abs(delta_mouse[0] * (mouse[1] - self.centers[:, 1])
+                          - (mouse[0] - self.centers[:, 0]) * delta_mouse[1]) / length
+        return self.bins[distance <= radius + self.half_diagonal]
+
+    def run(self, pixel_shader: moderngl.ComputeShader, mouse, delta_mouse):
+        """Activates the bins hit by the mouse and runs pixel_shader over the active list."""
+        active_in, active_out = self.lists
+        active_in.bind_to_storage_buffer(5)
+        active_out.bind_to_storage_buffer(6)
+        self.flags.bind_to_storage_buffer(7)
+        self.bin_agents.bind_to_storage_buffer(8)
+        self.bin_offsets.bind_to_storage_buffer(9)
+        self.hit_bins.bind_to_storage_buffer(10)
+        self.args.bind_to_storage_buffer(11)
+        self.rest_texture.bind_to_image(5, read=False, write=True)
+
+        # the previous particle pass wrote the list and the flags
+        self.ctx.memory_barrier()
+        hit = self.hit(np.asarray(mouse, dtype=np.float64), np.asarray(delta_mouse, dtype=np.float64))
+        if len(hit):
+            self.hit_bins.write(hit)
+            self.activate_shader.run(len(hit), 1, 1)
+            self.ctx.memory_barrier()
+        self.args_shader.run(1, 1, 1)
+        self.ctx.memory_barrier()
+        pixel_shader.run_indirect(self.args)
+
+        # agents still moving are the input of the next frame
+        self.lists.reverse()
+
+    def release(self):
+        # the shaders belong to the shader cache they were loaded from
+        for buffer in (self.bin_agents, self.bin_offsets, self.hit_bins, self.flags, self.args, *self.lists):
+            buffer.release()
+        self.rest_texture.release()
@@ -0,0 +1,182 @@
+"""
+NumPy layouts of the GLSL ``Agent`` structs and vectorized agent buffer construction.
+Field order and padding of the dtypes must match the std430 structs in resources/.
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+
+# struct Agent in pixel_particles.glsl, 48 bytes
+AGENT_DTYPE = np.dtype([
+    ("position", "<f4", 2),
+    ("padding", "<f4", 2),
+    ("velocity", "<f4", 2),
+    ("original_postion", "<f4", 2),
+    ("color", "<f4", 4),
+])
+
+# struct Agent in pixel_particles_single_color.glsl, 32 bytes
+AGENT_SINGLE_COLOR_DTYPE = np.dtype([
+    ("position", "<f4", 2),
+    ("angle", "<f4"),
+    ("padding", "<f4"),
+    ("velocity", "<f4", 2),
+    ("original_postion", "<f4", 2),
+])
+
+
+# PACKED structs, original position as a uint16 pair and color as rgba8,
+# unpacked in the shaders with bit operations and unpackUnorm4x8
+AGENT_PACKED_DTYPE = np.dtype([
+    ("position", "<f4", 2),
+    ("velocity", "<f4", 2),
+    ("original_postion", "<u2", 2),
+    ("color", "u1", 4),
+])
+
+AGENT_SINGLE_COLOR_PACKED_DTYPE = np.dtype([
+    ("position", "<f4", 2),
+    ("velocity", "<f4", 2),
+    ("original_postion", "<u2", 2),
+])
+
+# PACKED and HALF_VELOCITY, velocity as half floats read with unpackHalf2x16
+AGENT_PACKED_HALF_DTYPE = np.dtype([
+    ("position", "<f4", 2),
+    ("velocity", "<f2", 2),
+    ("original_postion", "<u2", 2),
+    ("color", "u1", 4),
+])
+
+AGENT_SINGLE_COLOR_PACKED_HALF_DTYPE = np.dtype([
+    ("position", "<f4", 2),
+    ("velocity", "<f2", 2),
+    ("original_postion", "<u2", 2),
+])
+
+# agent_layout config value -> dtype
+AGENT_LAYOUTS = {
+    "float": AGENT_DTYPE,
+    "packed": AGENT_PACKED_DTYPE,
+    "packed_half": AGENT_PACKED_HALF_DTYPE,
+}
+AGENT_SINGLE_COLOR_LAYOUTS = {
+    "float": AGENT_SINGLE_COLOR_DTYPE,
+    "packed": AGENT_SINGLE_COLOR_PACKED_DTYPE,
+    "packed_half": AGENT_SINGLE_COLOR_PACKED_HALF_DTYPE,
+}
+
+# color added by pixel_particles_single_color.glsl per agent, .r is scaled by distance
+SINGLE_COLOR_TRAIL = np.array((0.0, 0.0175, 0.205, 1.0), dtype=np.float32) * np.float32(2.75)
+
+
+def layout_defines(layout: str) -> dict:
+    """PACKED and HALF_VELOCITY defines of the particle kernels for an agent_layout."""
+    return {
+        "PACKED": "0" if layout == "float" else "1",
+        "HALF_VELOCITY": "1" if layout == "packed_half" else "0",
+    }
+
+
+def to_unorm8(color: np.ndarray) -> np.ndarray:
+    """Converts floats the way imageStore converts them into a rgba8 image."""
+    return np.rint(np.clip(color, 0.0, 1.0) * np.float32(255)).astype(np.uint8)
+
+
+def unpack_agents(agents: np.ndarray) -> np.ndarray:
+    """Returns a copy of agents in the float layout with the same color mode."""
+    if "color" in agents.dtype.names:
+        unpacked = np.zeros(len(agents), dtype=AGENT_DTYPE)
+        if agents.dtype["color"].base == np.uint8:
+            unpacked["color"] = agents["color"] / np.float32(255)
+        else:
+            unpacked["color"] = agents["color"]
+    else:
+        unpacked = np.zeros(len(agents), dtype=AGENT_SINGLE_COLOR_DTYPE)
+        if "angle" in agents.dtype.names:
+            unpacked["angle"] = agents["angle"]
+    for name in ("position", "velocity", "original_postion"):
+        unpacked[name] = agents[name]
+    return unpacked
+
+
+def bayer_matrix(size: int) -> np.ndarray:
+    """Ordered dither matrix of size x size, size a power of two, values 0 to size*size-1."""
+    matrix = np.zeros((1, 1), dtype=np.int64)
+    while len(matrix) < size:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]])
+    return matrix
+
+
+DITHER = bayer_matrix(16)
+
+
+def agent_priorities(agents: np.ndarray) -> np.ndarray:
+    """
+    Sampling order of agents, the agents with the n lowest priorities are spread evenly over the mask.
+    The ordered dither level of the original position comes first and a hash of it breaks ties.
+    """
+    position = agents["original_postion"].astype(np.int64)
+    x, y = position[:, 0], position[:, 1]
+    level = DITHER[y % len(DITHER), x % len(DITHER)]
+    hashed = (x.astype(np.uint32) * np.uint32(0x8DA6B343)) ^ (y.astype(np.uint32) * np.uint32(0xD8163841))
+    hashed ^= hashed >> np.uint32(13)
+    hashed *= np.uint32(0x85EBCA6B)
+    hashed ^= hashed >> np.uint32(16)
+    return level + hashed / np.float64(2 ** 32)
+
+
+def sample_agents(agents: np.ndarray, count: int) -> Optional[np.ndarray]:
+    """
+    Returns sorted indices of count agents spread evenly over the mask, None if count covers all.
+    Samples are nested, a larger count keeps every agent of a smaller one.
+    """
+    if count >= len(agents):
+        return None
+    priorities = agent_priorities(agents)
+    return np.sort(np.argpartition(priorities, count)[:count])
+
+
+def splat_radius(radius, total: int, count: int) -> int:
+    """splat_radius config value for count of total agents, auto covers the gaps between samples."""
+    if radius != "auto":
+        return radius
+    # side of the splat close to the mean distance of the samples
+    return int(round((np.sqrt(total / max(count, 1)) - 1) / 2))
+
+
+def mask_coordinates(mask: np.ndarray,
+                     color_treshold: Tuple[int, int, int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns (rows, columns) of all mask pixels with any channel above color_treshold."""
+    # per channel comparisons are several times faster than np.any over the last axis
+    above = mask[..., 0] > color_treshold[0]
+    for channel in range(1, mask.shape[-1]):
+        above |= mask[..., channel] > color_treshold[channel]
+    return np.nonzero(above)
+
+
+def build_agents(mask: np.ndarray, color_treshold: Tuple[int, int, int, int],
+                 dtype: np.dtype = AGENT_DTYPE,
+                 random_generator: Optional[np.random.Generator] = None) -> np.ndarray:
+    """
+    Builds the whole agent buffer from a RGBA mask in one pass.
+    Returns a structured array of dtype that can be passed directly to ctx.buffer.
+    """
+    rows, columns = mask_coordinates(mask, color_treshold)
+    agents = np.zeros(len(rows), dtype=dtype)
+
+    # numpy rows go top to bottom, GL y goes bottom to top
+    agents["position"][:, 0] = columns
+    agents["position"][:, 1] = mask.shape[0] - rows
+    agents["original_postion"] = agents["position"]
+
+    if "color" in dtype.names:
+        if dtype["color"].base == np.uint8:
+            agents["color"] = mask[rows, columns]
+        else:
+            agents["color"] = mask[rows, columns] / np.float32(255)
+    if "angle" in dtype.names:
+        if random_generator is None:
+            random_generator = np.random.default_rng()
+        agents["angle"] = random_generator.random(len(agents), dtype=np.float32) * np.float32(2 * np.pi)
+    return agents
@@ -0,0 +1,288 @@
+"""
+Animated masks and playlists. The image of a config can be an animated GIF or APNG
+or a directory of frames, and a playlist shows several images for a time each.
+Frames are decoded and turned into agent targets, the position and color every agent
+flows to, on a background thread a few frames ahead. The targets are uploaded into a
+double-buffered buffer the particle kernels read in place of the original position
+and color of the agents (MASK_TARGETS), so agents flow into every new shape without
+being rebuilt and the render loop never waits for a decode.
+The frames and durations of an animated image are read on that thread as well, the
+window only reads image headers and lists frame directories.
+"""
+import collections
+import logging
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import moderngl
+import numpy as np
+
+from wallpaper_shaders.agents import mask_coordinates
+from wallpaper_shaders.common import image_path
+
+# struct Target of the particle kernels and trail_points.glsl, 16 bytes
+TARGET_DTYPE = np.dtype([
+    ("position", "<f4", 2),
+    ("color", "u1", 4),
+    ("padding", "<u4"),
+])
+
+# files of a frame directory, sorted by name
+FRAME_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".webp")
+
+
+class MaskFrame(NamedTuple):
+    path: str
+    # frame of an animated image
+    index: int
+    # seconds the frame is shown
+    duration: float
+
+
+class MaskSource(NamedTuple):
+    path: str
+    # frames of a directory or still image, None for an animated image, see animated_frames
+    frames: Optional[List[MaskFrame]]
+    # seconds a playlist entry is shown, None for the image of a config without playlist
+    duration: Optional[float]
+
+    @property
+    def first_frame(self) -> MaskFrame:
+        return self.frames[0] if self.frames is not None else MaskFrame(self.path, 0, 0.0)
+
+
+def directory_frames(path: str, frame_time: float) -> List[MaskFrame]:
+    return [MaskFrame(os.path.join(path, file), 0, frame_time)
+            for file in sorted(os.listdir(path)) if file.lower().endswith(FRAME_EXTENSIONS)]
+
+
+def animated_frames(path: str, frame_time: float) -> List[MaskFrame]:
+    """
+    Frames of an animated image, seeking to each of them decodes the whole animation.
+    Frames without a duration of their own are shown for frame_time seconds.
+    """
+    from PIL import Image
+
+    frames = []
+    with Image.open(path) as image:
+        for index in range(getattr(image, "n_frames", 1)):
+            image.seek(index)
+            # milliseconds, missing or 0 in many files
+            duration = image.info.get("duration") or frame_time * 1000
+            frames.append(MaskFrame(path, index, duration / 1000))
+    return frames
+
+
+def check_image(name: str):
+    """Raises ValueError unless name is a readable image or a directory of frames, only headers are read."""
+    from PIL import Image
+
+    path = image_path(name)
+    if os.path.isdir(path):
+        if not directory_frames(path, 0.0):
+            raise ValueError("Image directory has no frames.")
+        return
+    try:
+        Image.open(path).close()
+    except FileNotFoundError:
+        raise ValueError("Image not found.")
+    except (OSError, ValueError, TypeError):
+        raise ValueError("Error while loading the Image")
+
+
+def mask_source(name: str, frame_time: float, duration: Optional[float] = None) -> MaskSource:
+    """Source of an image, animated image or directory of images in the images directory."""
+    from PIL import Image
+
+    path = image_path(name)
+    if os.path.isdir(path):
+        frames = directory_frames(path, frame_time)
+        if not frames:
+            raise ValueError(f"{name} has no frames.")
+        return MaskSource(path, frames, duration)
+    # only the header is read
+    with Image.open(path) as image:
+        animated = getattr(image, "is_animated", False)
+    return MaskSource(path, None if animated else [MaskFrame(path, 0, frame_time)], duration)
+
+
+def mask_sources(image: str, playlist: Sequence[Tuple[str, float]], frame_time: float) -> List[MaskSource]:
+    """Sources to show in a loop, image or the playlist entries, each for its duration in seconds."""
+    if not playlist:
+        return [mask_source(image, frame_time)]
+    return [mask_source(name, frame_time, duration) for name, duration in playlist]
+
+
+def is_animated(sources: Sequence[MaskSource]) -> bool:
+    return len(sources) > 1 or sources[0].frames is None or len(sources[0].frames) > 1
+
+
+def looped_frames(sources: Sequence[MaskSource], frame_time: float) -> Iterator[MaskFrame]:
+    """
+    Frames of sources shown in a loop, an entry of a playlist shows its image for its
+    duration and animations repeat until it is over.
+    The frames of animated images are read the first time they are shown.
+    """
+    entries = [source.frames for source in sources]
+    while True:
+        for number, source in enumerate(sources):
+            if entries[number] is None:
+                try:
+                    entries[number] = animated_frames(source.path, frame_time)
+                except (OSError, ValueError) as error:
+                    # shown as a still image, decode_frame logs whether it is readable at all
+                    logging.warning("Could not read the frames of %s: %s", source.path, error)
+                    entries[number] = [source.first_frame._replace(duration=frame_time)]
+            entry = entries[number]
+            if source.duration is None:
+                yield from entry
+            elif len(entry) == 1:
+                yield entry[0]._replace(duration=source.duration)
+            else:
+                shown = 0.0
+                while shown < source.duration:
+                    for frame in entry:
+                        yield frame
+                        shown += frame.duration
+                        if shown >= source.duration:
+                            break
+
+
+def decode_frame(frame: MaskFrame, size: Tuple[int, int]) -> np.ndarray:
+    """Returns the RGBA mask of frame resized with padding to size."""
+    from PIL import Image
+    from wallpaper_shaders.utils import resize_with_padding
+
+    with Image.open(frame.path) as image:
+        image.seek(frame.index)
+        # palette frames of animations are converted to the RGBA the agents are built from
+        return np.asarray(resize_with_padding(image.convert("RGBA"), size))
+
+
+def morton_keys(positions: np.ndarray) -> np.ndarray:
+    """Z-order curve keys of pixel positions, close keys are close on screen."""
+    keys = np.zeros(len(positions), dtype=np.uint64)
+    coordinates = np.clip(positions, 0, 0xFFFF).astype(np.uint64)
+    for bit in range(16):
+        keys |= ((coordinates[:, 0] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit)
+        keys |= ((coordinates[:, 1] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit + 1)
+    return keys
+
+
+def initial_targets(agents: np.ndarray) -> np.ndarray:
+    """Targets of agents built from the first frame, their original positions and colors."""
+    targets = np.zeros(len(agents), dtype=TARGET_DTYPE)
+    targets["position"] = agents["original_postion"]
+    if "color" in agents.dtype.names:
+        if agents.dtype["color"].base == np.uint8:
+            targets["color"] = agents["color"]
+        else:
+            targets["color"] = np.round(np.clip(agents["color"], 0, 1) * 255)
+    return targets
+
+
+def build_targets(mask: np.ndarray, color_treshold: Tuple[int, int, int, int],
+                  previous: np.ndarray) -> np.ndarray:
+    """
+    Targets of the mask pixels for as many agents as previous has.
+    Pixels are sampled evenly along the z-order curve, or repeated when there are fewer
+    than agents, and the agent with the k-th previous target on the curve gets the k-th
+    new one, so shapes flow into each other instead of agents crossing the screen.
+    A mask without pixels keeps the previous targets.
+    """
+    rows, columns = mask_coordinates(mask, color_treshold)
+    if not len(rows):
+        return previous
+    # numpy rows go top to bottom, GL y goes bottom to top
+    positions = np.stack((columns, mask.shape[0] - rows), axis=1)
+    pixels = np.argsort(morton_keys(positions), kind="stable")
+    chosen = pixels[np.linspace(0, len(pixels), len(previous), endpoint=False).astype(np.int64)]
+    agents = np.argsort(morton_keys(previous["position"]), kind="stable")
+
+    targets = np.zeros(len(previous), dtype=TARGET_DTYPE)
+    targets["position"][agents] = positions[chosen]
+    targets["color"][agents] = mask[rows[chosen], columns[chosen]]
+    return targets
+
+
+class MaskAnimation:
+    """
+    Shows the frames of sources in a loop, starting with the first frame whose targets
+    are passed in. update() switches to the next frame once the shown one had its time
+    and the targets of the next one are decoded, a frame still decoding is waited for by
+    showing the current one longer. At most prefetch frames are decoded ahead, which
+    bounds the memory to prefetch target arrays.
+    The targets of the shown frame are bound to storage binding 17 by bind().
+    """
+
+    def __init__(self, ctx: moderngl.Context, sources: Sequence[MaskSource], frame_time: float,
+                 size: Tuple[int, int], color_treshold: Tuple[int, int, int, int], targets: np.ndarray,
+                 prefetch: int = 2):
+        self.size = size
+        self.color_treshold = color_treshold
+        self.prefetch = prefetch
+        # targets of the shown frame for all agents, uploaded for the simulated sample
+        self.targets = targets
+        self.sample: Optional[np.ndarray] = None
+        # the shown one and the one uploaded next
+        self.buffers = [ctx.buffer(targets), ctx.buffer(reserve=targets.nbytes)]
+
+        self.switch_time: Optional[float] = None
+        self.decoder = ThreadPoolExecutor(1, thread_name_prefix="MaskDecoder")
+        # frames to show, only advanced by the decoder thread
+        self.schedule = looped_frames(sources, frame_time)
+        # duration of the first frame, it is shown from the targets passed in
+        self.first_duration: Future = self.decoder.submit(lambda: next(self.schedule).duration)
+        # (targets, duration) of the next frames
+        self.pending: Deque[Future] = collections.deque()
+        # targets of the last decoded frame, only used by the decoder thread
+        self.decoded = targets
+        self._prefetch()
+
+    def _prefetch(self):
+        while len(self.pending) < self.prefetch:
+            self.pending.append(self.decoder.submit(self._decode))
+
+    def _decode(self) -> Tuple[np.ndarray, float]:
+        frame = next(self.schedule)
+        try:
+            self.decoded = build_targets(decode_frame(frame, self.size), self.color_treshold, self.decoded)
+        except (OSError, ValueError) as error:
+            # the agents keep the previous shape for the time of a broken frame
+            logging.warning("Could not decode mask frame %s %d: %s", frame.path, frame.index, error)
+        return self.decoded, frame.duration
+
+    def update(self, time: float) -> bool:
+        """Returns True when it switched to the next frame."""
+        if self.switch_time is None:
+            if not self.first_duration.done():
+                return False
+            self.switch_time = time + self.first_duration.result()
+        if time < self.switch_time or not self.pending[0].done():
+            return False
+        self.targets, duration = self.pending.popleft().result()
+        self.switch_time = time + duration
+        self._upload()
+        self._prefetch()
+        return True
+
+    def set_sample(self, sample: Optional[np.ndarray]):
+        """Agents of all agents at sample are simulated, None simulates all of them."""
+        self.sample = sample
+        self._upload()
+
+    def _upload(self):
+        # the buffer the kernels read last frame is left alone
+        self.buffers.reverse()
+        self.buffers[0].write(self.targets if self.sample is None else self.targets[self.sample])
+
+    def bind(self):
+        self.buffers[0].bind_to_storage_buffer(17)
+
+    def release(self):
+        for future in self.pending:
+            future.cancel()
+        self.decoder.shutdown(wait=True)
+        for buffer in self.buffers:
+            buffer.release()
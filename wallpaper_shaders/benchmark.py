@@ -0,0 +1,190 @@
+"""
+Offscreen benchmark of ComputeRender throughput.
+Runs a shader script in a headless moderngl context (Mesa llvmpipe works) with a
+synthetic mouse path and prints frame time statistics as JSON.
+run with: python -m wallpaper_shaders.benchmark --script pixel_particles --frames 600
+"""
+import argparse
+import importlib
+import json
+import math
+import subprocess
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import moderngl_window as mglw
+import numpy as np
+
+from wallpaper_shaders.common import ROOT_DIRECTORY
+
+SCRIPTS = ("pixel_particles", "pixel_particles_single_color")
+WARMUP_FRAMES = 30
+# render() is called with a fixed timestep so runs are reproducible
+FRAME_TIME = 1 / 60
+
+
+def create_headless_render(script_name: str, size: Tuple[int, int],
+                           config_overrides: Optional[Dict[str, Any]] = None,
+                           backend: Optional[str] = None):
+    """
+    Returns a ComputeRender of script_name rendering into an offscreen window of size.
+    config_overrides replace values of the script config.
+    Snapshots are off unless overridden so every run starts from the mask.
+    """
+    script = importlib.import_module("wallpaper_shaders." + script_name)
+    render_cls = script.ComputeRender
+
+    @classmethod
+    def load_config(cls):
+        config = render_cls.load_config()
+        return type(config)(**{**config.dict(), "snapshot": False, **(config_overrides or {})})
+
+    headless_cls = type("Headless" + render_cls.__name__, (render_cls,), {
+        "window_size": tuple(size),
+        "wallpaper": False,
+        # frames are timed, sleeping while idle would only add to the frame times
+        "throttle_idle": False,
+        "load_config": load_config,
+    })
+
+    window_cls = mglw.get_local_window_cls("headless")
+    window = window_cls(size=size, gl_version=render_cls.gl_version, backend=backend)
+    mglw.activate_context(window=window)
+    render = headless_cls(ctx=window.ctx, wnd=window)
+    # every timed frame should simulate
+    render.upload_agents(block=True)
+    return render
+
+
+def set_agent_count(render, count: int):
+    """Resamples the agents of render evenly to count, repeating them if there are fewer."""
+    indices = np.linspace(0, len(render.agents), count, endpoint=False).astype(np.int64)
+    render.all_agents = np.ascontiguousarray(render.agents[indices])
+    render.budget = render.create_budget(count)
+    render.set_sample(None)
+
+
+def synthetic_mouse_path(size: Tuple[int, int], frames: int) -> List[Tuple[int, int, int, int]]:
+    """
+    Deterministic lissajous mouse path over the whole window as (x, y, dx, dy) in window coordinates.
+    Fast enough that most frames are above the mouse movement treshold of ComputeRender.
+    """
+    # period at which the fastest horizontal movement is about 90 pixels per frame
+    period = max(60, size[0] * 0.45 * 3 * 2 * math.pi / 90)
+    path = []
+    previous = None
+    for frame in range(frames):
+        phase = 2 * math.pi * frame / period
+        x = int(size[0] * (0.5 + 0.45 * math.sin(3 * phase)))
+        y = int(size[1] * (0.5 + 0.45 * math.sin(2 * phase)))
+        previous = previous or (x, y)
+        path.append((x, y, x - previous[0], y - previous[1]))
+        previous = (x, y)
+    return path
+
+
+def parse_override(text: str) -> Tuple[str, Any]:
+    """Parses key=value, value is json or a plain string."""
+    key, separator, value = text.partition("=")
+    if not separator:
+        raise argparse.ArgumentTypeError(f"{text} is not key=value")
+    try:
+        return key, json.loads(value)
+    except json.JSONDecodeError:
+        return key, value
+
+
+def percentile(values: Sequence[float], percent: float) -> float:
+    return float(np.percentile(values, percent))
+
+
+def git_revision() -> Optional[str]:
+    """Returns the current commit so results can be compared across commits."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=str(ROOT_DIRECTORY),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(render, frames: int, warmup: int = WARMUP_FRAMES) -> Dict[str, Any]:
+    """Renders warmup + frames frames and returns the statistics of the timed ones."""
+    path = synthetic_mouse_path(render.window_size, warmup + frames)
+    frame_times = []
+    for frame, (x, y, dx, dy) in enumerate(path):
+        start = time.perf_counter()
+        render.mouse_position_event(x, y, dx, dy)
+        render.render(frame * FRAME_TIME, FRAME_TIME)
+        # wait for the GPU so the time covers the whole frame
+        render.ctx.finish()
+        if frame >= warmup:
+            frame_times.append(time.perf_counter() - start)
+    return frame_statistics(render, frame_times)
+
+
+def frame_statistics(render, frame_times: Sequence[float]) -> Dict[str, Any]:
+    """Returns fps and frame time percentiles of frame_times in seconds."""
+    frames = len(frame_times)
+    total = sum(frame_times)
+    statistics = {
+        "frames": frames,
+        "fps": frames / total,
+        "agents_per_sec": render.count * frames / total,
+        "frame_time_ms": {
+            "mean": 1000 * total / frames,
+            "p50": 1000 * percentile(frame_times, 50),
+            "p95": 1000 * percentile(frame_times, 95),
+            "p99": 1000 * percentile(frame_times, 99),
+        },
+    }
+    if render.diffuse_pass.tiles is not None:
+        statistics["diffuse_tile_fraction"] = render.diffuse_pass.tiles.processed_fraction
+    return statistics
+
+
+def main(args: Sequence[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmark a shader script offscreen.")
+    parser.add_argument("--script", default=SCRIPTS[0], choices=SCRIPTS)
+    parser.add_argument("--size", type=int, nargs=2, default=(1920, 1080))
+    parser.add_argument("--image", default=None, help="mask image, defaults to the one in the config")
+    parser.add_argument("--agents", type=int, default=None, help="resample the mask agents to this count")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--backend", default=None, help="moderngl context backend, e.g. egl")
+    parser.add_argument("--profile", action="store_true", help="add per stage cpu/gpu times to the result")
+    parser.add_argument("--output", default=None, help="append the result as a json line to this file")
+    parser.add_argument("--set", type=parse_override, action="append", default=[], metavar="KEY=VALUE",
+                        help="override a config value, e.g. --set active_list=true")
+    values = parser.parse_args(args)
+
+    overrides = dict(values.set)
+    if values.image:
+        overrides["image"] = values.image
+    render = create_headless_render(values.script, tuple(values.size), overrides, values.backend)
+    if values.agents is not None:
+        set_agent_count(render, values.agents)
+    render.profiler.enabled = values.profile
+    render.profiler.log_interval = 0
+
+    result = {
+        "script": values.script,
+        "revision": git_revision(),
+        "renderer": render.ctx.info["GL_RENDERER"],
+        "size": list(values.size),
+        "image": render.config.image,
+        "agents": render.count,
+        "config": dict(values.set),
+        **run_benchmark(render, values.frames),
+    }
+    render.close()
+    if values.profile:
+        result["stages_ms"] = {name: {"cpu": cpu, "gpu": gpu}
+                               for name, (cpu, gpu) in render.profiler.averages().items()}
+
+    print(json.dumps(result, indent=2))
+    if values.output:
+        with open(values.output, "a") as file:
+            file.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
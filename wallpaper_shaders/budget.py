@@ -0,0 +1,92 @@
+"""
+Automatic agent budget, max_agents "auto" in the particle configs.
+The GPU time of the simulation steps is measured with timer queries read a few
+frames later, so measuring never waits for the GPU. The budget is scaled so a
+step takes about target_ms and the agents are resampled when it changes enough.
+GL does not nest time queries, while a profiler times the stages inside the steps
+every other frame is measured by the budget and the others by the profiler.
+"""
+import collections
+import contextlib
+from typing import Deque, List, Optional, Tuple
+
+import moderngl
+import numpy as np
+
+from wallpaper_shaders.profiling import FrameProfiler
+
+# fewer agents do not make a picture anymore
+MIN_AGENTS = 1000
+
+
+class AgentBudget:
+    """
+    Usage:
+        with budget.measure(steps, profiler):
+            ... simulate steps ...
+        count = budget.update()  # None or the new number of agents
+    Starts with all agents. Drivers with broken timer queries, which report about
+    no time at all, never change the budget.
+    """
+
+    def __init__(self, ctx: moderngl.Context, total: int, target_ms: float, interval: int = 120,
+                 latency: int = 3, hysteresis: float = 0.15, max_growth: float = 2.0):
+        self.ctx = ctx
+        self.total = total
+        self.target_ms = target_ms
+        self.interval = interval
+        self.latency = latency
+        self.hysteresis = hysteresis
+        self.max_growth = max_growth
+        self.budget = total
+
+        # queries waiting for their results with the steps they timed
+        self._pending: Deque[Tuple[moderngl.Query, int]] = collections.deque()
+        self._free_queries: List[moderngl.Query] = []
+        # milliseconds per step of the current budget
+        self._samples: List[float] = []
+        # pending queries that timed the previous budget
+        self._stale = 0
+        self._frame = 0
+
+    @contextlib.contextmanager
+    def measure(self, steps: int, profiler: Optional[FrameProfiler] = None):
+        """Times the simulation steps of a frame on the GPU, profiler the one timing stages inside."""
+        self._frame += 1
+        if profiler is None or not profiler.enabled:
+            paused = contextlib.nullcontext()
+        elif self._frame % 2:
+            # the profiler times this frame's stages
+            yield
+            return
+        else:
+            paused = profiler.without_gpu()
+        query = self._free_queries.pop() if self._free_queries else self.ctx.query(time=True)
+        with paused, query:
+            yield
+        self._pending.append((query, steps))
+
+    def update(self) -> Optional[int]:
+        """Collects finished measurements, returns the new budget every interval frames if it changed enough."""
+        while len(self._pending) > self.latency:
+            query, steps = self._pending.popleft()
+            milliseconds = query.elapsed / 1e6 / steps
+            self._free_queries.append(query)
+            if self._stale:
+                self._stale -= 1
+            elif milliseconds > 0.001:
+                self._samples.append(milliseconds)
+        if len(self._samples) < self.interval:
+            return None
+
+        step_ms = float(np.median(self._samples))
+        self._samples.clear()
+        wanted = int(self.budget * min(self.target_ms / step_ms, self.max_growth))
+        wanted = min(max(wanted, min(MIN_AGENTS, self.total)), self.total)
+        # all agents are worth a resample even if it is a small change
+        if wanted == self.budget or (abs(wanted - self.budget) <= self.hysteresis * self.budget
+                                     and wanted != self.total):
+            return None
+        self.budget = wanted
+        self._stale = len(self._pending)
+        return wanted
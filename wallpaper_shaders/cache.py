@@ -0,0 +1,158 @@
+"""
+On-disk cache of preprocessed masks and agent buffers.
+Entries are stored as .npy files so a warm start can memory map them
+and skip decoding, resizing and thresholding the mask image.
+run with: python -m wallpaper_shaders.cache --clear to invalidate the cache
+"""
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+
+from wallpaper_shaders.common import CACHE_DIRECTORY, image_path
+from wallpaper_shaders.agents import build_agents
+
+# bump when the way entries are built changes
+CACHE_VERSION = 1
+
+MASK_FILE = "mask.npy"
+AGENTS_FILE = "agents.npy"
+
+
+class MaskCache:
+    """
+    Directory of cache entries, one subdirectory per key.
+    Entries not used for max_age seconds are evicted and if the cache
+    grows over max_size bytes the least recently used ones go first.
+    """
+
+    def __init__(self, directory=CACHE_DIRECTORY, max_size: int = 1024 * 1024 * 1024,
+                 max_age: float = 30 * 24 * 60 * 60):
+        self.directory = str(directory)
+        self.max_size = max_size
+        self.max_age = max_age
+
+    @staticmethod
+    def key(image_name: str, size: Tuple[int, int],
+            color_treshold: Tuple[int, int, int, int], dtype: np.dtype) -> str:
+        """Returns a key from the image content, size, treshold and struct layout."""
+        digest = hashlib.sha256()
+        with open(image_path(image_name), "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        digest.update(repr((CACHE_VERSION, tuple(size), tuple(color_treshold), dtype.descr)).encode())
+        return digest.hexdigest()
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def load(self, key: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Returns memory mapped (mask, agents) or None on a miss."""
+        entry = self._entry(key)
+        try:
+            mask = np.load(os.path.join(entry, MASK_FILE), mmap_mode="r")
+            agents = np.load(os.path.join(entry, AGENTS_FILE), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        # mark as recently used for eviction
+        os.utime(entry)
+        return mask, agents
+
+    def store(self, key: str, mask: np.ndarray, agents: np.ndarray):
+        """Writes an entry, the entry appears atomically so readers never see a partial one."""
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        try:
+            np.save(os.path.join(temporary, MASK_FILE), mask)
+            np.save(os.path.join(temporary, AGENTS_FILE), agents)
+            os.replace(temporary, self._entry(key))
+        except OSError as error:
+            # another process may have stored the same key in the meantime
+            logging.warning("Could not store cache entry %s: %s", key, error)
+            shutil.rmtree(temporary, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        """Returns list of (last use, size in bytes, path) of all entries."""
+        result = []
+        if not os.path.isdir(self.directory):
+            return result
+        for name in os.listdir(self.directory):
+            entry = os.path.join(self.directory, name)
+            if name.startswith(".") or not os.path.isdir(entry):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, file)) for file in os.listdir(entry))
+            result.append((os.path.getmtime(entry), size, entry))
+        return result
+
+    def evict(self):
+        """Removes entries older than max_age, then the oldest ones until under max_size."""
+        now = time.time()
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for last_use, size, entry in entries:
+            if now - last_use <= self.max_age and total <= self.max_size:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Invalidates the whole cache."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def load_mask(image_name: str, size: Tuple[int, int]) -> np.ndarray:
+    """Decodes the image and resizes it with padding to size."""
+    # only needed on a cache miss
+    from PIL import Image
+    from wallpaper_shaders.utils import resize_with_padding
+
+    with Image.open(image_path(image_name)) as mask_image:
+        return np.asarray(resize_with_padding(mask_image, size))
+
+
+def load_mask_and_agents(image_name: str, size: Tuple[int, int],
+                         color_treshold: Tuple[int, int, int, int], dtype: np.dtype,
+                         random_generator: Optional[np.random.Generator] = None,
+                         cache: Optional[MaskCache] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns (mask, agents) for the image resized to size.
+    With a cache, hits are memory mapped and misses are built and stored.
+    """
+    if cache is not None:
+        key = cache.key(image_name, size, color_treshold, dtype)
+        cached = cache.load(key)
+        if cached is not None:
+            logging.info("Mask %s loaded from cache", image_name)
+            return cached
+
+    mask = load_mask(image_name, size)
+    agents = build_agents(mask, color_treshold, dtype, random_generator)
+    if cache is not None:
+        cache.store(key, mask, agents)
+    return mask, agents
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the mask and agent cache.")
+    parser.add_argument("--clear", action="store_true", help="remove all cache entries")
+    parser.add_argument("--evict", action="store_true", help="remove old entries now")
+    args = parser.parse_args()
+
+    cache = MaskCache()
+    if args.clear:
+        cache.clear()
+    elif args.evict:
+        cache.evict()
+    for last_use, size, entry in sorted(cache.entries()):
+        print(f"{time.ctime(last_use)}  {size / 1024 / 1024:8.1f} MB  {os.path.basename(entry)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,17 @@
 from os import path
 import pathlib
 
-CONFIG_DIRECTORY = pathlib.PurePath(__file__, "../../config")
-RESOURCES_DIRECTORY = pathlib.PurePath(__file__, "../../resources")
-RESOURCES_DIRECTORY = pathlib.PurePath(__file__, "../../resources")
+# parent of a file instead of "file/.." so the paths also work outside of windows
+ROOT_DIRECTORY = pathlib.PurePath(path.abspath(__file__)).parent.parent
+CONFIG_DIRECTORY = ROOT_DIRECTORY.joinpath("config")
+RESOURCES_DIRECTORY = ROOT_DIRECTORY.joinpath("resources")
 
 #If I want to in the future seperate images in anouther file
 IMAGES_DIRECTORY = RESOURCES_DIRECTORY
 
+#preprocessed masks and other generated data, safe to delete
+CACHE_DIRECTORY = ROOT_DIRECTORY.joinpath("cache")
+
 def image_path(name):
     """returns path to an image in RESOURCES_PATH"""
     return path.join(IMAGES_DIRECTORY, name)
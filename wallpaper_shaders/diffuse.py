@@ -0,0 +1,321 @@
+"""
+Variants of the diffuse kernel and a tuner picking the fastest one for the current device.
+All variants are diffuse.glsl compiled with different defines, the separable one
+blurs rows into a half float texture first and columns of it second.
+Tuning results are remembered per renderer and window size in the cache directory.
+With dirty tiles the pass only diffuses the tiles changed lately, see DirtyTiles.
+run with: python -m wallpaper_shaders.diffuse --size 3840 2160 --backend egl
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import moderngl
+import numpy as np
+
+from wallpaper_shaders.common import CACHE_DIRECTORY
+
+MODES = ("direct", "tiled", "separable")
+LOCAL_SIZES = ((8, 8), (16, 8), (16, 16), (32, 8), (32, 32))
+# TILE_SIZE of the shaders, a multiple of every local size
+TILE_SIZE = 32
+TUNING_FILE = CACHE_DIRECTORY.joinpath("diffuse_tuning.json")
+
+LoadComputeShader = Callable[..., moderngl.ComputeShader]
+
+
+class DiffuseVariant(NamedTuple):
+    mode: str
+    local_size: Tuple[int, int]
+
+    @property
+    def name(self) -> str:
+        return f"{self.mode}_{self.local_size[0]}x{self.local_size[1]}"
+
+    @classmethod
+    def parse(cls, name: str) -> "DiffuseVariant":
+        """Inverse of name, e.g. tiled_16x16."""
+        mode, _, local_size = name.rpartition("_")
+        try:
+            local_x, local_y = (int(value) for value in local_size.split("x"))
+        except ValueError:
+            raise ValueError(f"{name} is not mode_XxY") from None
+        if mode not in MODES:
+            raise ValueError(f"Unknown diffuse mode {mode}, use one of {', '.join(MODES)}")
+        return cls(mode, (local_x, local_y))
+
+
+# the kernel before variants existed
+DEFAULT_VARIANT = DiffuseVariant("direct", (32, 32))
+VARIANTS = [DiffuseVariant(mode, local_size) for mode in MODES for local_size in LOCAL_SIZES]
+
+
+class DirtyTiles:
+    """
+    Tiles of TILE_SIZE pixels the diffuse pass skips while nothing changes in them.
+    The diffuse pass and the kernels drawing into the trails mark the tiles they change
+    in the marks bound to storage binding 18, prepare() lists the tiles with a mark next
+    to them in the last two steps with dirty_tiles.glsl and builds the indirect dispatch
+    of the diffuse pass. Two steps because the textures ping-pong, a tile is left alone
+    once both hold it settled.
+    The listed tiles are read back latency steps later for processed_fraction.
+    """
+
+    def __init__(self, ctx: moderngl.Context, load_compute_shader: LoadComputeShader,
+                 size: Tuple[int, int], groups_per_tile: int, latency: int = 3):
+        self.ctx = ctx
+        # tiles in x and y
+        self.grid = (-(-size[0] // TILE_SIZE), -(-size[1] // TILE_SIZE))
+        self.tile_count = self.grid[0] * self.grid[1]
+        defines = {"GROUPS_PER_TILE": str(groups_per_tile)}
+        self.list_shader = load_compute_shader("dirty_tiles.glsl", defines=defines)
+        self.args_shader = load_compute_shader("dirty_tiles.glsl", defines={**defines, "ARGS_PASS": "1"})
+
+        # the marks of the last step and the ones of the step before
+        self.marks = [ctx.buffer(reserve=self.tile_count * 4) for _ in range(2)]
+        # count followed by the tiles
+        self.list = ctx.buffer(reserve=(self.tile_count + 1) * 4)
+        self.args = ctx.buffer(reserve=3 * 4)
+        self.counts = [ctx.buffer(reserve=4) for _ in range(latency)]
+        self.step = 0
+        self.processed_tiles = 0
+        self.measured_steps = 0
+        self.invalidate()
+
+    def invalidate(self):
+        """Every tile is diffused the next two steps, e.g. after the textures were written."""
+        for buffer in self.marks:
+            buffer.write(np.ones(self.tile_count, dtype=np.uint32))
+
+    def prepare(self):
+        """Lists this step's tiles, then clears and binds the marks of this step."""
+        counter = self.counts[self.step % len(self.counts)]
+        if self.step >= len(self.counts):
+            self.processed_tiles += int.from_bytes(counter.read(), "little")
+            self.measured_steps += 1
+
+        last, before = self.marks
+        last.bind_to_storage_buffer(18)
+        before.bind_to_storage_buffer(19)
+        self.list.bind_to_storage_buffer(20)
+        self.args.bind_to_storage_buffer(21)
+        self.list.clear(size=4)
+        # the marks were written by the last step
+        self.ctx.memory_barrier()
+        self.list_shader["tiles"].value = self.grid
+        self.list_shader.run(-(-self.grid[0] // 8), -(-self.grid[1] // 8), 1)
+        self.ctx.memory_barrier()
+        self.args_shader.run(1, 1, 1)
+        self.ctx.memory_barrier()
+        self.ctx.copy_buffer(counter, self.list, size=4)
+
+        before.clear()
+        before.bind_to_storage_buffer(18)
+        self.marks.reverse()
+        self.step += 1
+
+    @property
+    def processed_fraction(self) -> Optional[float]:
+        """Mean fraction of the tiles diffused per step, None before the first read back."""
+        if not self.measured_steps:
+            return None
+        return self.processed_tiles / (self.measured_steps * self.tile_count)
+
+    def release(self):
+        # the shaders belong to the shader cache they were loaded from
+        for buffer in (*self.marks, self.list, self.args, *self.counts):
+            buffer.release()
+
+
+class DiffusePass:
+    """
+    diffuse.glsl compiled as variant, run() diffuses the texture bound to image unit 0
+    into the one bound to unit 1. defines are the DECAY and DIFFUSE defines of the script.
+    With dirty_tiles only the tiles listed by self.tiles are diffused.
+    The shaders belong to the cache of load_compute_shader and are not released with the pass.
+    """
+
+    def __init__(self, ctx: moderngl.Context, load_compute_shader: LoadComputeShader,
+                 size: Tuple[int, int], defines: Dict[str, str], variant: DiffuseVariant = DEFAULT_VARIANT,
+                 dirty_tiles: bool = False):
+        self.size = size
+        self.variant = variant
+        defines = {
+            **defines,
+            "LOCAL_SIZE_X": str(variant.local_size[0]),
+            "LOCAL_SIZE_Y": str(variant.local_size[1]),
+            "TILED": "1" if variant.mode == "tiled" else "0",
+            "DIRTY_TILES": "1" if dirty_tiles else "0",
+        }
+        self.tiles = None
+        if dirty_tiles:
+            groups_per_tile = (TILE_SIZE // variant.local_size[0]) * (TILE_SIZE // variant.local_size[1])
+            self.tiles = DirtyTiles(ctx, load_compute_shader, size, groups_per_tile)
+        self.rows = None
+        if variant.mode == "separable":
+            self.shaders = [load_compute_shader("diffuse.glsl", defines={**defines, "SEPARABLE_PASS": str(index)})
+                            for index in (1, 2)]
+            self.rows = ctx.texture(size, 4, dtype="f2")
+        else:
+            self.shaders = [load_compute_shader("diffuse.glsl", defines=defines)]
+        # ceil so the last groups cover the edge, the kernel skips pixels outside
+        self.groups = (-(-size[0] // variant.local_size[0]), -(-size[1] // variant.local_size[1]), 1)
+        self.ctx = ctx
+
+    def run(self):
+        if self.tiles is not None:
+            self.tiles.prepare()
+        if self.rows is not None:
+            self.rows.bind_to_image(2, read=True, write=True)
+        for index, shader in enumerate(self.shaders):
+            if index:
+                self.ctx.memory_barrier(moderngl.SHADER_IMAGE_ACCESS_BARRIER_BIT)
+            if self.tiles is not None:
+                shader.run_indirect(self.tiles.args)
+            else:
+                shader.run(*self.groups)
+
+    def invalidate(self):
+        """The textures were written outside of the passes, e.g. by a snapshot."""
+        if self.tiles is not None:
+            self.tiles.invalidate()
+
+    def release(self):
+        if self.rows is not None:
+            self.rows.release()
+        if self.tiles is not None:
+            self.tiles.release()
+
+
+def tuning_key(ctx: moderngl.Context, size: Tuple[int, int]) -> str:
+    return f"{ctx.info['GL_RENDERER']}|{ctx.info['GL_VERSION']}|{size[0]}x{size[1]}"
+
+
+def load_tuning() -> Dict[str, str]:
+    try:
+        with open(TUNING_FILE) as file:
+            return json.load(file)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def store_tuning(key: str, variant: DiffuseVariant):
+    tuning = load_tuning()
+    tuning[key] = variant.name
+    try:
+        os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+        temporary = f"{TUNING_FILE}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(tuning, file, indent=2)
+        os.replace(temporary, TUNING_FILE)
+    except OSError as error:
+        logging.warning("Could not store diffuse tuning: %s", error)
+
+
+def measure(ctx: moderngl.Context, diffuse: DiffusePass, runs: int) -> float:
+    """Returns mean milliseconds of diffuse.run() including the wait for the GPU."""
+    # wall time instead of timer queries, some drivers (llvmpipe) report nonsense for those
+    diffuse.run()
+    ctx.finish()
+    start = time.perf_counter()
+    for _ in range(runs):
+        diffuse.run()
+    ctx.finish()
+    return (time.perf_counter() - start) * 1000 / runs
+
+
+def autotune(ctx: moderngl.Context, load_compute_shader: LoadComputeShader, size: Tuple[int, int],
+             defines: Dict[str, str], variants: Sequence[DiffuseVariant] = VARIANTS,
+             runs: int = 5) -> List[Tuple[float, DiffuseVariant]]:
+    """Times every variant on noise textures of size, returns (ms, variant) sorted fastest first."""
+    noise = np.random.default_rng(0).integers(0, 256, (size[1], size[0], 4), dtype=np.uint8)
+    read_texture = ctx.texture(size, 4, noise)
+    write_texture = ctx.texture(size, 4)
+    read_texture.bind_to_image(0, read=True, write=False)
+    write_texture.bind_to_image(1, read=False, write=True)
+
+    results = []
+    for variant in variants:
+        try:
+            diffuse = DiffusePass(ctx, load_compute_shader, size, defines, variant)
+        except moderngl.Error as error:
+            # e.g. more invocations or shared memory than the device supports
+            logging.info("Diffuse variant %s is not supported: %s", variant.name, error)
+            continue
+        results.append((measure(ctx, diffuse, runs), variant))
+        diffuse.release()
+
+    read_texture.release()
+    write_texture.release()
+    results.sort()
+    return results
+
+
+def tuned_variant(ctx: moderngl.Context, load_compute_shader: LoadComputeShader,
+                  size: Tuple[int, int], defines: Dict[str, str]) -> DiffuseVariant:
+    """Returns the remembered fastest variant, tuning and remembering it on the first run."""
+    key = tuning_key(ctx, size)
+    name = load_tuning().get(key)
+    if name is not None:
+        try:
+            return DiffuseVariant.parse(name)
+        except ValueError:
+            pass
+    logging.info("Tuning the diffuse kernel for %s", key)
+    results = autotune(ctx, load_compute_shader, size, defines)
+    if not results:
+        return DEFAULT_VARIANT
+    milliseconds, variant = results[0]
+    logging.info("Fastest diffuse kernel is %s, %.3f ms", variant.name, milliseconds)
+    store_tuning(key, variant)
+    return variant
+
+
+def create_diffuse(ctx: moderngl.Context, load_compute_shader: LoadComputeShader,
+                   size: Tuple[int, int], defines: Dict[str, str], kernel: str,
+                   dirty_tiles: bool = False) -> DiffusePass:
+    """DiffusePass of the config value kernel, a variant name or auto."""
+    if kernel == "auto":
+        variant = tuned_variant(ctx, load_compute_shader, size, defines)
+    else:
+        variant = DiffuseVariant.parse(kernel)
+    return DiffusePass(ctx, load_compute_shader, size, defines, variant, dirty_tiles)
+
+
+def main(args: Optional[Sequence[str]] = None):
+    import moderngl_window as mglw
+    from moderngl_window.meta import ProgramDescription
+    from moderngl_window import resources
+    from wallpaper_shaders.common import RESOURCES_DIRECTORY
+    from wallpaper_shaders.shader_cache import ShaderCache
+
+    parser = argparse.ArgumentParser(description="Time the diffuse kernel variants and remember the fastest.")
+    parser.add_argument("--size", type=int, nargs=2, default=(1920, 1080))
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--backend", default=None, help="moderngl context backend, e.g. egl")
+    values = parser.parse_args(args)
+
+    kwargs = {"backend": values.backend} if values.backend else {}
+    ctx = moderngl.create_context(standalone=True, require=430, **kwargs)
+    mglw.activate_context(ctx=ctx)
+    resources.register_dir(RESOURCES_DIRECTORY)
+    cache = ShaderCache(ctx, RESOURCES_DIRECTORY)
+
+    def load_compute_shader(path, defines=None):
+        return cache.get("compute", {"path": path, "defines": defines},
+                         lambda: resources.programs.load(ProgramDescription(compute_shader=path, defines=defines)))
+
+    size = tuple(values.size)
+    results = autotune(ctx, load_compute_shader, size, {}, runs=values.runs)
+    for milliseconds, variant in results:
+        print(f"{variant.name:>16} {milliseconds:8.3f} ms")
+    if results:
+        store_tuning(tuning_key(ctx, size), results[0][1])
+    cache.release()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Cursor sparks, short lived particles spawned along the mouse line on top of the mask agents.
+Sparks live in a pool of fixed capacity. A free list of unused slots and an atomic
+live count are kept on the GPU, so emitting and retiring sparks never reallocates
+or reads anything back. The update pass is dispatched indirectly over the live sparks.
+"""
+import math
+
+import moderngl
+import numpy as np
+
+# bytes of the Spark struct of sparks.glsl
+SPARK_SIZE = 48
+# local_size_x of sparks.glsl
+GROUP_SIZE = 64
+
+
+class SparkEmitter:
+    """
+    Buffers and passes of sparks.glsl, run() once per simulation step after the
+    particle kernel, with the trail texture at image unit 0 and the settle counter
+    at storage binding 4. rate is the sparks per simulation pixel of mouse movement.
+    """
+
+    def __init__(self, ctx: moderngl.Context, capacity: int, rate: float,
+                 emit_shader: moderngl.ComputeShader, args_shader: moderngl.ComputeShader,
+                 update_shader: moderngl.ComputeShader):
+        self.ctx = ctx
+        self.capacity = capacity
+        self.rate = rate
+        self.emit_shader = emit_shader
+        self.args_shader = args_shader
+        self.update_shader = update_shader
+        self.seed = 0
+
+        self.pool = ctx.buffer(reserve=capacity * SPARK_SIZE)
+        # count followed by the free slots, all of them at first
+        self.free_list = ctx.buffer(np.concatenate(([capacity], np.arange(capacity))).astype(np.uint32))
+        # count followed by spark slots, swapped every step
+        self.lists = [ctx.buffer(reserve=(capacity + 1) * 4) for _ in range(2)]
+        for buffer in self.lists:
+            buffer.clear()
+        self.args = ctx.buffer(reserve=3 * 4)
+
+    def run(self, mouse, delta_mouse, splat_radius: int):
+        """Emits the sparks of this step's mouse movement and moves the live ones."""
+        live_in, live_out = self.lists
+        self.pool.bind_to_storage_buffer(12)
+        self.free_list.bind_to_storage_buffer(13)
+        live_in.bind_to_storage_buffer(14)
+        live_out.bind_to_storage_buffer(15)
+        self.args.bind_to_storage_buffer(16)
+
+        # the previous update pass wrote the lists
+        self.ctx.memory_barrier()
+        # more sparks than the pool holds would only fail to take a slot
+        count = min(int(math.hypot(*delta_mouse) * self.rate), self.capacity)
+        if count:
+            self.emit_shader["mouse"].value = tuple(mouse)
+            self.emit_shader["delta_mouse"].value = tuple(delta_mouse)
+            self.emit_shader["emit_count"].value = count
+            self.emit_shader["seed"].value = self.seed
+            self.emit_shader.run(-(-count // GROUP_SIZE), 1, 1)
+            self.ctx.memory_barrier()
+        self.seed = (self.seed + 0x9E3779B9) & 0xFFFFFFFF
+        self.args_shader.run(1, 1, 1)
+        self.ctx.memory_barrier()
+        self.update_shader["splat_radius"].value = splat_radius
+        self.update_shader.run_indirect(self.args)
+
+        # sparks still alive are the input of the next step
+        self.lists.reverse()
+
+    def release(self):
+        # the shaders belong to the shader cache they were loaded from
+        for buffer in (self.pool, self.free_list, self.args, *self.lists):
+            buffer.release()
@@ -0,0 +1,287 @@
+"""
+Offline export of a shader script as a png sequence or a video, e.g. loops pre-rendered
+for machines too slow to simulate them live.
+Frames are rendered offscreen at the export size with a fixed timestep and read back
+through a ring of pixel buffers, so reading a frame never waits for the one just rendered.
+They are encoded on background threads and at most max_pending frames wait for them,
+a slow encoder holds the rendering back instead of filling the memory.
+export with: python -m wallpaper_shaders.export frames/ --frames 600 --size 1920 1080 --backend egl
+         or: python -m wallpaper_shaders.export loop.mp4 --frames 600 --fps 60
+"""
+import abc
+import argparse
+import collections
+import json
+import logging
+import os
+import queue
+import subprocess
+import threading
+import time
+from typing import Any, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import moderngl
+import numpy as np
+
+# rgb rows are read and encoded
+COMPONENTS = 3
+# frames read back per pixel buffer ring, more hides a longer GPU latency
+READ_DEPTH = 3
+
+
+class FrameReader:
+    """
+    Ring of depth pixel buffers. read() starts copying a framebuffer into the next buffer
+    and returns the frame copied depth reads earlier, its copy is done by then.
+    Frames are returned as rgb rows, bottom row first as read from GL.
+    """
+
+    def __init__(self, ctx: moderngl.Context, size: Tuple[int, int], depth: int = READ_DEPTH):
+        self.size = size
+        self.buffers = [ctx.buffer(reserve=size[0] * size[1] * COMPONENTS) for _ in range(depth)]
+        # frame numbers and buffers of the copies not returned yet
+        self.pending: Deque[Tuple[int, moderngl.Buffer]] = collections.deque()
+        self.next = 0
+
+    def read(self, framebuffer: moderngl.Framebuffer, frame: int) -> Optional[Tuple[int, bytes]]:
+        ready = self._finish() if len(self.pending) == len(self.buffers) else None
+        buffer = self.buffers[self.next]
+        self.next = (self.next + 1) % len(self.buffers)
+        framebuffer.read_into(buffer, viewport=(0, 0, *self.size), components=COMPONENTS)
+        self.pending.append((frame, buffer))
+        return ready
+
+    def flush(self) -> Iterator[Tuple[int, bytes]]:
+        """Returns the frames still being copied."""
+        while self.pending:
+            yield self._finish()
+
+    def _finish(self) -> Tuple[int, bytes]:
+        frame, buffer = self.pending.popleft()
+        return frame, buffer.read()
+
+    def release(self):
+        for buffer in self.buffers:
+            buffer.release()
+
+
+class FrameWriter(abc.ABC):
+    """
+    Encodes frames on worker threads, write() blocks while max_pending frames wait.
+    An encoding error is raised by the next write() or by close().
+    """
+
+    def __init__(self, size: Tuple[int, int], workers: int = 1, max_pending: int = 8):
+        self.size = size
+        self.queue: "queue.Queue[Optional[Tuple[int, bytes]]]" = queue.Queue(max_pending)
+        self.error: Optional[Exception] = None
+        # set by close(discard=True), the workers skip the frames still queued
+        self.discarding = False
+        self.threads = [threading.Thread(target=self._work, name=f"FrameWriter-{worker}", daemon=True)
+                        for worker in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def write(self, frame: int, data: bytes):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((frame, data))
+
+    def image(self, data: bytes) -> np.ndarray:
+        """rgb rows of data top row first."""
+        width, height = self.size
+        return np.ascontiguousarray(np.frombuffer(data, dtype=np.uint8).reshape(height, width, COMPONENTS)[::-1])
+
+    @abc.abstractmethod
+    def encode(self, frame: int, data: bytes):
+        """Encodes the rgb rows of frame, called on the worker threads."""
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None or self.discarding:
+                # keep taking frames so write() does not block forever
+                continue
+            try:
+                self.encode(*item)
+            except Exception as error:
+                logging.error("Encoding frame %d failed: %s", item[0], error)
+                self.error = error
+
+    def close(self, discard: bool = False):
+        """Waits for the frames written so far, discard drops the ones not encoded yet and any error."""
+        self.discarding = discard
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.error is not None and not discard:
+            raise self.error
+
+
+class PngSequenceWriter(FrameWriter):
+    """
+    Saves frame_000000.png, frame_000001.png, ... to directory.
+    PIL releases the GIL while compressing, so the workers encode in parallel.
+    """
+
+    def __init__(self, directory: str, size: Tuple[int, int], workers: int = 4,
+                 max_pending: int = 8, compress_level: int = 1):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.compress_level = compress_level
+        super().__init__(size, workers, max_pending)
+
+    def encode(self, frame: int, data: bytes):
+        from PIL import Image
+
+        path = os.path.join(self.directory, f"frame_{frame:06d}.png")
+        Image.fromarray(self.image(data)).save(path, compress_level=self.compress_level)
+
+
+class PipeWriter(FrameWriter):
+    """Writes raw rgb24 frames to the stdin of an encoder command, one worker keeps them in order."""
+
+    def __init__(self, command: Sequence[str], size: Tuple[int, int], max_pending: int = 8):
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        super().__init__(size, 1, max_pending)
+
+    def encode(self, frame: int, data: bytes):
+        self.process.stdin.write(self.image(data).tobytes())
+
+    def close(self, discard: bool = False):
+        try:
+            super().close(discard)
+        finally:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            code = self.process.wait()
+        if code != 0 and not discard:
+            raise RuntimeError(f"Encoder exited with {code}")
+
+
+def ffmpeg_command(path: str, size: Tuple[int, int], fps: float, arguments: Sequence[str]) -> List[str]:
+    """Command encoding raw rgb24 frames from stdin to the video at path."""
+    return [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{size[0]}x{size[1]}", "-r", str(fps), "-i", "-",
+        *arguments, path,
+    ]
+
+
+def export(render, writer: FrameWriter, inputs: Sequence[Tuple[int, int, int, int]], frame_time: float,
+           start_frame: int = 0, depth: int = READ_DEPTH) -> Dict[str, Any]:
+    """
+    Renders one frame per cursor input (x, y, dx, dy) at a fixed timestep and writes
+    the frames from start_frame on, earlier ones only let the trails build up.
+    Returns the frame counts and timings.
+    """
+    reader = FrameReader(render.ctx, render.wnd.fbo.size, depth)
+    start = time.perf_counter()
+    try:
+        for frame, (x, y, dx, dy) in enumerate(inputs):
+            render.mouse_position_event(x, y, dx, dy)
+            render.render(frame * frame_time, frame_time)
+            if frame < start_frame:
+                continue
+            ready = reader.read(render.wnd.fbo, frame - start_frame)
+            if ready is not None:
+                writer.write(*ready)
+        for ready in reader.flush():
+            writer.write(*ready)
+    except BaseException:
+        # stop the workers and the encoder, the error raised is the one of the export
+        writer.close(discard=True)
+        raise
+    finally:
+        reader.release()
+    rendered = time.perf_counter()
+    writer.close()
+    end = time.perf_counter()
+    frames = max(0, len(inputs) - start_frame)
+    return {
+        "frames": frames,
+        "render_fps": len(inputs) / (rendered - start),
+        "export_fps": frames / (end - start),
+        # time spent waiting for the writer after the last frame
+        "encode_tail_s": end - rendered,
+    }
+
+
+def scaled_inputs(size: Tuple[int, int], records: np.ndarray,
+                  trace_size: Tuple[int, int]) -> List[Tuple[int, int, int, int]]:
+    """Cursor inputs of trace records scaled from the window they were recorded in to size."""
+    scale_x, scale_y = size[0] / trace_size[0], size[1] / trace_size[1]
+    inputs = []
+    for record in records:
+        x, y = record["position"]
+        dx, dy = record["delta"]
+        inputs.append((round(x * scale_x), round(y * scale_y), round(dx * scale_x), round(dy * scale_y)))
+    return inputs
+
+
+def main(args: Optional[Sequence[str]] = None):
+    from wallpaper_shaders.benchmark import (
+        FRAME_TIME, SCRIPTS, create_headless_render, git_revision, parse_override, synthetic_mouse_path
+    )
+    from wallpaper_shaders.trace import load_trace
+
+    parser = argparse.ArgumentParser(description="Export a shader script offscreen as png frames or a video.")
+    parser.add_argument("output", help="directory for a png sequence, otherwise a video file for the encoder")
+    parser.add_argument("--script", default=SCRIPTS[0], choices=SCRIPTS)
+    parser.add_argument("--size", type=int, nargs=2, default=(1920, 1080))
+    parser.add_argument("--frames", type=int, default=600, help="frames to export")
+    parser.add_argument("--start-frame", type=int, default=0, help="frames simulated before the first exported one")
+    parser.add_argument("--fps", type=float, default=1 / FRAME_TIME, help="frame rate, the timestep is 1 / fps")
+    parser.add_argument("--trace", default=None,
+                        help="cursor input recorded with --record-trace, defaults to a synthetic path")
+    parser.add_argument("--backend", default=None, help="moderngl context backend, e.g. egl")
+    parser.add_argument("--read-depth", type=int, default=READ_DEPTH, help="pixel buffers in the readback ring")
+    parser.add_argument("--workers", type=int, default=4, help="png encoding threads")
+    parser.add_argument("--max-pending", type=int, default=8, help="frames waiting for the encoder at most")
+    parser.add_argument("--encoder-args", default="-c:v libx264 -pix_fmt yuv420p -crf 18",
+                        help="ffmpeg output arguments for videos")
+    parser.add_argument("--set", type=parse_override, action="append", default=[], metavar="KEY=VALUE",
+                        help="override a config value, e.g. --set active_list=true")
+    values = parser.parse_args(args)
+
+    size = tuple(values.size)
+    total = values.start_frame + values.frames
+    if values.trace is not None:
+        trace_size, records = load_trace(values.trace)
+        # the cursor rests where the trace ended
+        inputs = scaled_inputs(size, records[:total], trace_size)
+        inputs += [(*inputs[-1][:2], 0, 0)] * (total - len(inputs)) if inputs else [(0, 0, 0, 0)] * total
+    else:
+        inputs = synthetic_mouse_path(size, total)
+
+    if os.path.splitext(values.output)[1]:
+        try:
+            writer = PipeWriter(ffmpeg_command(values.output, size, values.fps, values.encoder_args.split()),
+                                size, values.max_pending)
+        except FileNotFoundError:
+            parser.error("ffmpeg was not found, install it or export a png sequence to a directory")
+    else:
+        writer = PngSequenceWriter(values.output, size, values.workers, values.max_pending)
+
+    render = create_headless_render(values.script, size, dict(values.set), values.backend)
+    result = {
+        "script": values.script,
+        "output": values.output,
+        "revision": git_revision(),
+        "renderer": render.ctx.info["GL_RENDERER"],
+        "size": list(size),
+        "agents": render.count,
+        "config": dict(values.set),
+        **export(render, writer, inputs, 1 / values.fps, values.start_frame, values.read_depth),
+    }
+    render.close()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
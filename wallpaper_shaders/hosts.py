@@ -0,0 +1,242 @@
+"""
+Platforms the wallpaper can run on and background cursor sampling.
+A host knows the screen size, where the cursor is and how to put a window
+behind the desktop icons. The host is picked by platform or by the
+WALLPAPER_HOST environment variable (windows, x11 or headless).
+"""
+import abc
+import ctypes
+import ctypes.util
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Callable, Optional, Tuple
+
+
+class Host(abc.ABC):
+    """Interface of a platform, subclasses implement all methods."""
+
+    name = "base"
+
+    @abc.abstractmethod
+    def screen_size(self) -> Tuple[int, int]:
+        """Returns size of the primary screen."""
+
+    @abc.abstractmethod
+    def cursor_position(self) -> Tuple[int, int]:
+        """Returns the cursor position in screen coordinates, y going down."""
+
+    @abc.abstractmethod
+    def attach(self, window):
+        """Puts the moderngl_window window between the wallpaper and the desktop icons."""
+
+
+class WindowsHost(Host):
+    """Uses the win api through user32."""
+
+    name = "windows"
+
+    def __init__(self):
+        if sys.platform != "win32":
+            raise OSError("user32 is only available on Windows")
+        import ctypes.wintypes
+        self.user32 = ctypes.WinDLL("user32")
+
+    def screen_size(self) -> Tuple[int, int]:
+        return self.user32.GetSystemMetrics(0), self.user32.GetSystemMetrics(1)
+
+    def cursor_position(self) -> Tuple[int, int]:
+        # https://stackoverflow.com/a/24567802
+        point = ctypes.wintypes.POINT()
+        self.user32.GetCursorPos(ctypes.byref(point))
+        return point.x, point.y
+
+    def find_workerw_handle(self) -> int:
+        """
+        Finds and returns WorkerW window handle.
+        Children of this window will be drawn between the icons and the wallpaper.
+        """
+        # https://www.codeproject.com/Articles/856020/Draw-Behind-Desktop-Icons-in-Windows-plus
+        user32 = self.user32
+
+        # Find handle of progman window
+        desktop_handle = user32.GetDesktopWindow()
+        progman = user32.FindWindowExW(desktop_handle, 0, "Progman", 0)
+
+        # Send message to progman to create WorkerW window
+        # 0x0000 - SMTO_NORMAL
+        user32.SendMessageTimeoutW(progman, 0x052C, 0, 0, 0x0000, 1000, 0)
+
+        # Find newly created WorkerW window
+        workerw = []
+
+        def enum_windows_proc(hwnd, _lparam):
+            handle = user32.FindWindowExW(hwnd, 0, "SHELLDLL_DefView", 0)
+            if handle != 0:
+                # hacky way to get workerw value out of this function
+                workerw.append(user32.FindWindowExW(0, hwnd, "WorkerW", 0))
+            return True
+
+        WNDENUMPROC = ctypes.WINFUNCTYPE(ctypes.wintypes.BOOL,
+                                         ctypes.wintypes.HWND,
+                                         ctypes.wintypes.LPARAM)
+        enum_windows_proc_winfunc = WNDENUMPROC(enum_windows_proc)
+
+        user32.EnumWindows(enum_windows_proc_winfunc, 0)
+
+        return workerw.pop()
+
+    def attach(self, window):
+        # This is a bit hacky
+        self.user32.SetParent(window._window._hwnd, self.find_workerw_handle())
+
+
+class X11Host(Host):
+    """Uses Xlib through ctypes, works on most linux desktops including XWayland."""
+
+    name = "x11"
+
+    # PropModeReplace, XA_ATOM
+    _PROP_MODE_REPLACE = 0
+    _XA_ATOM = 4
+
+    def __init__(self):
+        library = ctypes.util.find_library("X11")
+        if library is None:
+            raise OSError("libX11 not found")
+        self.xlib = ctypes.cdll.LoadLibrary(library)
+        self.xlib.XOpenDisplay.restype = ctypes.c_void_p
+        self.xlib.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        self.xlib.XDefaultRootWindow.restype = ctypes.c_ulong
+        self.xlib.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        self.xlib.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        self.xlib.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        self.xlib.XInternAtom.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int]
+        self.xlib.XInternAtom.restype = ctypes.c_ulong
+        self.xlib.XFlush.argtypes = [ctypes.c_void_p]
+
+        # own connection, the one of the window toolkit is not ours to use from other threads
+        self.display = self.xlib.XOpenDisplay(None)
+        if not self.display:
+            raise OSError("Cannot open X display")
+        self.root = self.xlib.XDefaultRootWindow(self.display)
+        self.lock = threading.Lock()
+
+    def screen_size(self) -> Tuple[int, int]:
+        with self.lock:
+            screen = self.xlib.XDefaultScreen(self.display)
+            return self.xlib.XDisplayWidth(self.display, screen), self.xlib.XDisplayHeight(self.display, screen)
+
+    def cursor_position(self) -> Tuple[int, int]:
+        root, child = ctypes.c_ulong(), ctypes.c_ulong()
+        root_x, root_y, window_x, window_y = ctypes.c_int(), ctypes.c_int(), ctypes.c_int(), ctypes.c_int()
+        mask = ctypes.c_uint()
+        with self.lock:
+            self.xlib.XQueryPointer(ctypes.c_void_p(self.display), ctypes.c_ulong(self.root),
+                                    ctypes.byref(root), ctypes.byref(child),
+                                    ctypes.byref(root_x), ctypes.byref(root_y),
+                                    ctypes.byref(window_x), ctypes.byref(window_y), ctypes.byref(mask))
+        return root_x.value, root_y.value
+
+    def attach(self, window):
+        # pyglet keeps the xlib window id in _window, other toolkits are not supported
+        handle = getattr(getattr(window, "_window", None), "_window", None)
+        if not isinstance(handle, int):
+            logging.warning("Cannot attach a %s window to the desktop", window.name)
+            return
+        with self.lock:
+            window_type = self.xlib.XInternAtom(self.display, b"_NET_WM_WINDOW_TYPE", 0)
+            desktop = ctypes.c_ulong(self.xlib.XInternAtom(self.display, b"_NET_WM_WINDOW_TYPE_DESKTOP", 0))
+            self.xlib.XChangeProperty(ctypes.c_void_p(self.display), ctypes.c_ulong(handle),
+                                      ctypes.c_ulong(window_type), ctypes.c_ulong(self._XA_ATOM), 32,
+                                      self._PROP_MODE_REPLACE, ctypes.byref(desktop), 1)
+            self.xlib.XFlush(self.display)
+
+
+class HeadlessHost(Host):
+    """No screen, the cursor follows script(time) with time in seconds since creation."""
+
+    name = "headless"
+
+    def __init__(self, size: Tuple[int, int] = (1920, 1080),
+                 script: Optional[Callable[[float], Tuple[int, int]]] = None):
+        self.size = size
+        self.script = script or (lambda _time: (size[0] // 2, size[1] // 2))
+        self.start = time.perf_counter()
+
+    def screen_size(self) -> Tuple[int, int]:
+        return self.size
+
+    def cursor_position(self) -> Tuple[int, int]:
+        return self.script(time.perf_counter() - self.start)
+
+    def attach(self, window):
+        return
+
+
+def get_host(name: Optional[str] = None) -> Host:
+    """Returns host called name, by default WALLPAPER_HOST or the one of the current platform."""
+    name = name or os.environ.get("WALLPAPER_HOST")
+    if name is None:
+        name = "windows" if sys.platform == "win32" else "x11" if os.environ.get("DISPLAY") else "headless"
+    hosts = {host.name: host for host in (WindowsHost, X11Host, HeadlessHost)}
+    if name not in hosts:
+        raise ValueError(f"Unknown host {name}, use one of {', '.join(hosts)}")
+    try:
+        host = hosts[name]()
+    except OSError as error:
+        logging.warning("Cannot use %s host, falling back to headless: %s", name, error)
+        host = HeadlessHost()
+    logging.info("Using %s host", host.name)
+    return host
+
+
+class CursorSampler:
+    """
+    Polls the host cursor on a background thread.
+    Movement between two take() calls is coalesced into a single delta,
+    so reading the cursor never makes a syscall on the render thread.
+    """
+
+    def __init__(self, host: Host, rate: float = 240.0):
+        self.host = host
+        self.interval = 1 / rate
+        self._lock = threading.Lock()
+        self._position = host.cursor_position()
+        self._delta = (0, 0)
+        self._moved = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="CursorSampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            position = self.host.cursor_position()
+            with self._lock:
+                self._delta = (self._delta[0] + position[0] - self._position[0],
+                               self._delta[1] + position[1] - self._position[1])
+                self._position = position
+            if self._delta != (0, 0):
+                self._moved.set()
+
+    def take(self) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        """Returns the latest position and the movement since the previous take."""
+        with self._lock:
+            position, delta = self._position, self._delta
+            self._delta = (0, 0)
+            self._moved.clear()
+        return position, delta
+
+    def wait_moved(self, timeout: float) -> bool:
+        """Blocks until the cursor moves or timeout seconds pass, returns True if it moved."""
+        return self._moved.wait(timeout)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
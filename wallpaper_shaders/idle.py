@@ -0,0 +1,59 @@
+"""
+Settle detection for the particle kernels.
+The kernels count agents that are not resting on their original position,
+the count is read back a few frames later so the host never waits for the GPU.
+"""
+import logging
+from typing import Optional
+
+import moderngl
+
+
+class SettleMonitor:
+    """
+    Ring of counter buffers, one is cleared and bound each simulated frame
+    and read again latency frames later. After idle_after frames without
+    moving agents the scene is idle until wake() is called.
+    idle_after of 0 never goes idle.
+    """
+
+    def __init__(self, ctx: moderngl.Context, idle_after: int, latency: int = 3):
+        self.buffers = [ctx.buffer(reserve=4) for _ in range(latency)]
+        self.idle_after = idle_after
+        self.frame = 0
+        self.quiet_frames = 0
+        self.idle = False
+        # last count read back from the GPU
+        self.moving_agents: Optional[int] = None
+
+    def bind(self, binding: int):
+        """Reads the counter from latency frames ago, then clears and binds it for this frame."""
+        buffer = self.buffers[self.frame % len(self.buffers)]
+        if self.frame >= len(self.buffers):
+            self._update(int.from_bytes(buffer.read(), "little"))
+        buffer.clear()
+        buffer.bind_to_storage_buffer(binding)
+        self.frame += 1
+
+    def _update(self, moving_agents: int):
+        self.moving_agents = moving_agents
+        if moving_agents:
+            self.quiet_frames = 0
+            if self.idle:
+                self.wake("agents are moving")
+            return
+        self.quiet_frames += 1
+        if not self.idle and self.idle_after and self.quiet_frames >= self.idle_after:
+            self.idle = True
+            logging.info("Scene at rest for %d frames, entering idle", self.quiet_frames)
+
+    def wake(self, reason: str = "cursor moved"):
+        """Leaves idle, the scene has to be quiet for idle_after frames again."""
+        self.quiet_frames = 0
+        if self.idle:
+            self.idle = False
+            logging.info("Leaving idle, %s", reason)
+
+    def release(self):
+        for buffer in self.buffers:
+            buffer.release()
@@ -0,0 +1,806 @@
+"""
+Particle simulation shared by the pixel_particles scripts.
+A script subclasses ParticleRender with its kernel, time uniform and agent layouts
+and ParticleConfig with its defaults.
+"""
+import contextlib
+import logging
+import json
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional, Set, Tuple, Type, Union, List
+
+from moderngl_window import geometry
+import moderngl
+import numpy as np
+from pydantic import BaseSettings, ValidationError, validator
+
+from wallpaper_shaders.common import CONFIG_DIRECTORY
+from wallpaper_shaders.wallpaper_shader_win import WallpaperWindow
+from wallpaper_shaders.agents import AGENT_LAYOUTS, build_agents, layout_defines, sample_agents, splat_radius
+from wallpaper_shaders.cache import MaskCache, load_mask_and_agents
+from wallpaper_shaders.idle import SettleMonitor
+from wallpaper_shaders.active import ActiveAgents
+from wallpaper_shaders.animation import (
+    MaskAnimation, MaskSource, check_image, decode_frame, initial_targets, is_animated, mask_sources
+)
+from wallpaper_shaders.budget import AgentBudget
+from wallpaper_shaders.diffuse import DiffusePass, DiffuseVariant, create_diffuse, tuned_variant
+from wallpaper_shaders.emitter import SparkEmitter
+from wallpaper_shaders.points import TRAIL_RENDERERS, TrailPoints
+from wallpaper_shaders.snapshot import Snapshot, SnapshotWriter, load_snapshot, snapshot_key, snapshot_path
+from wallpaper_shaders.startup import STARTUP
+
+class ParticleConfig(BaseSettings):
+    image: str = "mask.png"
+    color_treshold: Tuple[int, int, int, int] = (10, 10, 10, 255)
+    pull: float = 0.5
+    push: float = 1.0
+    close_treshold: float = 1.0
+    drag: float = 0.99
+    decay: Tuple[float, float, float, float] = (0.01, 0.01, 0.01, 0.0)
+    diffuse: Tuple[float, float, float, float] = (0.9, 0.9, 0.9, 1.0)
+    cache: bool = True
+    settle_speed: float = 4.0
+    settle_radius: float = 8.0
+    settle_drag: float = 0.9
+    idle_after: int = 300
+    idle_fps: float = 4.0
+    idle_simulate: bool = False
+    active_list: bool = False
+    active_bin_size: int = 32
+    active_min_force: float = 0.5
+    diffuse_kernel: str = "auto"
+    sim_scale: float = 1.0
+    agent_layout: str = "float"
+    snapshot: bool = False
+    snapshot_interval: float = 300.0
+    simulation_rate: float = 60.0
+    max_substeps: int = 4
+    max_agents: Union[int, str] = 0
+    splat_radius: Union[int, str] = "auto"
+    agent_budget_ms: float = 4.0
+    trail_renderer: str = "scatter"
+    sparks: int = 0
+    spark_rate: float = 0.5
+    spark_lifetime: int = 90
+    spark_drag: float = 0.95
+    spark_color: Tuple[float, float, float, float] = (1.0, 0.6, 0.2, 1.0)
+    playlist: List[Tuple[str, float]] = []
+    mask_frame_time: float = 0.1
+    mask_prefetch: int = 2
+    dirty_tiles: bool = False
+
+    @validator("color_treshold")
+    @classmethod
+    def color_4_elements(cls, variable):
+        if len(variable) != 4:
+            raise ValueError("Color must have 4 elements(rgba).")
+        return tuple(variable)
+
+    @validator("decay", "diffuse", "spark_color")
+    @classmethod
+    def color_normalized_4_elements(cls, variable):
+        if len(variable) != 4:
+            raise ValueError("Color must have 4 elements(rgba).")
+        for element in variable:
+            if element < 0 or element > 1:
+                raise ValueError("Values must be in interval <0.0, 1.0>")
+        return tuple(variable)
+
+    @validator("idle_fps", "active_bin_size", "active_min_force", "snapshot_interval",
+               "simulation_rate", "max_substeps", "agent_budget_ms", "spark_rate", "spark_lifetime",
+               "mask_frame_time", "mask_prefetch")
+    @classmethod
+    def positive(cls, variable):
+        if variable <= 0:
+            raise ValueError("Must be greater than 0.")
+        return variable
+
+    @validator("sparks")
+    @classmethod
+    def not_negative(cls, variable):
+        if variable < 0:
+            raise ValueError("Must be at least 0.")
+        return variable
+
+    @validator("max_agents", "splat_radius")
+    @classmethod
+    def count_or_auto(cls, variable):
+        if variable != "auto" and (not isinstance(variable, int) or variable < 0):
+            raise ValueError("Must be auto or at least 0.")
+        return variable
+
+    @validator("sim_scale")
+    @classmethod
+    def scale(cls, variable):
+        if variable <= 0 or variable > 1:
+            raise ValueError("Must be in interval (0.0, 1.0>")
+        return variable
+
+    @validator("agent_layout")
+    @classmethod
+    def layout_exists(cls, variable):
+        # the layouts of both agent structs have the same names
+        if variable not in AGENT_LAYOUTS:
+            raise ValueError(f"Must be one of {', '.join(AGENT_LAYOUTS)}.")
+        return variable
+
+    @validator("trail_renderer")
+    @classmethod
+    def renderer_exists(cls, variable):
+        if variable not in TRAIL_RENDERERS:
+            raise ValueError(f"Must be one of {', '.join(TRAIL_RENDERERS)}.")
+        return variable
+
+    @validator("diffuse_kernel")
+    @classmethod
+    def diffuse_variant(cls, variable):
+        if variable != "auto":
+            DiffuseVariant.parse(variable)
+        return variable
+
+    @validator("image")
+    @classmethod
+    def image_exists(cls, variable):
+        # decoding is left to the agent loader, a cached mask is never decoded
+        # a directory holds the frames of an animated mask
+        check_image(variable)
+        return variable
+
+    @validator("playlist")
+    @classmethod
+    def playlist_entries(cls, variable, values):
+        for name, duration in variable:
+            try:
+                check_image(name)
+            except ValueError as error:
+                raise ValueError(f"{name}: {error}")
+            if duration <= 0:
+                raise ValueError("Durations must be greater than 0.")
+        # the active list bins agents by original positions an animation keeps moving
+        if values.get("active_list") and "image" in values:
+            try:
+                animated = is_animated(mask_sources(values["image"], variable, 0.0))
+            except (OSError, ValueError) as error:
+                raise ValueError(f"Could not read the mask frames: {error}")
+            if animated:
+                raise ValueError("Animated masks and playlists do not work with active_list.")
+        return variable
+
+class ParticleRender(WallpaperWindow):
+    """
+    To set a value to a uniform use set_value(name, value)
+    Some values are set by default: u_resolution, u_time, u_mouse
+    """
+    gl_version = (4, 3)
+
+    # set by the scripts
+    config_class: Type[ParticleConfig] = ParticleConfig
+    config_file = "config_pixel_particles.json"
+    # particle kernel in resources/ and the name of its time uniform
+    kernel = "pixel_particles.glsl"
+    time_uniform = "time"
+    # agent_layout config value -> dtype of the Agent struct of the kernel
+    agent_layouts: Dict[str, np.dtype] = AGENT_LAYOUTS
+
+    # files besides the kernel and config fields reload() has to act on
+    SHADER_FILES = {"view.glsl", "diffuse.glsl", "active_agents.glsl", "trail_points.glsl", "sparks.glsl",
+                    "dirty_tiles.glsl"}
+    PIXEL_FIELDS = {"pull", "push", "close_treshold", "drag", "settle_speed", "settle_radius", "settle_drag",
+                    "active_list", "agent_layout", "trail_renderer", "animated", "dirty_tiles"}
+    POINTS_FIELDS = {"trail_renderer", "active_list", "agent_layout", "animated", "dirty_tiles"}
+    # config fields the mask frames are read from
+    FRAME_FIELDS = {"image", "playlist", "mask_frame_time"}
+    SPARK_FIELDS = {"sparks", "spark_lifetime", "spark_drag", "spark_color", "dirty_tiles"}
+    # passes created by reload which own GL objects besides their cached programs
+    PASSES = ("diffuse_pass", "trail_points", "sparks")
+    DIFFUSE_FIELDS = {"decay", "diffuse", "diffuse_kernel", "sim_scale", "dirty_tiles"}
+    AGENT_FIELDS = {"image", "color_treshold", "sim_scale", "agent_layout", "playlist", "mask_frame_time",
+                    "mask_prefetch"}
+    ACTIVE_FIELDS = {"active_list", "active_bin_size"}
+    BUDGET_FIELDS = {"max_agents", "splat_radius", "agent_budget_ms"}
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        with STARTUP.phase("config validation"):
+            self.config = self.load_config()
+        self.simulation_rate = self.config.simulation_rate
+        self.max_substeps = self.config.max_substeps
+
+        # trails, mask and agents are simulated at this size and upscaled by view.glsl
+        self.sim_size = self.simulation_size(self.config)
+
+        self.count = 0  # number of agents
+
+        self.random_generator: np.random.Generator = np.random.default_rng()
+
+        # the image or the playlist entries, a static image has one source of one frame
+        self.mask_sources = self.load_mask_sources(self.config)
+        self.animation: Optional[MaskAnimation] = None
+
+        # a compatible snapshot of the last run is resumed instead of building agents
+        self.snapshots = SnapshotWriter(self.ctx, snapshot_path(self.config_file))
+        self.next_snapshot = self.config.snapshot_interval
+        snapshot = self.load_snapshot() if self.config.snapshot and not self.animated else None
+
+        # Load Mask and generate afents from it while the shaders compile, see upload_agents
+        self.loader = ThreadPoolExecutor(1, thread_name_prefix="AgentLoader")
+        self.agents_future: Optional[Future] = None
+        if snapshot is None:
+            self.agents_future = self.loader.submit(self.build_agents)
+        self.mask = self.agents = None
+        self.mask_texture = self.agent_buffer = None
+        # agents of the mask, agents are the ones at sample simulated within the agent budget
+        self.all_agents = self.sample = None
+        # None unless max_agents is auto
+        self.budget: Optional[AgentBudget] = None
+        self.splat_radius = 0
+
+        self.ctx: moderngl.Context
+        with STARTUP.phase("shader compilation"):
+            self.view_prog = self.create_view_program(self.config)
+            self.pixel_shader = self.create_pixel_shader(self.config)
+            self.trail_points = self.create_trail_points(self.config)
+            self.sparks = self.create_sparks(self.config)
+
+        with STARTUP.phase("diffuse kernel"):
+            self.diffuse_pass = self.create_diffuse_pass(self.config)
+
+        self.create_textures()
+        self.view_fs = geometry.quad_fs()
+
+        self.settle = SettleMonitor(self.ctx, self.config.idle_after)
+
+        # mouse and delta_mouse uniforms, in GL coordinates
+        self.mouse = (0, 0)
+        self.delta_mouse = (0, 0)
+
+        # None simulates every agent every frame, created by upload_agents
+        self.active = None
+
+        if snapshot is not None:
+            self.restore_snapshot(snapshot)
+        # a reload that fails returns to these programs
+        self.shader_cache.commit()
+
+        STARTUP.begin("first frame")
+        STARTUP.begin("first simulated frame")
+
+    @staticmethod
+    def load_mask_sources(config: ParticleConfig) -> List[MaskSource]:
+        return mask_sources(config.image, config.playlist, config.mask_frame_time)
+
+    @property
+    def animated(self) -> bool:
+        """Agents follow the targets of a MaskAnimation instead of their original positions."""
+        return is_animated(self.mask_sources)
+
+    def simulation_size(self, config: ParticleConfig) -> Tuple[int, int]:
+        return tuple(max(1, round(size * config.sim_scale)) for size in self.window_size)
+
+    # the programs of each pass are held in a slot of the shader cache named after it,
+    # the ones of a pass created again are released by the next commit
+    def create_view_program(self, config: ParticleConfig) -> moderngl.Program:
+        with self.shader_cache.slot("view_prog"):
+            return self.load_program(
+                "view.glsl",
+                defines={"REST_OVERLAY": "1" if config.active_list else "0"}
+            )
+
+    def create_pixel_shader(self, config: ParticleConfig) -> moderngl.ComputeShader:
+        with self.shader_cache.slot("pixel_shader"):
+            return self.load_compute_shader(
+                self.kernel,
+                defines={
+                    "PULL": config.pull,
+                    "PUSH": config.push,
+                    "CLOSE_TRESHOLD": config.close_treshold,
+                    "DRAG": config.drag,
+                    "SETTLE_SPEED": f"{config.settle_speed:f}",
+                    "SETTLE_RADIUS": f"{config.settle_radius:f}",
+                    "SETTLE_DRAG": f"{config.settle_drag:f}",
+                    "ACTIVE_LIST": "1" if config.active_list else "0",
+                    "SCATTER_TRAILS": "1" if config.trail_renderer == "scatter" else "0",
+                    "MASK_TARGETS": "1" if self.animated else "0",
+                    "DIRTY_TILES": "1" if config.dirty_tiles else "0",
+                    **layout_defines(config.agent_layout),
+                }
+            )
+
+    def create_trail_points(self, config: ParticleConfig) -> Optional[TrailPoints]:
+        """None when the particle kernel scatters the trails itself."""
+        with self.shader_cache.slot("trail_points"):
+            if config.trail_renderer == "scatter":
+                return None
+            return TrailPoints(self.ctx, self.load_program(
+                "trail_points.glsl",
+                defines={
+                    "SINGLE_COLOR": "0" if "color" in self.agent_layouts[config.agent_layout].names else "1",
+                    "ACTIVE_LIST": "1" if config.active_list else "0",
+                    "MASK_TARGETS": "1" if self.animated else "0",
+                    "DIRTY_TILES": "1" if config.dirty_tiles else "0",
+                    **layout_defines(config.agent_layout),
+                }
+            ))
+
+    def create_sparks(self, config: ParticleConfig) -> Optional[SparkEmitter]:
+        """None without sparks."""
+        with self.shader_cache.slot("sparks"):
+            if not config.sparks:
+                return None
+            defines = {
+                "LIFETIME": config.spark_lifetime,
+                "DRAG": f"{config.spark_drag:f}",
+                "SPARK_COLOR": f"vec4{config.spark_color}",
+                "DIRTY_TILES": "1" if config.dirty_tiles else "0",
+            }
+            return SparkEmitter(
+                self.ctx, config.sparks, config.spark_rate,
+                self.load_compute_shader("sparks.glsl", defines={**defines, "EMIT_PASS": "1"}),
+                self.load_compute_shader("sparks.glsl", defines={**defines, "ARGS_PASS": "1"}),
+                self.load_compute_shader("sparks.glsl", defines=defines),
+            )
+
+    def create_diffuse_pass(self, config: ParticleConfig) -> DiffusePass:
+        size = self.simulation_size(config)
+        defines = {
+            "DECAY": f"vec4{config.decay}",
+            "DIFFUSE": f"vec4{config.diffuse}",
+        }
+        kernel = config.diffuse_kernel
+        if kernel == "auto":
+            # only the fastest of the variants timed by the tuner is held by the slot
+            with self.shader_cache.transient():
+                kernel = tuned_variant(self.ctx, self.load_compute_shader, size, defines).name
+        with self.shader_cache.slot("diffuse_pass"):
+            return create_diffuse(self.ctx, self.load_compute_shader, size, defines, kernel, config.dirty_tiles)
+
+    def create_textures(self):
+        """Allocates the trail textures at sim_size."""
+        self.set_uniform("u_resolution", self.sim_size)
+
+        # RGB_8 texture
+        # filtered when upscaled to the window
+        self.texture_filter = moderngl.NEAREST if self.sim_size == tuple(self.window_size) else moderngl.LINEAR
+        self.texture1 = self.ctx.texture(self.sim_size, 4)
+        self.texture1.filter = self.texture_filter, self.texture_filter
+        self.texture2 = self.ctx.texture(self.sim_size, 4)
+        self.texture2.filter = self.texture_filter, self.texture_filter
+        # targets of trail_points
+        self.framebuffer1 = self.ctx.framebuffer(self.texture1)
+        self.framebuffer2 = self.ctx.framebuffer(self.texture2)
+
+        #odd texture1 or even texture2
+        self.odd = True
+        # texture shown by the last simulated frame, shown again while idle
+        self.display_texture = self.texture1
+
+    def release_textures(self):
+        self.framebuffer1.release()
+        self.framebuffer2.release()
+        self.texture1.release()
+        self.texture2.release()
+
+    def create_active(self, agents: np.ndarray) -> ActiveAgents:
+        with self.shader_cache.slot("active"):
+            active = ActiveAgents(
+                self.ctx, agents, self.sim_size, self.config,
+                self.load_compute_shader("active_agents.glsl"),
+                self.load_compute_shader("active_agents.glsl", defines={"ARGS_PASS": "1"}),
+                self.splat_radius,
+            )
+        active.rest_texture.filter = self.texture_filter, self.texture_filter
+        return active
+
+    def build_agents(self):
+        """Returns (mask, agents), runs on the loader thread."""
+        with STARTUP.phase("mask processing"):
+            if self.animated:
+                # agents of the first frame, the other frames only move their targets
+                mask = decode_frame(self.mask_sources[0].first_frame, self.sim_size)
+                return mask, build_agents(mask, self.config.color_treshold,
+                                          self.agent_layouts[self.config.agent_layout], self.random_generator)
+            return load_mask_and_agents(
+                self.config.image, self.sim_size, self.config.color_treshold,
+                self.agent_layouts[self.config.agent_layout],
+                random_generator=self.random_generator,
+                cache=MaskCache() if self.config.cache else None
+            )
+
+    def snapshot_key(self) -> str:
+        return snapshot_key(self.config.image, self.sim_size, self.config.color_treshold,
+                            self.agent_layouts[self.config.agent_layout])
+
+    def load_snapshot(self) -> Optional[Snapshot]:
+        with STARTUP.phase("snapshot loading"):
+            return load_snapshot(self.snapshots.path, self.snapshot_key(), self.sim_size,
+                                 self.agent_layouts[self.config.agent_layout])
+
+    def restore_snapshot(self, snapshot: Snapshot):
+        """Continues the simulation of the last run from snapshot."""
+        # copied out of the map so the next snapshot can replace the file, Windows refuses while it is mapped
+        self.set_agents(np.array(snapshot.mask), np.array(snapshot.agents))
+        self.texture1.write(snapshot.textures[0])
+        self.texture2.write(snapshot.textures[1])
+        self.diffuse_pass.invalidate()
+        self.odd = snapshot.odd
+        self.display_texture = self.texture2 if self.odd else self.texture1
+        logging.info("Resumed %d agents from %s", self.count, self.snapshots.path)
+
+    def capture_snapshot(self):
+        """Starts writing the running state to the snapshot file."""
+        if self.agent_buffer is None or self.agents_future is not None:
+            # the running agents do not belong to the config until the rebuild is uploaded
+            return
+        if self.animation is not None:
+            # the targets of the animation are not part of a snapshot
+            return
+        self.snapshots.capture(self.snapshot_key(), self.agent_buffer, self.count,
+                               (self.texture1, self.texture2), self.mask, self.odd,
+                               None if self.sample is None else (self.all_agents, self.sample))
+
+    def upload_agents(self, block: bool = False) -> bool:
+        """
+        Uploads the mask and agents once the loader has built them.
+        Returns False while there are no agents to simulate, unless block waits for them.
+        """
+        if self.agents_future is not None and (block or self.agents_future.done()):
+            future, self.agents_future = self.agents_future, None
+            try:
+                mask, agents = future.result()
+            except (OSError, ValueError) as error:
+                if self.agent_buffer is None:
+                    raise
+                logging.error("Could not rebuild the agents, keeping the old ones", exc_info=error)
+            else:
+                self.set_agents(mask, agents)
+        return self.agent_buffer is not None
+
+    def create_budget(self, total: int) -> Optional[AgentBudget]:
+        if self.config.max_agents != "auto":
+            return None
+        return AgentBudget(self.ctx, total, self.config.agent_budget_ms)
+
+    def agent_budget(self, total: int) -> int:
+        """Number of the total agents to simulate."""
+        if self.budget is not None:
+            return self.budget.budget
+        return self.config.max_agents or total
+
+    def set_agents(self, mask: np.ndarray, agents: np.ndarray):
+        """Puts mask and agents on the GPU in place of the previous ones, sampled down to the agent budget."""
+        self.release_agents()
+        self.mask, self.all_agents = mask, agents
+        self.budget = self.create_budget(len(agents))
+        if self.animated:
+            self.animation = MaskAnimation(self.ctx, self.mask_sources, self.config.mask_frame_time, self.sim_size,
+                                           self.config.color_treshold, initial_targets(agents),
+                                           self.config.mask_prefetch)
+        with STARTUP.phase("buffer upload"):
+            # flipped because GL textures start at the bottom row
+            self.mask_texture = self.ctx.texture(self.sim_size, 4, np.ascontiguousarray(self.mask[::-1]))
+            self.set_sample(sample_agents(agents, self.agent_budget(len(agents))))
+        # the programs the previous agents kept running are not used anymore
+        self.shader_cache.commit()
+
+    def set_sample(self, sample: Optional[np.ndarray], agents: Optional[np.ndarray] = None):
+        """
+        Simulates the agents of all_agents at sample, None simulates all of them.
+        agents replaces their state, by default they start from the mask.
+        """
+        if self.agent_buffer is not None:
+            self.agent_buffer.release()
+        if self.active is not None:
+            self.active.release()
+            self.active = None
+        if agents is None:
+            agents = self.all_agents if sample is None else self.all_agents[sample]
+        self.sample, self.agents = sample, agents
+        if self.animation is not None:
+            self.animation.set_sample(sample)
+
+        # Agent buffer, the structured array already has the GLSL layout picked by agent_layout
+        self.agent_buffer = self.ctx.buffer(self.agents)
+
+        self.count = len(self.agents)
+        self.set_uniform("agents_count", self.count)
+        self.splat_radius = splat_radius(self.config.splat_radius, len(self.all_agents), self.count)
+        self.set_uniform("splat_radius", self.splat_radius)
+
+        if self.config.active_list:
+            self.active = self.create_active(self.agents)
+            self.view_prog["rest_texture"].value = 1
+
+    def resample_agents(self, count: int):
+        """Simulates count agents instead, agents simulated before and after keep their state."""
+        sample = sample_agents(self.all_agents, count)
+        agents = np.array(self.all_agents) if sample is None else self.all_agents[sample]
+        current = np.frombuffer(self.agent_buffer.read(), dtype=self.agents.dtype)
+        everything = np.arange(len(self.all_agents))
+        old = everything if self.sample is None else self.sample
+        new = everything if sample is None else sample
+        kept = np.isin(new, old, assume_unique=True)
+        agents[kept] = current[np.searchsorted(old, new[kept])]
+        self.set_sample(sample, agents)
+        logging.info("Simulating %d of %d agents", self.count, len(self.all_agents))
+
+    def release_agents(self):
+        if self.agent_buffer is not None:
+            self.mask_texture.release()
+            self.agent_buffer.release()
+            self.mask_texture = self.agent_buffer = None
+            self.count = 0
+        if self.active is not None:
+            self.active.release()
+            self.active = None
+        if self.animation is not None:
+            self.animation.release()
+            self.animation = None
+
+    def reload(self, paths: Set[str]):
+        """
+        Applies changes of the config and shader files in paths.
+        Only programs depending on them are recompiled and agents are only rebuilt
+        when their mask changed. If anything fails to load the running state is kept.
+        """
+        config = self.config
+        if str(CONFIG_DIRECTORY.joinpath(self.config_file)) in paths:
+            try:
+                config = self.load_config()
+            except (ValidationError, json.JSONDecodeError, OSError):
+                return
+        fields = {name for name in config.__fields__ if getattr(config, name) != getattr(self.config, name)}
+        files = {os.path.basename(path) for path in paths}
+        if config.image in files:
+            fields.add("image")
+        shader_files = self.SHADER_FILES | {self.kernel}
+        if not fields and not files & shader_files:
+            return
+        logging.info("Reloading %s", ", ".join(sorted(fields | (files & shader_files))))
+
+        sources = self.mask_sources
+        if fields & self.FRAME_FIELDS:
+            try:
+                sources = self.load_mask_sources(config)
+            except (OSError, ValueError) as error:
+                logging.error("Reload failed, could not read the mask frames: %s", error)
+                return
+            if is_animated(sources) != self.animated:
+                fields.add("animated")
+        # the programs are compiled for the new frames
+        previous_sources, self.mask_sources = self.mask_sources, sources
+
+        programs = {}
+        try:
+            if "view.glsl" in files or "active_list" in fields:
+                programs["view_prog"] = self.create_view_program(config)
+            if self.kernel in files or fields & self.PIXEL_FIELDS:
+                programs["pixel_shader"] = self.create_pixel_shader(config)
+            if files & {"diffuse.glsl", "dirty_tiles.glsl"} or fields & self.DIFFUSE_FIELDS:
+                programs["diffuse_pass"] = self.create_diffuse_pass(config)
+            if "trail_points.glsl" in files or fields & self.POINTS_FIELDS:
+                programs["trail_points"] = self.create_trail_points(config)
+            if "sparks.glsl" in files or fields & self.SPARK_FIELDS:
+                programs["sparks"] = self.create_sparks(config)
+            if "active_agents.glsl" in files:
+                # compiled here to catch errors, the new list takes it from the shader cache
+                fields.add("active_list")
+                self.load_compute_shader("active_agents.glsl")
+        except moderngl.Error as error:
+            logging.error("Reload failed, keeping the running programs: %s", error)
+            self.mask_sources = previous_sources
+            self.shader_cache.rollback()
+            for name in self.PASSES:
+                if programs.get(name) is not None:
+                    programs[name].release()
+            return
+        self.shader_cache.report()
+
+        self.config = config
+        for name in self.PASSES:
+            if name in programs and getattr(self, name) is not None:
+                getattr(self, name).release()
+        for name, program in programs.items():
+            setattr(self, name, program)
+        if self.active is not None and not config.active_list:
+            # the new programs do not use the list, even before the agents are rebuilt
+            self.active.release()
+            self.active = None
+        if self.active is not None:
+            self.view_prog["rest_texture"].value = 1
+        self.set_uniform("agents_count", self.count)
+        self.set_uniform("u_resolution", self.sim_size)
+        self.set_uniform("mouse", self.mouse)
+        self.set_uniform("delta_mouse", self.delta_mouse)
+        self.set_uniform("splat_radius", self.splat_radius)
+        self.settle.idle_after = config.idle_after
+        self.simulation_rate = config.simulation_rate
+        self.max_substeps = config.max_substeps
+        self.settle.wake("reloaded")
+
+        if "sim_scale" in fields:
+            self.sim_size = self.simulation_size(config)
+            self.release_textures()
+            self.create_textures()
+        if fields & self.AGENT_FIELDS:
+            if fields & {"sim_scale", "agent_layout", "animated"}:
+                # the running agents do not fit the textures or the kernel anymore
+                self.release_agents()
+            self.agents_future = self.loader.submit(self.build_agents)
+        elif fields & self.ACTIVE_FIELDS and self.agent_buffer is not None:
+            # the list assumes every agent starts at rest, so the agents start over
+            self.set_agents(self.mask, self.all_agents)
+        elif fields & self.BUDGET_FIELDS and self.agent_buffer is not None:
+            self.budget = self.create_budget(len(self.all_agents))
+            self.resample_agents(self.agent_budget(len(self.all_agents)))
+        if self.active is not None:
+            self.active.push = config.push
+            self.active.min_force = config.active_min_force
+        if self.sparks is not None:
+            self.sparks.rate = config.spark_rate
+        # the running agents use the replaced active list shaders until the rebuilt ones are uploaded
+        self.shader_cache.commit(release=self.agents_future is None)
+
+    @classmethod
+    def load_config(cls) -> ParticleConfig:
+        """Loads and validates config_file from the config directory."""
+        try:
+            with open(CONFIG_DIRECTORY.joinpath(cls.config_file)) as file:
+                config_json = json.load(file)
+            return cls.config_class(**config_json)
+        except (ValidationError, json.JSONDecodeError) as error:
+            logging.error("%s is invalid", cls.config_file, exc_info=error)
+            raise
+
+    def set_uniform(self, name, value: Any):
+        """Method for inputting a value to a uniform."""
+        try:
+            self.pixel_shader[name].value = value
+        except KeyError:
+            pass
+
+    def mouse_position_event(self, x, y, dx, dy):
+        if dx or dy:
+            self.settle.wake()
+        # treshold in window pixels, uniforms in simulation pixels
+        scale = self.config.sim_scale
+        self.mouse = (x*scale, (self.window_size[1]-y)*scale)
+        if abs(dx) + abs(dy) > 30:
+            self.delta_mouse = (dx*scale, -dy*scale)
+        else:
+            self.delta_mouse = (0, 0)
+        self.set_uniform("mouse", self.mouse)
+        self.set_uniform("delta_mouse", self.delta_mouse)
+
+    def render(self, time, frame_time):
+        super().render(time, frame_time)
+        self.snapshots.poll()
+        with self.profiler.stage("clear"):
+            self.ctx.clear(0.2, 0.2, 0.2)
+
+        if not self.upload_agents():
+            # empty trails until the agents are built
+            self.present(self.display_texture)
+            return
+
+        if self.animation is not None and self.animation.update(time):
+            self.settle.wake("the mask changed")
+
+        steps = self.steps
+        if self.settle.idle:
+            # throttle the whole loop, cursor movement ends the wait early
+            self.wait_for_input(1 / self.config.idle_fps)
+            if not self.config.idle_simulate:
+                self.present(self.display_texture)
+                return
+            # throttled frames simulate at most once
+            steps = min(steps, 1)
+
+        if not steps:
+            # the display refreshes faster than the simulation, show the last simulated frame
+            self.present(self.display_texture)
+            return
+
+        if self.budget is not None:
+            count = self.budget.update()
+            if count is not None:
+                self.resample_agents(count)
+
+        self.set_uniform(self.time_uniform, time)
+        measure = self.budget.measure(steps, self.profiler) if self.budget is not None else contextlib.nullcontext()
+        with measure:
+            for step in range(steps):
+                if step == 1:
+                    # the cursor movement of the frame pushes only once
+                    self.set_uniform("delta_mouse", (0, 0))
+                self.display_texture = self.simulate(self.delta_mouse if step == 0 else (0, 0))
+        if steps > 1:
+            self.set_uniform("delta_mouse", self.delta_mouse)
+        self.present(self.display_texture)
+
+        if self.config.snapshot and time >= self.next_snapshot:
+            self.next_snapshot = time + self.config.snapshot_interval
+            self.capture_snapshot()
+
+        if not STARTUP.reported:
+            STARTUP.end("first simulated frame")
+            STARTUP.report()
+
+    def simulate(self, delta_mouse) -> moderngl.Texture:
+        """Runs one simulation step, returns the texture it drew the agents to."""
+        # Switch Previous Texture
+        if self.odd:
+            read_texture = self.texture1
+            write_texture = self.texture2
+            read_framebuffer = self.framebuffer1
+        else:
+            write_texture = self.texture1
+            read_texture = self.texture2
+            read_framebuffer = self.framebuffer2
+
+        self.odd = not self.odd
+
+        read_texture.bind_to_image(0, read=True, write=False)
+        write_texture.bind_to_image(1, read=False, write=True)
+
+        # diffuse pixels
+        with self.profiler.stage("diffuse"):
+            self.diffuse_pass.run()
+
+        # bind angents
+        self.agent_buffer.bind_to_storage_buffer(2)
+        if self.animation is not None:
+            self.animation.bind()
+
+        self.mask_texture.bind_to_image(3, read=True, write=False)
+        self.settle.bind(4)
+
+        with self.profiler.stage("particles"):
+            if self.active is None:
+                self.pixel_shader.run(self.count // 16 + 1, 1, 1)
+            else:
+                self.active.run(self.pixel_shader, self.mouse, delta_mouse)
+
+        if self.trail_points is not None:
+            with self.profiler.stage("points"):
+                self.trail_points.run(read_framebuffer, self.count, self.sim_size, self.splat_radius)
+
+        if self.sparks is not None:
+            with self.profiler.stage("sparks"):
+                self.sparks.run(self.mouse, delta_mouse, self.splat_radius)
+
+        return read_texture
+
+    def present(self, texture):
+        """Draws texture to the screen."""
+        texture.use(0)
+        if self.active is not None:
+            self.active.rest_texture.use(1)
+        with self.profiler.stage("view"):
+            self.view_fs.render(self.view_prog)
+        if not STARTUP.reported:
+            STARTUP.end("first frame")
+
+    def close(self):
+        # collect the last timer queries while the context is alive
+        self.profiler.close()
+        self.loader.shutdown()
+        if self.config.snapshot:
+            self.capture_snapshot()
+        self.snapshots.close()
+        if self.diffuse_pass.tiles is not None and self.diffuse_pass.tiles.processed_fraction is not None:
+            logging.info("The diffuse pass processed %.1f%% of the tiles",
+                         100 * self.diffuse_pass.tiles.processed_fraction)
+        self.diffuse_pass.release()
+        for name in ("trail_points", "sparks"):
+            if getattr(self, name) is not None:
+                getattr(self, name).release()
+        self.release_textures()
+        self.release_agents()
+        self.settle.release()
+        self.view_fs.release()
+        self.shader_cache.report()
+        self.shader_cache.release()
+        self.ctx.release()
+        return super().close()
@@ -0,0 +1,43 @@
+"""
+Trail renderer drawing the agents as instanced points, trail_renderer "points" in the particle configs.
+The particle kernel only moves the agents, trail_points.glsl reads them from the agent buffer
+and draws them into a framebuffer of the trail texture with additive blending.
+"""
+from typing import Tuple
+
+import moderngl
+
+# trail_renderer config values, scatter stores the pixels in the particle kernel
+TRAIL_RENDERERS = ("scatter", "points")
+
+
+class TrailPoints:
+    """
+    Draws the agents of the buffer bound to storage binding 2, and with the active list
+    only those flagged in binding 7, into framebuffer. Agents need no vertex buffer,
+    instance i is agent i.
+    """
+
+    def __init__(self, ctx: moderngl.Context, program: moderngl.Program):
+        self.ctx = ctx
+        self.program = program
+        self.vao = ctx.vertex_array(program, [])
+
+    def run(self, framebuffer: moderngl.Framebuffer, count: int, size: Tuple[int, int], splat_radius: int):
+        self.program["u_resolution"].value = size
+        self.program["splat_radius"].value = splat_radius
+        # the particle kernel just wrote the agent buffer
+        self.ctx.memory_barrier()
+        previous = self.ctx.fbo
+        framebuffer.use()
+        self.ctx.enable(moderngl.BLEND | moderngl.PROGRAM_POINT_SIZE)
+        self.ctx.blend_func = moderngl.ONE, moderngl.ONE
+        self.vao.render(moderngl.POINTS, vertices=1, instances=count)
+        self.ctx.blend_func = moderngl.DEFAULT_BLENDING
+        self.ctx.disable(moderngl.BLEND | moderngl.PROGRAM_POINT_SIZE)
+        if previous is not None:
+            previous.use()
+
+    def release(self):
+        # the program belongs to the shader cache
+        self.vao.release()
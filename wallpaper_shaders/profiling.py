@@ -0,0 +1,146 @@
+"""
+Opt-in per stage CPU and GPU timing of the render loop.
+GPU times come from GL timer queries that are read a few frames later,
+so profiling never waits for the GPU to finish the current frame.
+"""
+import collections
+import contextlib
+import json
+import logging
+import time
+from typing import Deque, Dict, List, Optional, Tuple
+
+import moderngl
+
+# frame -> stage -> (cpu ms, gpu ms)
+FrameTimes = Dict[str, Tuple[float, Optional[float]]]
+
+
+class FrameProfiler:
+    """
+    Times stages of a frame, usage:
+        profiler.begin_frame()
+        with profiler.stage("diffuse"):
+            ...
+    A stage entered several times in a frame, e.g. by simulation substeps, is timed as the sum.
+    Inside without_gpu() stages are only timed on the CPU, GL does not nest time queries.
+    Queries are reused after latency frames, which is when their results are read.
+    Results of the last history frames are kept for averages and dumps.
+    """
+
+    def __init__(self, ctx: Optional[moderngl.Context], enabled: bool = True, latency: int = 3,
+                 history: int = 600, log_interval: float = 5.0, output: Optional[str] = None):
+        self.ctx = ctx
+        self.enabled = enabled
+        self.latency = latency
+        self.log_interval = log_interval
+        self.output = output
+
+        self.history: Deque[FrameTimes] = collections.deque(maxlen=history)
+        # ring of frames waiting for their queries, each is stage -> (cpu ms, queries)
+        self._pending: Deque[Dict[str, Tuple[float, List[moderngl.Query]]]] = collections.deque()
+        self._free_queries: List[moderngl.Query] = []
+        self._frame: Optional[Dict[str, Tuple[float, List[moderngl.Query]]]] = None
+        self._gpu_paused = False
+        self._last_log = time.perf_counter()
+
+    def _query(self) -> Optional[moderngl.Query]:
+        if self.ctx is None:
+            return None
+        if self._free_queries:
+            return self._free_queries.pop()
+        return self.ctx.query(time=True)
+
+    def _collect(self, frame: Dict[str, Tuple[float, List[moderngl.Query]]]):
+        times = {}
+        for name, (cpu, queries) in frame.items():
+            gpu = None
+            if queries:
+                gpu = sum(query.elapsed for query in queries) / 1e6
+                self._free_queries.extend(queries)
+            times[name] = (cpu, gpu)
+        self.history.append(times)
+
+    def begin_frame(self):
+        """Ends the previous frame and collects the results of the one latency frames ago."""
+        if not self.enabled:
+            return
+        if self._frame:
+            self._pending.append(self._frame)
+        while len(self._pending) >= self.latency:
+            self._collect(self._pending.popleft())
+        self._frame = {}
+
+        now = time.perf_counter()
+        if self.log_interval and now - self._last_log >= self.log_interval and self.history:
+            self._last_log = now
+            logging.info("Frame profile: %s", ", ".join(
+                f"{name} {cpu:.2f}/{gpu:.2f} ms" if gpu is not None else f"{name} {cpu:.2f} ms"
+                for name, (cpu, gpu) in self.averages().items()
+            ))
+
+    @contextlib.contextmanager
+    def stage(self, name: str, gpu: bool = True):
+        """Times the body as stage name, gpu=False for stages that do not issue GL commands."""
+        if not self.enabled or self._frame is None:
+            yield
+            return
+        query = self._query() if gpu and not self._gpu_paused else None
+        start = time.perf_counter()
+        if query is not None:
+            with query:
+                yield
+        else:
+            yield
+        cpu, queries = self._frame.get(name, (0.0, []))
+        if query is not None:
+            queries.append(query)
+        self._frame[name] = (cpu + (time.perf_counter() - start) * 1000, queries)
+
+    @contextlib.contextmanager
+    def without_gpu(self):
+        """Stages of the body skip their timer queries, for a time query around them."""
+        paused, self._gpu_paused = self._gpu_paused, True
+        try:
+            yield
+        finally:
+            self._gpu_paused = paused
+
+    def averages(self) -> Dict[str, Tuple[float, Optional[float]]]:
+        """Returns stage -> (mean cpu ms, mean gpu ms) over the kept history."""
+        sums: Dict[str, List[float]] = {}
+        counts: Dict[str, List[int]] = {}
+        for frame in self.history:
+            for name, (cpu, gpu) in frame.items():
+                total = sums.setdefault(name, [0.0, 0.0])
+                count = counts.setdefault(name, [0, 0])
+                total[0] += cpu
+                count[0] += 1
+                if gpu is not None:
+                    total[1] += gpu
+                    count[1] += 1
+        return {name: (total[0] / counts[name][0],
+                       total[1] / counts[name][1] if counts[name][1] else None)
+                for name, total in sums.items()}
+
+    def dump(self, path: str):
+        """Writes the averages and the per frame history as json."""
+        with open(path, "w") as file:
+            json.dump({
+                "averages_ms": {name: {"cpu": cpu, "gpu": gpu} for name, (cpu, gpu) in self.averages().items()},
+                "frames_ms": [{name: {"cpu": cpu, "gpu": gpu} for name, (cpu, gpu) in frame.items()}
+                              for frame in self.history],
+            }, file, indent=1)
+
+    def close(self):
+        """Collects the frames still in flight and dumps to output if set, only the first call does anything."""
+        if not self.enabled:
+            return
+        if self._frame:
+            self._pending.append(self._frame)
+        while self._pending:
+            self._collect(self._pending.popleft())
+        self._frame = None
+        self.enabled = False
+        if self.output:
+            self.dump(self.output)
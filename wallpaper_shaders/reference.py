@@ -0,0 +1,242 @@
+"""
+Headless NumPy implementation of the particle and diffuse compute kernels.
+Mirrors one ComputeRender.render() call per step, including which texture
+each kernel reads and writes, so it can be used as a fallback renderer on
+machines without GL 4.3 and as the oracle for GPU regression tests.
+run with: python -m wallpaper_shaders.reference --steps 120 --output frame.png
+"""
+import argparse
+import importlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+
+from wallpaper_shaders.agents import SINGLE_COLOR_TRAIL, to_unorm8, unpack_agents
+
+MousePath = Callable[[int], Tuple[Tuple[float, float], Tuple[float, float]]]
+
+
+def distance_line(line_p1: np.ndarray, line_p2: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """distance_line from the particle kernels, NaN when the line has zero length."""
+    direction = line_p2 - line_p1
+    cross = np.abs(direction[0] * (line_p1[1] - points[:, 1]) - (line_p1[0] - points[:, 0]) * direction[1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return cross / np.sqrt(direction[0] ** 2 + direction[1] ** 2)
+
+
+class ReferenceEngine:
+    """
+    Simulates agents and the two ping-pong trail textures on the CPU.
+    config is a Config of either particle module, the kernel is picked from the agent layout,
+    packed layouts are simulated unpacked.
+    Textures are (height, width, 4) uint8 arrays indexed [y, x] like imageLoad/imageStore.
+    """
+
+    def __init__(self, config, agents: np.ndarray, size: Tuple[int, int],
+                 workers: Optional[int] = None, tile_height: int = 64):
+        self.config = config
+        # writable copy, cached agents are read only maps, half velocities are not rounded like on the GPU
+        self.agents = unpack_agents(agents)
+        self.size = size
+        self.single_color = "color" not in self.agents.dtype.names
+        self.tile_height = tile_height
+
+        self.pull = np.float32(config.pull)
+        self.push = np.float32(config.push)
+        self.close_treshold = np.float32(config.close_treshold)
+        self.drag = np.float32(config.drag)
+        self.settle_speed = np.float32(config.settle_speed)
+        self.settle_radius = np.float32(config.settle_radius)
+        self.settle_drag = np.float32(config.settle_drag)
+        self.decay = np.asarray(config.decay, dtype=np.float32)
+        self.diffuse = np.asarray(config.diffuse, dtype=np.float32)
+
+        self.texture1 = np.zeros((size[1], size[0], 4), dtype=np.uint8)
+        self.texture2 = np.zeros((size[1], size[0], 4), dtype=np.uint8)
+        #odd texture1 or even texture2
+        self.odd = True
+
+        self.mouse = np.zeros(2, dtype=np.float32)
+        self.delta_mouse = np.zeros(2, dtype=np.float32)
+        # same as the StatsBlock counter after the last step
+        self.moving_agents = 0
+
+        self.executor = ThreadPoolExecutor(workers or os.cpu_count())
+
+    def set_mouse(self, mouse: Tuple[float, float], delta_mouse: Tuple[float, float]):
+        """Same as the mouse and delta_mouse uniforms, in GL coordinates."""
+        self.mouse = np.asarray(mouse, dtype=np.float32)
+        self.delta_mouse = np.asarray(delta_mouse, dtype=np.float32)
+
+    def _tiles(self, length: int, tile: int) -> Iterator[Tuple[int, int]]:
+        for start in range(0, length, tile):
+            yield start, min(start + tile, length)
+
+    def diffuse_step(self, read_texture: np.ndarray, write_texture: np.ndarray):
+        """diffuse.glsl, 3x3 box blur mixed by DIFFUSE minus DECAY, outside of the image reads as 0."""
+        padded = np.pad(read_texture.astype(np.float32) / np.float32(255), ((1, 1), (1, 1), (0, 0)))
+        width = self.size[0]
+
+        def diffuse_tile(rows):
+            start, end = rows
+            color_sum = np.zeros((end - start, width, 4), dtype=np.float32)
+            for offset_y in range(3):
+                for offset_x in range(3):
+                    color_sum += padded[start + offset_y:end + offset_y, offset_x:offset_x + width]
+            og_color = padded[start + 1:end + 1, 1:width + 1]
+            color = og_color * (1 - self.diffuse) + (color_sum / np.float32(9)) * self.diffuse
+            write_texture[start:end] = to_unorm8(color - self.decay)
+
+        list(self.executor.map(diffuse_tile, self._tiles(self.size[1], self.tile_height)))
+
+    def _move_agents(self, agents: np.ndarray, img_input: np.ndarray):
+        """Particle kernel for a slice of agents, returns the trail writes as (x, y, rgba8) and moving agents."""
+        image_size = np.asarray(self.size, dtype=np.float32)
+        pos = agents["position"]
+        velocity = agents["velocity"].copy()
+        original_postion = agents["original_postion"]
+
+        distance_mouse = distance_line(self.mouse, self.mouse - self.delta_mouse, pos)
+        # GLSL max with a NaN operand returns the other one
+        force = self.delta_mouse / np.fmax(distance_mouse, np.float32(1.0))[:, None]
+        velocity += force * self.push
+
+        to_original = original_postion - pos
+        distance_original = np.sqrt(np.sum(to_original ** 2, axis=-1))
+        far = distance_original > self.close_treshold
+        angle = np.arctan2(to_original[far, 1], to_original[far, 0])
+        velocity[far] += np.stack((np.cos(angle), np.sin(angle)), axis=-1) * self.pull
+
+        velocity *= self.drag
+
+        # agents close to their original position are slowed more and slow ones lose the velocity that orbits it
+        close = far & (distance_original < self.settle_radius)
+        velocity[close] *= self.settle_drag
+        radial = close & (np.sqrt(np.sum(velocity ** 2, axis=-1)) < self.settle_speed)
+        direction = to_original[radial] / distance_original[radial, None]
+        velocity[radial] = direction * np.sum(velocity[radial] * direction, axis=-1)[:, None]
+
+        newpos = pos + velocity
+
+        # stop on the original position if this step passes close enough to it
+        step_delta = newpos - pos
+        along = np.clip(np.sum(to_original * step_delta, axis=-1)
+                        / np.maximum(np.sum(step_delta ** 2, axis=-1), np.float32(0.000001)), 0.0, 1.0)
+        closest = np.sqrt(np.sum((pos + step_delta * along[:, None] - original_postion) ** 2, axis=-1))
+        settled = ((distance_original > 0) & (np.sqrt(np.sum(velocity ** 2, axis=-1)) < self.settle_speed)
+                   & (closest <= self.close_treshold))
+        newpos[settled] = original_postion[settled]
+        velocity[settled] = 0
+        moving = int(np.count_nonzero(np.any((newpos != original_postion) | (velocity != 0), axis=-1)))
+
+        outside = np.any((newpos > image_size) | (newpos < 0), axis=-1)
+        newpos[outside] = np.minimum(image_size - np.float32(0.001),
+                                     np.maximum(newpos[outside] - np.float32(0.001), np.float32(0.0)))
+
+        inside = ~outside
+        cords = newpos[inside].astype(np.int32)
+        # newpos == IMAGE_SIZE passes the bounds check but imageStore drops it
+        stored = np.all(cords < self.size, axis=-1)
+        cords = cords[stored]
+        distance_original = distance_original[inside][stored]
+
+        if self.single_color:
+            color = img_input[cords[:, 1], cords[:, 0]].astype(np.float32) / np.float32(255)
+            color += SINGLE_COLOR_TRAIL
+            color[:, 0] += np.float32(0.01 * 2.75) * distance_original / np.float32(10)
+        else:
+            speed = np.sum(np.abs(velocity[inside][stored]), axis=-1)
+            cut_color = np.maximum((distance_original / image_size[0]) * np.float32(0.05) + speed * np.float32(0.2),
+                                   np.float32(1.0))
+            color = agents["color"][inside][stored].copy()
+            color[:, 0] *= cut_color
+            color[:, 1] *= np.maximum(cut_color * np.float32(0.5), np.float32(1.0))
+
+        agents["position"] = newpos
+        agents["velocity"] = velocity
+        return cords, to_unorm8(color), moving
+
+    def particle_step(self, img_input: np.ndarray, img_output: np.ndarray, chunk: int = 1 << 16):
+        """
+        Particle kernel over all agents, chunks run on the worker threads.
+        Colliding writes keep the highest agent index, the GPU keeps an arbitrary one.
+        """
+        chunks = [self.agents[start:end] for start, end in self._tiles(len(self.agents), chunk)]
+        self.moving_agents = 0
+        for cords, colors, moving in self.executor.map(lambda agents: self._move_agents(agents, img_input), chunks):
+            img_output[cords[:, 1], cords[:, 0]] = colors
+            self.moving_agents += moving
+
+    def step(self) -> np.ndarray:
+        """One ComputeRender.render(), returns the texture that gets displayed."""
+        if self.odd:
+            read_texture, write_texture = self.texture1, self.texture2
+        else:
+            read_texture, write_texture = self.texture2, self.texture1
+        self.odd = not self.odd
+
+        self.diffuse_step(read_texture, write_texture)
+        # image bindings are swapped in the particle kernels
+        self.particle_step(write_texture, read_texture)
+        return read_texture
+
+    def run(self, steps: int, mouse_path: Optional[MousePath] = None) -> np.ndarray:
+        """Runs a batch of steps, mouse_path(step) returns (mouse, delta_mouse) for each step."""
+        frame = self.texture1 if self.odd else self.texture2
+        for step in range(steps):
+            if mouse_path is not None:
+                self.set_mouse(*mouse_path(step))
+            frame = self.step()
+        return frame
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def mouse_swipe(size: Tuple[int, int], steps: int, repeats: int = 1) -> MousePath:
+    """Mouse path going left to right through the middle of the screen repeats times in steps."""
+    speed = size[0] * repeats / steps
+
+    def path(step):
+        x = (step * speed) % size[0]
+        delta = speed if x >= speed else 0.0
+        return (x, size[1] / 2), (delta, 0.0)
+    return path
+
+
+def load_config(script_name: str):
+    """Loads the config of a shader script with its Config model."""
+    script = importlib.import_module("wallpaper_shaders." + script_name)
+    return script.ComputeRender.load_config()
+
+
+def main(args: Sequence[str] = None):
+    from PIL import Image
+    from wallpaper_shaders.agents import AGENT_DTYPE, AGENT_SINGLE_COLOR_DTYPE
+    from wallpaper_shaders.cache import MaskCache, load_mask_and_agents
+
+    parser = argparse.ArgumentParser(description="Render the particle simulation on the CPU.")
+    parser.add_argument("--script", default="pixel_particles",
+                        choices=("pixel_particles", "pixel_particles_single_color"))
+    parser.add_argument("--size", type=int, nargs=2, default=(1280, 720))
+    parser.add_argument("--steps", type=int, default=120)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default="reference.png")
+    values = parser.parse_args(args)
+
+    config = load_config(values.script)
+    dtype = AGENT_DTYPE if values.script == "pixel_particles" else AGENT_SINGLE_COLOR_DTYPE
+    size = tuple(values.size)
+    _, agents = load_mask_and_agents(config.image, size, config.color_treshold, dtype,
+                                     cache=MaskCache() if config.cache else None)
+
+    engine = ReferenceEngine(config, agents, size, workers=values.workers)
+    frame = engine.run(values.steps, mouse_swipe(size, values.steps))
+    engine.close()
+    Image.fromarray(frame[::-1]).save(values.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+Cache of compiled shader variants.
+A variant is the shader source, its defines and the driver it was compiled for,
+so hot reload, diffuse tuning and parameter sweeps compile each variant once.
+Compute shaders are also kept across runs as program binaries of the driver,
+loaded with glProgramBinary instead of being compiled from source.
+"""
+import contextlib
+import ctypes
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+import moderngl
+
+from wallpaper_shaders.common import CACHE_DIRECTORY
+
+# arguments of load_program and load_compute_shader naming shader files
+SHADER_ARGUMENTS = ("path", "vertex_shader", "geometry_shader", "fragment_shader",
+                    "tess_control_shader", "tess_evaluation_shader")
+
+BINARY_DIRECTORY = CACHE_DIRECTORY.joinpath("programs")
+
+# ARB_get_program_binary, core since GL 4.1
+GL_PROGRAM_BINARY_LENGTH = 0x8741
+GL_NUM_PROGRAM_BINARY_FORMATS = 0x87FE
+GL_LINK_STATUS = 0x8B82
+
+# glProgramBinary replaces the whole program, moderngl only needs an object to wrap it
+PLACEHOLDER_COMPUTE_SHADER = "#version 430\nlayout(local_size_x = 1) in;\nvoid main() {}\n"
+# attributes of the uniforms and blocks of moderngl that belong to a running program
+MEMBER_RUNTIME_ATTRIBUTES = ("program_obj", "ctx", "extra")
+
+
+class ProgramBinaries:
+    """
+    Directory of compute shader binaries, one file per shader cache key.
+    A binary is loaded into a placeholder compute shader and the uniforms and blocks
+    moderngl found when it was compiled from source are restored with it.
+    Binaries the driver rejects are compiled from source again and replaced, the
+    max_entries least recently used files are kept.
+    Render programs are not stored, their vertex attributes are reflected by moderngl as well.
+    """
+
+    def __init__(self, ctx: moderngl.Context, directory=BINARY_DIRECTORY, max_entries: int = 256):
+        self.ctx = ctx
+        self.directory = str(directory)
+        self.max_entries = max_entries
+        # the function loader of the glcontext backend of moderngl
+        loader = getattr(getattr(ctx.mglo, "_context", None), "load_opengl_function", None)
+        if loader is None:
+            raise OSError("The GL context has no function loader")
+        function_type = ctypes.WINFUNCTYPE if sys.platform == "win32" else ctypes.CFUNCTYPE
+
+        def function(name, *argtypes):
+            address = loader(name)
+            if not address:
+                raise OSError(f"{name} is not available")
+            return function_type(None, *argtypes)(address)
+
+        self.glGetIntegerv = function("glGetIntegerv", ctypes.c_uint, ctypes.POINTER(ctypes.c_int))
+        self.glGetProgramiv = function("glGetProgramiv", ctypes.c_uint, ctypes.c_uint, ctypes.POINTER(ctypes.c_int))
+        self.glGetProgramBinary = function("glGetProgramBinary", ctypes.c_uint, ctypes.c_int,
+                                           ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_uint),
+                                           ctypes.c_void_p)
+        self.glProgramBinary = function("glProgramBinary", ctypes.c_uint, ctypes.c_uint, ctypes.c_char_p,
+                                        ctypes.c_int)
+        formats = ctypes.c_int()
+        self.glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS, ctypes.byref(formats))
+        if formats.value <= 0:
+            raise OSError("The driver has no program binary formats")
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def load(self, key: str) -> Optional[moderngl.ComputeShader]:
+        """Returns the compute shader stored for key or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                header = json.loads(file.readline())
+                binary = file.read()
+        except (OSError, ValueError):
+            return None
+        shader = self.ctx.compute_shader(PLACEHOLDER_COMPUTE_SHADER)
+        self.glProgramBinary(shader.glo, header["format"], binary, len(binary))
+        linked = ctypes.c_int()
+        self.glGetProgramiv(shader.glo, GL_LINK_STATUS, ctypes.byref(linked))
+        # a binary of an updated driver or a format it dropped
+        if self.ctx.error != "GL_NO_ERROR" or not linked.value:
+            logging.info("Program binary %s was rejected by the driver", key)
+            shader.release()
+            with contextlib.suppress(OSError):
+                os.remove(path)
+            return None
+        shader._members = {}
+        for kind, attributes in header["members"]:
+            member = getattr(moderngl, kind).__new__(getattr(moderngl, kind))
+            vars(member).update(attributes, program_obj=shader.glo, ctx=self.ctx.mglo, extra=None)
+            shader._members[member.name] = member
+        # mark as recently used for eviction
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        return shader
+
+    def store(self, key: str, shader: moderngl.ComputeShader):
+        """Writes the binary of shader, the file appears atomically so readers never see a partial one."""
+        length = ctypes.c_int()
+        self.glGetProgramiv(shader.glo, GL_PROGRAM_BINARY_LENGTH, ctypes.byref(length))
+        if length.value <= 0:
+            return
+        binary = ctypes.create_string_buffer(length.value)
+        written = ctypes.c_int()
+        binary_format = ctypes.c_uint()
+        self.glGetProgramBinary(shader.glo, length, ctypes.byref(written), ctypes.byref(binary_format), binary)
+        members = [(type(member).__name__,
+                    {name: value for name, value in vars(member).items() if name not in MEMBER_RUNTIME_ATTRIBUTES})
+                   for member in shader._members.values()]
+        header = json.dumps({"format": binary_format.value, "members": members})
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            descriptor, temporary = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+            with os.fdopen(descriptor, "wb") as file:
+                file.write(header.encode() + b"\n")
+                file.write(binary.raw[:written.value])
+            os.replace(temporary, self._path(key))
+        except OSError as error:
+            logging.warning("Could not store program binary %s: %s", key, error)
+            return
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used binaries over max_entries."""
+        try:
+            entries = sorted((entry.stat().st_mtime, entry.path) for entry in os.scandir(self.directory)
+                             if entry.name.endswith(".bin"))
+        except OSError:
+            return
+        for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+
+
+class ShaderCache:
+    """
+    Owns every program it compiled until release(), programs
+    returned by get() must not be released by the caller.
+    Every variant get() returns belongs to a slot, the variants a pass uses when it is created
+    inside slot(), otherwise the variant itself, so a variant compiled again from changed
+    sources takes the place of the old one. commit() releases the variants no slot holds
+    anymore and rollback() returns to the committed slots.
+    With binary_dir, compute shaders are stored there and loaded instead of compiled when
+    the driver supports program binaries.
+    """
+
+    def __init__(self, ctx: moderngl.Context, resource_dir, binary_dir=None):
+        self.resource_dir = str(resource_dir)
+        self.driver = "|".join(ctx.info[name] for name in ("GL_VENDOR", "GL_RENDERER", "GL_VERSION"))
+        self.programs: Dict[str, Any] = {}
+        # slot -> keys got in it last, by get() and at the last commit()
+        self.latest: Dict[str, Set[str]] = {}
+        self.committed: Dict[str, Set[str]] = {}
+        # slot of the pass being created, None takes the variant as slot
+        self.current: Optional[str] = None
+        # False inside transient()
+        self.holding = True
+        # programs of shader files outside resource_dir, compiled on every get()
+        self.uncached: List[Any] = []
+        self.binaries: Optional[ProgramBinaries] = None
+        if binary_dir is not None:
+            try:
+                self.binaries = ProgramBinaries(ctx, binary_dir)
+            except OSError as error:
+                logging.info("Compute shaders are compiled from source on every run: %s", error)
+        self.hits = 0
+        self.misses = 0
+        # misses loaded from program binaries instead of compiled
+        self.loaded = 0
+        # seconds spent compiling, per variant description
+        self.compile_times: Dict[str, float] = {}
+
+    def variant(self, kind: str, arguments: Dict[str, Any]) -> str:
+        """Describes the variant by its shader files and arguments, the same for any version of the sources."""
+        defines = arguments.get("defines") or {}
+        other = {name: value for name, value in arguments.items() if name != "defines"}
+        return repr((kind, sorted((str(name), str(value)) for name, value in defines.items()),
+                     sorted((name, str(value)) for name, value in other.items())))
+
+    def key(self, kind: str, arguments: Dict[str, Any]) -> Optional[str]:
+        """Returns the variant key or None if a shader file is not in resource_dir."""
+        digest = hashlib.sha256(f"{kind}|{self.driver}".encode())
+        for name in SHADER_ARGUMENTS:
+            path = arguments.get(name)
+            if path is None:
+                continue
+            try:
+                with open(os.path.join(self.resource_dir, path), "rb") as file:
+                    digest.update(f"|{name}|".encode())
+                    digest.update(file.read())
+            except OSError:
+                return None
+        defines = arguments.get("defines") or {}
+        other = {name: value for name, value in arguments.items() if name not in SHADER_ARGUMENTS + ("defines",)}
+        digest.update(repr((sorted((str(name), str(value)) for name, value in defines.items()),
+                            sorted(other.items()))).encode())
+        return digest.hexdigest()
+
+    @contextlib.contextmanager
+    def slot(self, name: str) -> Iterator[None]:
+        """The variants got inside take the place of the ones got in slot name before."""
+        previous, self.current = self.current, name
+        self.latest[name] = set()
+        try:
+            yield
+        finally:
+            self.current = previous
+
+    @contextlib.contextmanager
+    def transient(self) -> Iterator[None]:
+        """The variants got inside are released by the next commit() unless a slot got them as well."""
+        previous, self.holding = self.holding, False
+        try:
+            yield
+        finally:
+            self.holding = previous
+
+    def _hold(self, key: str, kind: str, arguments: Dict[str, Any]):
+        if not self.holding:
+            return
+        if self.current is not None:
+            self.latest[self.current].add(key)
+        else:
+            self.latest[self.variant(kind, arguments)] = {key}
+
+    def get(self, kind: str, arguments: Dict[str, Any], compile_program: Callable[[], Any]):
+        """Returns the cached variant described by kind and arguments, compiling it on a miss."""
+        key = self.key(kind, arguments)
+        if key is not None and key in self.programs:
+            self.hits += 1
+            self._hold(key, kind, arguments)
+            return self.programs[key]
+        self.misses += 1
+        name = next(str(arguments[name]) for name in SHADER_ARGUMENTS if arguments.get(name))
+        program = None
+        if key is not None and kind == "compute" and self.binaries is not None:
+            program = self.binaries.load(key)
+        if program is not None:
+            self.loaded += 1
+            logging.info("Loaded %s from its program binary", name)
+        else:
+            start = time.perf_counter()
+            program = compile_program()
+            seconds = time.perf_counter() - start
+            description = f"{name} {arguments.get('defines') or ''}".strip()
+            self.compile_times[description] = self.compile_times.get(description, 0.0) + seconds
+            logging.info("Compiled %s in %.1f ms", name, seconds * 1000)
+            if key is not None and kind == "compute" and self.binaries is not None:
+                self.binaries.store(key, program)
+        if key is None:
+            self.uncached.append(program)
+        else:
+            self.programs[key] = program
+            self._hold(key, kind, arguments)
+        return program
+
+    def commit(self, release: bool = True):
+        """
+        Takes the variants the slots got last as the running ones, after a reload swapped its programs.
+        release=False keeps the unused variants for programs that are still running until a later commit().
+        """
+        self.committed = {slot: set(keys) for slot, keys in self.latest.items()}
+        if not release:
+            return
+        held = set().union(*self.latest.values())
+        unused = [key for key in self.programs if key not in held]
+        for key in unused:
+            self.programs.pop(key).release()
+        if unused:
+            logging.info("Released %d unused shader variants", len(unused))
+
+    def rollback(self):
+        """Returns to the committed variants, after a reload that keeps the running programs."""
+        self.latest = {slot: set(keys) for slot, keys in self.committed.items()}
+
+    def report(self):
+        """Logs hits, misses and the time spent compiling."""
+        logging.info("Shader cache: %d hits, %d misses, %d loaded from binaries, %.1f ms compiling",
+                     self.hits, self.misses, self.loaded, sum(self.compile_times.values()) * 1000)
+
+    def release(self):
+        for program in (*self.programs.values(), *self.uncached):
+            program.release()
+        self.programs.clear()
+        self.uncached.clear()
+        self.latest.clear()
+        self.committed.clear()
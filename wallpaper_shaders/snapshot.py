@@ -0,0 +1,184 @@
+"""
+Snapshots of the running simulation, a restarted wallpaper continues from the last
+snapshot instead of building agents from the mask and starting with empty trails.
+A snapshot file is a header followed by the agent buffer, both trail textures and the mask.
+It is written through a memory map on a background thread and memory mapped when loaded.
+"""
+import logging
+import os
+import struct
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import moderngl
+import numpy as np
+
+from wallpaper_shaders.cache import MaskCache
+from wallpaper_shaders.common import CACHE_DIRECTORY
+
+SNAPSHOT_DIRECTORY = CACHE_DIRECTORY.joinpath("snapshots")
+
+MAGIC = b"WPSNAP\0\0"
+# bump when the file layout changes
+SNAPSHOT_VERSION = 1
+# magic, version, width, height, agent count, agent size, odd, key
+HEADER = struct.Struct("<8s6I64s")
+# sections start after the padded header
+HEADER_SIZE = 128
+
+
+class Snapshot(NamedTuple):
+    agents: np.ndarray
+    # rgba8 rows of texture1 and texture2 as read from GL, bottom row first
+    textures: Tuple[np.ndarray, np.ndarray]
+    mask: np.ndarray
+    odd: bool
+
+
+def snapshot_path(config_file: str) -> str:
+    """One snapshot per script, named after its config file."""
+    return os.path.join(SNAPSHOT_DIRECTORY, os.path.splitext(config_file)[0] + ".snapshot")
+
+
+def snapshot_key(image_name: str, size: Tuple[int, int],
+                 color_treshold: Tuple[int, int, int, int], dtype: np.dtype) -> str:
+    """Hash of the config the state depends on, the same as the key of its mask cache entry."""
+    return MaskCache.key(image_name, size, color_treshold, dtype)
+
+
+def section_lengths(size: Tuple[int, int], count: int, dtype: np.dtype) -> List[int]:
+    """Bytes of the agents, texture1, texture2 and mask sections."""
+    image = size[0] * size[1] * 4
+    return [count * dtype.itemsize, image, image, image]
+
+
+def load_snapshot(path: str, key: str, size: Tuple[int, int], dtype: np.dtype) -> Optional[Snapshot]:
+    """Returns the memory mapped snapshot at path or None if it is missing or does not match."""
+    try:
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+    except (OSError, ValueError):
+        # missing or empty
+        return None
+
+    reason = None
+    if len(data) < HEADER_SIZE:
+        reason = "it is truncated"
+    else:
+        magic, version, width, height, count, itemsize, odd, stored_key = HEADER.unpack_from(data)
+        if magic != MAGIC or version != SNAPSHOT_VERSION:
+            reason = "it has an unknown format"
+        elif (width, height) != tuple(size):
+            reason = f"it was made at {width}x{height}"
+        elif itemsize != dtype.itemsize:
+            reason = "it was made with another agent layout"
+        elif stored_key.decode("ascii", "replace") != key:
+            reason = "it was made with another mask or config"
+        elif len(data) != HEADER_SIZE + sum(section_lengths(size, count, dtype)):
+            reason = "it is truncated"
+    if reason is not None:
+        logging.info("Ignoring snapshot %s, %s", path, reason)
+        return None
+
+    sections = []
+    offset = HEADER_SIZE
+    for length in section_lengths(size, count, dtype):
+        sections.append(data[offset:offset + length])
+        offset += length
+    agents, texture1, texture2, mask = sections
+    return Snapshot(agents.view(dtype), (texture1, texture2), mask.reshape(size[1], size[0], 4), bool(odd))
+
+
+def write_snapshot(path: str, header: Sequence, sections: Sequence[np.ndarray]):
+    """Writes header values and uint8 sections, the file is replaced atomically."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    file, temporary = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    os.close(file)
+    try:
+        data = np.memmap(temporary, dtype=np.uint8, mode="w+",
+                         shape=(HEADER_SIZE + sum(len(section) for section in sections),))
+        HEADER.pack_into(data, 0, MAGIC, SNAPSHOT_VERSION, *header)
+        offset = HEADER_SIZE
+        for section in sections:
+            data[offset:offset + len(section)] = section
+            offset += len(section)
+        data.flush()
+        del data
+        os.replace(temporary, path)
+    except OSError as error:
+        logging.warning("Could not write snapshot %s: %s", path, error)
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+
+
+class SnapshotWriter:
+    """
+    Writes snapshots without stalling the frame. capture() copies the GPU state
+    into staging buffers, poll() reads them READ_DELAY frames later when the copies
+    are done and the file is written on a background thread.
+    """
+
+    READ_DELAY = 2
+
+    def __init__(self, ctx: moderngl.Context, path: str):
+        self.ctx = ctx
+        self.path = path
+        self.writer = ThreadPoolExecutor(1, thread_name_prefix="SnapshotWriter")
+        # frames until read back, header values, staging buffers, mask, sampled
+        self.pending = None
+
+    def capture(self, key: str, agent_buffer: moderngl.Buffer, count: int,
+                textures: Sequence[moderngl.Texture], mask: np.ndarray, odd: bool,
+                sampled: Optional[Tuple[np.ndarray, np.ndarray]] = None):
+        """
+        Starts a snapshot, a previous one not read back yet is dropped for the newer state.
+        sampled is (all agents, indices) when agent_buffer holds a sample of all agents,
+        the snapshot stores all of them so it can be resumed with any agent budget.
+        """
+        if count == 0:
+            return
+        if self.pending is not None:
+            for buffer in self.pending[2]:
+                buffer.release()
+        staging = [self.ctx.buffer(reserve=agent_buffer.size)]
+        self.ctx.copy_buffer(staging[0], agent_buffer)
+        for texture in textures:
+            staging.append(self.ctx.buffer(reserve=texture.width * texture.height * 4))
+            texture.read_into(staging[-1])
+        width, height = textures[0].size
+        total = count if sampled is None else len(sampled[0])
+        header = (width, height, total, agent_buffer.size // count, int(odd), key.encode("ascii"))
+        self.pending = [self.READ_DELAY, header, staging, mask, sampled]
+
+    def poll(self, block: bool = False):
+        """Called every frame, hands a captured snapshot to the writer once its copies are done."""
+        if self.pending is None:
+            return
+        self.pending[0] -= 1
+        if self.pending[0] > 0 and not block:
+            return
+        _, header, staging, mask, sampled = self.pending
+        self.pending = None
+        sections = [np.frombuffer(buffer.read(), dtype=np.uint8) for buffer in staging]
+        for buffer in staging:
+            buffer.release()
+        sections.append(np.ascontiguousarray(mask).reshape(-1))
+        self.writer.submit(self._write, header, sections, sampled)
+
+    def _write(self, header: Sequence, sections: List[np.ndarray],
+               sampled: Optional[Tuple[np.ndarray, np.ndarray]]):
+        if sampled is not None:
+            # agents outside of the sample were never simulated and rest where they started
+            all_agents, sample = sampled
+            agents = np.array(all_agents)
+            agents[sample] = sections[0].view(all_agents.dtype)
+            sections[0] = agents.view(np.uint8).reshape(-1)
+        write_snapshot(self.path, header, sections)
+
+    def close(self):
+        """Finishes the captured snapshot and waits for the writes."""
+        self.poll(block=True)
+        self.writer.shutdown(wait=True)
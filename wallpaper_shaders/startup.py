@@ -0,0 +1,66 @@
+"""
+Timed phases of the startup, from launching run.py to the first simulated frame.
+Phases are always recorded, it is only a few perf_counter calls, and logged
+as a breakdown when profiling is enabled with --profile-startup.
+Only the standard library is imported so it can be used before the heavy imports.
+"""
+import contextlib
+import logging
+import threading
+import time
+from typing import Dict, List, Tuple
+
+
+class StartupProfiler:
+    """
+    Phases may overlap, e.g. building agents on a background thread while shaders compile,
+    so each is reported with its start offset and duration.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.enabled = False
+        self.reported = False
+        self._lock = threading.Lock()
+        # imports runs from importing this module until the importer ends it
+        self._open: Dict[str, float] = {"imports": self.start}
+        # name, start, end
+        self.phases: List[Tuple[str, float, float]] = []
+
+    def begin(self, name: str):
+        with self._lock:
+            self._open[name] = time.perf_counter()
+
+    def end(self, name: str):
+        """Ends a phase started with begin(), nothing happens if it was not started."""
+        now = time.perf_counter()
+        with self._lock:
+            start = self._open.pop(name, None)
+            if start is not None:
+                self.phases.append((name, start, now))
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def report(self):
+        """Logs the phases once, the first simulated frame calls this."""
+        if self.reported:
+            return
+        self.reported = True
+        if not self.enabled:
+            return
+        with self._lock:
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+        lines = [f"{name:<24} at {start - self.start:7.3f} s took {end - start:7.3f} s"
+                 for name, start, end in phases]
+        total = max((end for _, _, end in phases), default=self.start) - self.start
+        logging.info("Startup profile, %.3f s in total:\n%s", total, "\n".join(lines))
+
+
+# one per process, run.py enables it
+STARTUP = StartupProfiler()
@@ -0,0 +1,150 @@
+"""
+Recording of the cursor input of a wallpaper and its replay offscreen.
+A trace is a header with the window size followed by one record per frame with
+the frame timestamps and the cursor sample passed to mouse_position_event.
+Replay feeds the records at a fixed timestep, so runs of the same trace simulate
+the same frames and their frame times and checksums can be compared across commits.
+record with: python run.py --record-trace input.trace
+replay with: python -m wallpaper_shaders.trace input.trace --script pixel_particles --backend egl
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+import time
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+MAGIC = b"WPTRACE\0"
+# bump when the record layout changes
+TRACE_VERSION = 1
+# magic, version, window width, window height
+HEADER = struct.Struct("<8s3I")
+TRACE_DTYPE = np.dtype([
+    ("time", "<f8"),
+    ("frame_time", "<f4"),
+    ("position", "<i4", 2),
+    ("delta", "<i4", 2),
+])
+
+
+class TraceRecorder:
+    """Appends one record per frame, records are buffered by the file and flushed on close."""
+
+    def __init__(self, path: str, size: Tuple[int, int]):
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, TRACE_VERSION, *size))
+        self.frames = 0
+
+    def record(self, time: float, frame_time: float, position: Tuple[int, int], delta: Tuple[int, int]):
+        self.file.write(np.array((time, frame_time, position, delta), dtype=TRACE_DTYPE).tobytes())
+        self.frames += 1
+
+    def close(self):
+        self.file.close()
+
+
+def load_trace(path: str) -> Tuple[Tuple[int, int], np.ndarray]:
+    """Returns the window size and records of the trace at path."""
+    with open(path, "rb") as file:
+        data = file.read()
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path} is not a trace")
+    magic, version, width, height = HEADER.unpack_from(data)
+    if magic != MAGIC or version != TRACE_VERSION:
+        raise ValueError(f"{path} is not a version {TRACE_VERSION} trace")
+    # a recording cut short by a crash ends with a partial record
+    count = (len(data) - HEADER.size) // TRACE_DTYPE.itemsize
+    return (width, height), np.frombuffer(data, dtype=TRACE_DTYPE, count=count, offset=HEADER.size)
+
+
+def frame_checksum(render) -> str:
+    """sha256 of the rendered frame."""
+    return hashlib.sha256(render.wnd.fbo.read(components=4)).hexdigest()
+
+
+def save_frame(render, path: str, downsample: int):
+    """Saves the rendered frame as a png scaled down by downsample."""
+    from PIL import Image
+
+    width, height = render.wnd.fbo.size
+    frame = np.frombuffer(render.wnd.fbo.read(components=3), dtype=np.uint8).reshape(height, width, 3)
+    # GL rows start at the bottom
+    image = Image.fromarray(np.ascontiguousarray(frame[::-1]))
+    if downsample > 1:
+        image = image.resize((max(1, width // downsample), max(1, height // downsample)), Image.BILINEAR)
+    image.save(path)
+
+
+def replay(render, records: np.ndarray, frame_time: float, checkpoint_interval: int = 0,
+           frames_directory: Optional[str] = None, downsample: int = 4) -> Dict[str, Any]:
+    """
+    Renders one frame per record at a fixed timestep and returns the frame time statistics.
+    Every checkpoint_interval frames the frame checksum is added and saved to frames_directory.
+    """
+    from wallpaper_shaders.benchmark import frame_statistics
+
+    if frames_directory is not None:
+        os.makedirs(frames_directory, exist_ok=True)
+    frame_times = []
+    checksums = {}
+    for frame, record in enumerate(records):
+        start = time.perf_counter()
+        x, y = (int(value) for value in record["position"])
+        dx, dy = (int(value) for value in record["delta"])
+        render.mouse_position_event(x, y, dx, dy)
+        render.render(frame * frame_time, frame_time)
+        # wait for the GPU so the time covers the whole frame
+        render.ctx.finish()
+        frame_times.append(time.perf_counter() - start)
+
+        if checkpoint_interval and (frame + 1) % checkpoint_interval == 0:
+            checksums[frame] = frame_checksum(render)
+            if frames_directory is not None:
+                save_frame(render, os.path.join(frames_directory, f"frame_{frame:06d}.png"), downsample)
+    return {**frame_statistics(render, frame_times), "checksums": checksums}
+
+
+def main(args: Optional[Sequence[str]] = None):
+    from wallpaper_shaders.benchmark import FRAME_TIME, SCRIPTS, create_headless_render, git_revision, parse_override
+
+    parser = argparse.ArgumentParser(description="Replay a recorded input trace offscreen.")
+    parser.add_argument("trace", help="file recorded with --record-trace")
+    parser.add_argument("--script", default=SCRIPTS[0], choices=SCRIPTS)
+    parser.add_argument("--backend", default=None, help="moderngl context backend, e.g. egl")
+    parser.add_argument("--frame-time", type=float, default=FRAME_TIME, help="fixed timestep in seconds")
+    parser.add_argument("--checkpoint-interval", type=int, default=60,
+                        help="frames between frame checksums, 0 disables them")
+    parser.add_argument("--frames-directory", default=None, help="save the checkpoint frames as png here")
+    parser.add_argument("--downsample", type=int, default=4, help="scale the saved frames down by this factor")
+    parser.add_argument("--output", default=None, help="append the result as a json line to this file")
+    parser.add_argument("--set", type=parse_override, action="append", default=[], metavar="KEY=VALUE",
+                        help="override a config value, e.g. --set active_list=true")
+    values = parser.parse_args(args)
+
+    size, records = load_trace(values.trace)
+    render = create_headless_render(values.script, size, dict(values.set), values.backend)
+    result = {
+        "script": values.script,
+        "trace": os.path.basename(values.trace),
+        "revision": git_revision(),
+        "renderer": render.ctx.info["GL_RENDERER"],
+        "size": list(size),
+        "agents": render.count,
+        "config": dict(values.set),
+        **replay(render, records, values.frame_time, values.checkpoint_interval,
+                 values.frames_directory, values.downsample),
+    }
+    render.close()
+
+    print(json.dumps(result, indent=2))
+    if values.output:
+        with open(values.output, "a") as file:
+            file.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,86 +1,159 @@
 """
 Contains baseclass for all moderngl programs supposed to be run as the wallpaper.
 """
-import ctypes
-from typing import Tuple
+import time
+from typing import Optional, Set
 
+import moderngl
 import moderngl_window as mglw
 
-from wallpaper_shaders.common import RESOURCES_DIRECTORY
-
-user32 = ctypes.WinDLL("user32")
-
-def find_workerw_handle() -> int:
-    """
-    Finds and returns WorkerW window handle.
-    Children of this window will be drawn between the icons and the wallpaper.
-    use ctypes.windll.user32.SetParent to set the window parent
-    """
-    # https://www.codeproject.com/Articles/856020/Draw-Behind-Desktop-Icons-in-Windows-plus
-
-    # Find handle of progman window
-    desktop_handle = user32.GetDesktopWindow()
-    progman = user32.FindWindowExW(desktop_handle, 0, "Progman", 0)
-
-    # Send message to progman to create WorkerW window
-    # 0x0000 - SMTO_NORMAL
-    user32.SendMessageTimeoutW(progman, 0x052C, 0, 0, 0x0000, 1000, 0)
-
-    # Find newly created WorkerW window
-    workerw = []
-
-    def enum_windows_proc(hwnd, _lparam):
-        handle = user32.FindWindowExW(hwnd, 0, "SHELLDLL_DefView", 0)
-        if handle != 0:
-            # hacky way to get workerw value out of this function
-            workerw.append(user32.FindWindowExW(0, hwnd, "WorkerW", 0))
-        return True
-
-    WNDENUMPROC = ctypes.WINFUNCTYPE(ctypes.wintypes.BOOL,
-                                     ctypes.wintypes.HWND,
-                                     ctypes.wintypes.LPARAM)
-    enum_windows_proc_winfunc = WNDENUMPROC(enum_windows_proc)
-
-    user32.EnumWindows(enum_windows_proc_winfunc, 0)
-
-    return workerw.pop()
-
-# Get cursor position
-# https://stackoverflow.com/a/24567802
-class POINT(ctypes.Structure):
-    """Structure to get x, y out of GetCursorPos"""
-    _fields_ = [("x", ctypes.c_long), ("y", ctypes.c_long)]
-
-def get_mouse_position() -> Tuple[int, int]:
-    """Returns the curent mouse position using win api."""
-    point = POINT()
-    user32.GetCursorPos(ctypes.byref(point))
-    return point.x, point.y
+from wallpaper_shaders.common import CONFIG_DIRECTORY, RESOURCES_DIRECTORY
+from wallpaper_shaders.hosts import CursorSampler, Host, get_host
+from wallpaper_shaders.profiling import FrameProfiler
+from wallpaper_shaders.shader_cache import BINARY_DIRECTORY, ShaderCache
+from wallpaper_shaders.startup import STARTUP
+from wallpaper_shaders.trace import TraceRecorder
+from wallpaper_shaders.watcher import FileWatcher
 
 
 class WallpaperWindow(mglw.WindowConfig):
     """
     ``Window Config`` class setup to render as a wallpaper.
     Subclasses should also call super() methods.
+    Loaded programs are cached per variant, subclasses must not release them
+    and release shader_cache before the context instead.
     """
 
     resource_dir = RESOURCES_DIRECTORY
 
     fullscreen = True
-    window_size = user32.GetSystemMetrics(0), user32.GetSystemMetrics(1)
+    # the fullscreen window covers the screen, a wallpaper takes the size of its window
+    window_size = 1920, 1080
     aspect_ratio = None
 
+    # False renders without attaching to the desktop or sampling the cursor, e.g. offscreen
+    wallpaper = True
+
+    # False never sleeps in wait_for_input, e.g. for timed offscreen frames
+    throttle_idle = True
+
+    # simulation steps per second independent of the display refresh rate, see simulation_steps
+    simulation_rate = 60.0
+    # steps one frame may catch up, time beyond that is dropped
+    max_substeps = 4
+
     def __init__(self, **kwargs):
+        STARTUP.end("context creation")
         super().__init__(**kwargs)
-        # This is a bit hacky
-        user32.SetParent(self.wnd._window._hwnd, find_workerw_handle())
-        self._prev_mouse_position = get_mouse_position()
+        if getattr(self.argv, "profile_startup", False):
+            STARTUP.enabled = True
+        self.shader_cache = ShaderCache(self.ctx, self.resource_dir, BINARY_DIRECTORY)
+        # argv is only set when started through run_window_config
+        self.profiler = FrameProfiler(
+            self.ctx,
+            enabled=getattr(self.argv, "profile", False),
+            log_interval=getattr(self.argv, "profile_interval", 5.0),
+            output=getattr(self.argv, "profile_output", None),
+        )
+        # simulation time not stepped yet, None until the first frame
+        self.accumulator = None
+        # steps due this frame
+        self.steps = 0
+        self.watcher = None
+        if getattr(self.argv, "watch", False):
+            self.watcher = FileWatcher([CONFIG_DIRECTORY, RESOURCES_DIRECTORY]).start()
+        # platform backend, set WALLPAPER_HOST to override
+        self.host: Optional[Host] = None
+        self.cursor = None
+        self.trace = None
+        if not self.wallpaper:
+            return
+        self.host = get_host()
+        self.window_size = tuple(self.wnd.size)
+        self.host.attach(self.wnd)
+        self.cursor = CursorSampler(self.host).start()
+        trace_path = getattr(self.argv, "record_trace", None)
+        if trace_path is not None:
+            self.trace = TraceRecorder(trace_path, self.window_size)
+
+    @classmethod
+    def add_arguments(cls, parser):
+        """Add commmand line arguments"""
+        parser.add_argument("--profile", action="store_true",
+                            help="time every render stage on the CPU and GPU")
+        parser.add_argument("--profile-interval", type=float, default=5.0,
+                            help="seconds between logged averages, 0 disables logging")
+        parser.add_argument("--profile-output", default=None,
+                            help="json file to dump the profile to on close")
+        parser.add_argument("--profile-startup", action="store_true",
+                            help="log how long each startup phase took")
+        parser.add_argument("--watch", action="store_true",
+                            help="hot reload changed configs and shaders")
+        parser.add_argument("--record-trace", default=None,
+                            help="record the cursor input of every frame to this file for replay")
+
+    def load_program(self, path=None, **kwargs) -> moderngl.Program:
+        return self.shader_cache.get("program", {"path": path, **kwargs},
+                                     lambda: super(WallpaperWindow, self).load_program(path, **kwargs))
+
+    def load_compute_shader(self, path, defines=None, **kwargs) -> moderngl.ComputeShader:
+        return self.shader_cache.get("compute", {"path": path, "defines": defines, **kwargs},
+                                     lambda: super(WallpaperWindow, self).load_compute_shader(path, defines, **kwargs))
 
     def render(self, time: float, frame_time: float):
+        self.profiler.begin_frame()
+        if self.watcher is not None:
+            changed = self.watcher.take()
+            if changed:
+                self.reload(changed)
+        self.steps = self.simulation_steps(frame_time)
+        # without a step the cursor movement is left to the next simulated frame
+        if self.cursor is None or not self.steps:
+            return
         # support for all events should be added
-        mouse_position = get_mouse_position()
-        self.mouse_position_event(mouse_position[0],
-                                  mouse_position[1],
-                                  mouse_position[0] - self._prev_mouse_position[0],
-                                  mouse_position[1] - self._prev_mouse_position[1])
-        self._prev_mouse_position = mouse_position
+        with self.profiler.stage("cursor", gpu=False):
+            mouse_position, delta = self.cursor.take()
+            if self.trace is not None:
+                self.trace.record(time, frame_time, mouse_position, delta)
+            self.mouse_position_event(mouse_position[0], mouse_position[1], delta[0], delta[1])
+
+    def simulation_steps(self, frame_time: float) -> int:
+        """
+        Advances the simulation clock by frame_time, returns the number of steps due.
+        Frames of displays faster than simulation_rate get no step and show the last simulated frame.
+        """
+        if self.accumulator is None:
+            # the first frame always simulates so there is something to show
+            self.accumulator = 0.0
+            return 1
+        self.accumulator += frame_time
+        # tolerance so frame times of exactly one step do not alternate between 0 and 2 steps
+        steps = int(self.accumulator * self.simulation_rate + 1e-6)
+        self.accumulator -= steps / self.simulation_rate
+        if steps > self.max_substeps:
+            steps = self.max_substeps
+            self.accumulator = 0.0
+        return steps
+
+    def reload(self, paths: Set[str]):
+        """Called at the start of a frame with files changed in config/ or resources/ when watching."""
+        return
+
+    def wait_for_input(self, timeout: float):
+        """Sleeps for up to timeout seconds, returns early when the cursor moves."""
+        if not self.throttle_idle:
+            return
+        if self.cursor is None:
+            time.sleep(timeout)
+        else:
+            self.cursor.wait_moved(timeout)
+
+    def close(self):
+        self.profiler.close()
+        if self.watcher is not None:
+            self.watcher.stop()
+        if self.cursor is not None:
+            self.cursor.stop()
+        if self.trace is not None:
+            self.trace.close()
+        return super().close()
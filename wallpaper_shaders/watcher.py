@@ -0,0 +1,66 @@
+"""
+Polling file watcher used to hot reload configs and shaders.
+Polling needs no platform specific APIs and a few stat calls
+every half a second are negligible next to rendering.
+"""
+import os
+import threading
+from typing import Dict, Iterable, Set, Tuple
+
+
+class FileWatcher:
+    """
+    Watches all files directly in directories on a background thread.
+    Changed, created and removed files are collected until take() is called.
+    """
+
+    def __init__(self, directories: Iterable, interval: float = 0.5):
+        self.directories = [str(directory) for directory in directories]
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._changed: Set[str] = set()
+        self._files = self._snapshot()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="FileWatcher", daemon=True)
+
+    def _snapshot(self) -> Dict[str, Tuple[int, int]]:
+        """Returns path -> (modification time, size) of every watched file."""
+        files = {}
+        for directory in self.directories:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+                except OSError:
+                    # removed between scandir and stat
+                    continue
+        return files
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            files = self._snapshot()
+            changed = {path for path in files.keys() | self._files.keys() if files.get(path) != self._files.get(path)}
+            self._files = files
+            if changed:
+                with self._lock:
+                    self._changed |= changed
+
+    def take(self) -> Set[str]:
+        """Returns paths changed since the previous take."""
+        with self._lock:
+            changed, self._changed = self._changed, set()
+        return changed
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()